@@ -0,0 +1,390 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+import httpx
+
+from app.core.cache import LLMCache
+from app.core.circuit import LLMUnavailableError
+from app.core.config import config
+from app.core.logger import logger
+
+# 批处理任务的终止状态（与 OpenAI Batch API 的状态名一致）
+TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+# 过期的任务仍可能返回已完成部分的结果
+RESULT_STATES = ("completed", "expired")
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class BatchTransport(ABC):
+    """
+    批处理接口的传输层：提交 JSONL 请求文件、查询任务状态、取回结果文件
+
+    请求文件每行为 {"custom_id", "method": "POST", "url": "/v1/chat/completions", "body": 请求体}，
+    结果文件每行为 {"custom_id", "response": {"status_code", "body"}, "error"}，格式与 OpenAI Batch API 一致。
+    缺少任一抽象方法的传输层在创建时即报错，而不是在某个波次中途失败。
+    """
+
+    @abstractmethod
+    async def submit(self, input_path: str) -> str:
+        """提交请求文件，返回任务 ID"""
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> str:
+        """返回任务状态（OpenAI Batch API 的状态名）"""
+
+    @abstractmethod
+    async def fetch(self, batch_id: str, output_path: str) -> None:
+        """把任务结果写入 output_path"""
+
+    async def aclose(self):
+        pass
+
+
+class OpenAIBatchTransport(BatchTransport):
+    """OpenAI 兼容的 /files + /batches 接口"""
+
+    def __init__(self, base_url: str, api_key: str, completion_window: str = "24h", transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.completion_window = completion_window
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        # 最近一次查询到的任务信息，取结果时需要其中的文件 ID
+        self._batches: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_config(cls, base_url: str, api_key: str) -> "OpenAIBatchTransport":
+        return cls(base_url, api_key, completion_window=config.BATCH_COMPLETION_WINDOW)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=300, transport=self.transport)
+        return self._client
+
+    async def submit(self, input_path: str) -> str:
+        client = self._get_client()
+        with open(input_path, "rb") as f:
+            resp = await client.post(f"{self.base_url}/files", headers=self.headers, data={"purpose": "batch"},
+                                     files={"file": (os.path.basename(input_path), f, "application/jsonl")})
+        resp.raise_for_status()
+        resp = await client.post(f"{self.base_url}/batches", headers=self.headers, json={
+            "input_file_id": resp.json()["id"],
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": self.completion_window,
+        })
+        resp.raise_for_status()
+        return resp.json()["id"]
+
+    async def status(self, batch_id: str) -> str:
+        resp = await self._get_client().get(f"{self.base_url}/batches/{batch_id}", headers=self.headers)
+        resp.raise_for_status()
+        info = resp.json()
+        self._batches[batch_id] = info
+        return info.get("status", "")
+
+    async def fetch(self, batch_id: str, output_path: str) -> None:
+        if batch_id not in self._batches:
+            await self.status(batch_id)
+        info = self._batches[batch_id]
+        client = self._get_client()
+        with open(output_path, "wb") as out:
+            # 失败的请求单独记录在 error_file_id 中，两个文件合并后按 custom_id 对应
+            for key in ("output_file_id", "error_file_id"):
+                file_id = info.get(key)
+                if not file_id:
+                    continue
+                resp = await client.get(f"{self.base_url}/files/{file_id}/content", headers=self.headers)
+                resp.raise_for_status()
+                content = resp.content
+                out.write(content if content.endswith(b"\n") or not content else content + b"\n")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class LocalBatchTransport(BatchTransport):
+    """
+    基于本地目录的批处理替身，用于测试和离线调试
+
+    submit 把请求文件复制到 directory/<任务 ID>/input.jsonl；首次查询状态时由 handler(请求体)
+    逐行生成响应体（可以是协程函数），写入同目录的 output.jsonl。handler 抛出异常的请求在结果中记为错误。
+    """
+
+    def __init__(self, directory: str, handler: Callable[[Dict[str, Any]], Union[Dict[str, Any], Awaitable]]):
+        self.directory = directory
+        self.handler = handler
+        self.submitted: List[str] = []
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    async def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            data = f.read()
+        batch_id = f"local-{hashlib.sha1(data).hexdigest()[:16]}"
+        os.makedirs(os.path.join(self.directory, batch_id), exist_ok=True)
+        with open(self._path(batch_id, "input.jsonl"), "wb") as f:
+            f.write(data)
+        self.submitted.append(batch_id)
+        return batch_id
+
+    async def status(self, batch_id: str) -> str:
+        if not os.path.exists(self._path(batch_id, "input.jsonl")):
+            return "failed"
+        if not os.path.exists(self._path(batch_id, "output.jsonl")):
+            await self._execute(batch_id)
+        return "completed"
+
+    async def _execute(self, batch_id: str):
+        lines = []
+        with open(self._path(batch_id, "input.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    body = self.handler(request["body"])
+                    if inspect.isawaitable(body):
+                        body = await body
+                    record = {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body},
+                              "error": None}
+                except Exception as e:
+                    record = {"custom_id": request["custom_id"], "response": None,
+                              "error": {"message": str(e)}}
+                lines.append(json.dumps(record, ensure_ascii=False))
+        with open(self._path(batch_id, "output.jsonl"), "w", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+    async def fetch(self, batch_id: str, output_path: str) -> None:
+        with open(self._path(batch_id, "output.jsonl"), "rb") as src, open(output_path, "wb") as dst:
+            dst.write(src.read())
+
+
+class _Request:
+    __slots__ = ("payload", "future", "prompt", "cache_key", "attempts")
+
+    def __init__(self, payload: Dict[str, Any], future: asyncio.Future, prompt: str, cache_key: Optional[str]):
+        self.payload = payload
+        self.future = future
+        self.prompt = prompt
+        self.cache_key = cache_key
+        self.attempts = 0
+
+
+class BatchLLM:
+    """
+    按波次提交批处理接口的 AsyncLLM 替身
+
+    run() 并发执行一组协程，协程中的 call_llm_advanced 只登记请求并等待结果；
+    连续 settle_delay 秒既没有新请求也没有协程结束时，认为所有协程都在等待 LLM 响应，把这一轮的请求写入 JSONL 文件提交，轮询到任务完成后
+    按 custom_id 把结果交回各自的协程，协程继续执行下一阶段。各阶段的生成和解析逻辑与在线模式相同，
+    问题 -> 答案（含思维链、标签）-> 优化因此自然形成先后多个波次。
+
+    请求文件按内容哈希命名并保存在 work_dir 中，进程中断后重新运行时，内容相同的波次直接复用
+    已提交的任务或已取回的结果。失败的请求在下一波次重试 retries 次，仍失败时与在线模式一样返回后备响应。
+    其余属性（stats、cache 等）转发给被包装的 AsyncLLM。
+    """
+
+    def __init__(self, llm, transport: BatchTransport, work_dir: str, poll_interval: float = 30,
+                 max_requests: int = 50000, retries: int = 1, settle_delay: float = 0.5):
+        self.llm = llm
+        self.transport = transport
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.settle_delay = settle_delay
+        self.max_requests = max(1, max_requests)
+        self.retries = retries
+        self.waves = 0
+        self.requests = 0
+        self.failed = 0
+        self._pending: Dict[str, _Request] = {}
+        self._serial = 0
+        self._finished = 0
+        # 登记新请求或协程结束时置位，用于判断本波次的请求是否已经登记完
+        self._activity: Optional[asyncio.Event] = None
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    async def call_llm_advanced(self, prompt, max_tokens=2048*2, return_exceptions=False, **kwargs):
+        """登记一个请求并等待所在波次完成；重试、超时等参数由批处理接口负责，这里忽略"""
+        self.llm.error_budget.check()
+        payload = self.llm._build_payload(prompt, max_tokens)
+        cache_key = None
+        if self.llm.cache is not None:
+            cache_key = LLMCache.make_key(payload)
+            cached = self.llm.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        future = asyncio.get_running_loop().create_future()
+        self._serial += 1
+        self._pending[f"req-{self._serial}"] = _Request(payload, future, prompt, cache_key)
+        if self._activity is not None:
+            self._activity.set()
+        result = await future
+        failed = isinstance(result, Exception)
+        self.llm.error_budget.record(not failed)
+        if not failed or return_exceptions:
+            return result
+        if self.llm.error_budget.enabled:
+            raise LLMUnavailableError(str(result)) from result
+        return self.llm._fallback_response(prompt)
+
+    def stats(self) -> dict:
+        stats = self.llm.stats()
+        stats["batch"] = {"waves": self.waves, "requests": self.requests, "failed": self.failed}
+        return stats
+
+    async def run(self, coros: Iterable[Awaitable]) -> List[Any]:
+        """执行所有协程并按顺序返回结果"""
+        self._activity = asyncio.Event()
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        for task in tasks:
+            task.add_done_callback(self._on_finished)
+        try:
+            while self._finished < len(tasks):
+                await self._settle()
+                if self._finished >= len(tasks):
+                    break
+                # 协程抛出的异常（如错误预算耗尽）立即终止，不再提交后续波次
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+                if self._pending:
+                    await self._submit_wave()
+                else:
+                    # 有协程在等待 LLM 以外的事件
+                    await asyncio.wait([t for t in tasks if not t.done()], timeout=0.05,
+                                       return_when=asyncio.FIRST_COMPLETED)
+            return [task.result() for task in tasks]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _on_finished(self, _task):
+        self._finished += 1
+        self._activity.set()
+
+    async def _settle(self):
+        """
+        等待连续 settle_delay 秒既没有新请求也没有协程结束，即所有协程都在等待结果
+
+        按时间而不是事件循环的轮数判断，协程等待线程池、文件读写等真实 I/O 时不会把一个阶段拆成多个波次。
+        """
+        while True:
+            self._activity.clear()
+            try:
+                await asyncio.wait_for(self._activity.wait(), self.settle_delay)
+            except asyncio.TimeoutError:
+                return
+
+    async def _submit_wave(self):
+        requests, self._pending = self._pending, {}
+        self.waves += 1
+        ids = list(requests)
+        parts = [ids[i:i + self.max_requests] for i in range(0, len(ids), self.max_requests)]
+        logger.info(f"批处理第 {self.waves} 波: {len(ids)} 个请求, {len(parts)} 个任务")
+        outcomes: Dict[str, Any] = {}
+        for part_outcomes in await asyncio.gather(*(self._run_batch(part, requests) for part in parts)):
+            outcomes.update(part_outcomes)
+
+        for custom_id in ids:
+            request = requests[custom_id]
+            outcome = outcomes.get(custom_id)
+            if isinstance(outcome, dict):
+                self.requests += 1
+                self.llm._record_usage(outcome)
+                if request.cache_key is not None:
+                    self.llm.cache.set(request.cache_key, outcome)
+                request.future.set_result(outcome)
+            elif request.attempts < self.retries:
+                request.attempts += 1
+                self._pending[custom_id] = request
+            else:
+                self.requests += 1
+                self.failed += 1
+                request.future.set_result(outcome or RuntimeError("批处理结果中缺少该请求"))
+        if self._pending:
+            logger.warning(f"批处理第 {self.waves} 波有 {len(self._pending)} 个请求失败，将在下一波重试")
+
+    async def _run_batch(self, ids: List[str], requests: Dict[str, _Request]) -> Dict[str, Any]:
+        """提交一个请求文件并等待结果，返回 {custom_id: 响应体或异常}"""
+        content = "".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT,
+                                      "body": requests[custom_id].payload}, ensure_ascii=False) + "\n"
+                          for custom_id in ids)
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+        os.makedirs(self.work_dir, exist_ok=True)
+        base = os.path.join(self.work_dir, f"batch-{digest}")
+        output_path = f"{base}.output.jsonl"
+        if os.path.exists(output_path):
+            logger.info(f"复用已取回的批处理结果: {output_path}")
+            return self._read_output(output_path)
+
+        try:
+            batch_id = self._read_batch_id(f"{base}.id")
+            if batch_id is None:
+                with open(f"{base}.jsonl", "w", encoding="utf-8") as f:
+                    f.write(content)
+                batch_id = await self.transport.submit(f"{base}.jsonl")
+                with open(f"{base}.id", "w", encoding="utf-8") as f:
+                    f.write(batch_id)
+                logger.info(f"已提交批处理任务 {batch_id}: {len(ids)} 个请求")
+            else:
+                logger.info(f"继续等待已提交的批处理任务 {batch_id}")
+            status = await self._wait(batch_id)
+            if status not in RESULT_STATES:
+                logger.error(f"批处理任务 {batch_id} 结束状态为 {status}")
+                os.remove(f"{base}.id")
+                return {custom_id: RuntimeError(f"批处理任务 {batch_id} {status}") for custom_id in ids}
+            await self.transport.fetch(batch_id, f"{output_path}.part")
+            os.replace(f"{output_path}.part", output_path)
+        except Exception as e:
+            logger.error(f"批处理任务执行失败: {str(e)}")
+            return {custom_id: e for custom_id in ids}
+        return self._read_output(output_path)
+
+    @staticmethod
+    def _read_batch_id(path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+
+    async def _wait(self, batch_id: str) -> str:
+        while True:
+            try:
+                status = await self.transport.status(batch_id)
+            except Exception as e:
+                logger.warning(f"查询批处理任务 {batch_id} 状态失败: {str(e)}")
+                status = ""
+            if status in TERMINAL_STATES:
+                return status
+            logger.debug(f"批处理任务 {batch_id} 状态: {status or '未知'}")
+            await asyncio.sleep(self.poll_interval)
+
+    @staticmethod
+    def _read_output(path: str) -> Dict[str, Any]:
+        outcomes: Dict[str, Any] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                custom_id = record.get("custom_id")
+                response = record.get("response") or {}
+                body = response.get("body")
+                if response.get("status_code") == 200 and isinstance(body, dict):
+                    outcomes[custom_id] = body
+                else:
+                    outcomes[custom_id] = RuntimeError(f"批处理请求失败: {record.get('error') or body}")
+        return outcomes
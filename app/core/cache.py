@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.core.config import config
+from app.core.logger import logger
+
+
+class SQLiteCache:
+    """
+    基于 SQLite 的持久化键值缓存，值以 JSON 存储
+
+    支持按总大小的 LRU 淘汰、TTL 过期和只读模式。子类通过 table / label 区分各自的缓存表。
+    命中时只在内存中记录访问时间，积累 flush_every 条后（或写入、淘汰、关闭时）批量写回，
+    避免每次命中都提交一次事务。
+    """
+
+    table = "cache"
+    label = "缓存"
+    flush_every = 256
+
+    def __init__(self, path: str, max_bytes: int = 0, ttl: float = 0, read_only: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._conn = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disabled = False
+        # 尚未写回的访问时间 {key: accessed}
+        self._accessed: Dict[str, float] = {}
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._conn is not None or self._disabled:
+            return self._conn
+        try:
+            if self.read_only:
+                if not os.path.exists(self.path):
+                    logger.warning(f"只读模式下{self.label}文件不存在: {self.path}")
+                    self._disabled = True
+                    return None
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, timeout=30)
+            else:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # 多个解析进程可能同时写入同一个缓存文件，等待锁而不是立即失败
+                conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_accessed ON {self.table}(accessed)")
+                if self.ttl:
+                    conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.ttl,))
+                conn.commit()
+            self._size = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+            self._conn = conn
+            logger.info(f"{self.label}已启用: {self.path} (只读: {self.read_only})")
+        except Exception as e:
+            logger.error(f"打开{self.label}失败，已禁用缓存: {str(e)}")
+            self._disabled = True
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                value, created = row
+                now = time.time()
+                if self.ttl and created < now - self.ttl:
+                    if not self.read_only:
+                        self._delete(conn, key)
+                        conn.commit()
+                    self.misses += 1
+                    return None
+                if not self.read_only:
+                    self._accessed[key] = now
+                    if len(self._accessed) >= self.flush_every:
+                        self._flush_accessed(conn)
+                        conn.commit()
+                self.hits += 1
+                return json.loads(value)
+            except Exception as e:
+                logger.warning(f"读取{self.label}失败: {str(e)}")
+                self.misses += 1
+                return None
+
+    def set(self, key: str, value: Any):
+        if self.read_only:
+            return
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                data = json.dumps(value, ensure_ascii=False)
+                size = len(data.encode("utf-8"))
+                now = time.time()
+                self._delete(conn, key)
+                self._accessed.pop(key, None)
+                conn.execute(
+                    f"INSERT INTO {self.table} (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, data, size, now, now),
+                )
+                self._size += size
+                self.writes += 1
+                if self.max_bytes and self._size > self.max_bytes:
+                    # 淘汰前写回访问时间，按真实的最近访问顺序淘汰
+                    self._flush_accessed(conn)
+                    self._evict(conn)
+                conn.commit()
+            except Exception as e:
+                logger.warning(f"写入{self.label}失败: {str(e)}")
+
+    def _flush_accessed(self, conn: sqlite3.Connection):
+        """把内存中记录的访问时间批量写回（不提交）"""
+        if self._accessed:
+            conn.executemany(f"UPDATE {self.table} SET accessed = ? WHERE key = ?",
+                             [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _delete(self, conn: sqlite3.Connection, key: str):
+        row = conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._size -= row[0]
+
+    def _evict(self, conn: sqlite3.Connection):
+        """按最近访问时间淘汰，直到总大小回落到上限的 90%"""
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed ASC LIMIT 256").fetchall()
+            if not rows:
+                self._size = 0
+                break
+            for key, size in rows:
+                if self._size <= target:
+                    break
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._flush_accessed(self._conn)
+                    self._conn.commit()
+                except Exception as e:
+                    logger.warning(f"写回{self.label}访问时间失败: {str(e)}")
+                    self._accessed.clear()
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "size_bytes": self._size,
+        }
+
+
+class LLMCache(SQLiteCache):
+    """
+    持久化 LLM 响应缓存
+
+    以请求内容（模型、系统提示、消息、采样参数）的哈希为键，重复构建同一语料时
+    直接返回已有响应。
+    """
+
+    table = "llm_cache"
+    label = "LLM 响应缓存"
+
+    @classmethod
+    def from_config(cls) -> "LLMCache":
+        return cls(
+            path=config.LLM_CACHE_PATH,
+            max_bytes=config.LLM_CACHE_MAX_SIZE,
+            ttl=config.LLM_CACHE_TTL,
+            read_only=config.LLM_CACHE_READ_ONLY,
+        )
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """根据影响输出的请求字段生成缓存键"""
+        keyed = {
+            "model": payload.get("model"),
+            "messages": payload.get("messages"),
+            "temperature": payload.get("temperature"),
+            "top_p": payload.get("top_p"),
+            "max_tokens": payload.get("max_tokens"),
+        }
+        raw = json.dumps(keyed, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ParseCache(SQLiteCache):
+    """
+    文档解析结果缓存
+
+    提取出的文本以文件内容哈希为键，与文件路径无关；文档块列表的键还包含
+    文件路径和分块参数。语料大部分未变化时，重新运行几乎不需要再次解析。
+    """
+
+    table = "parse_cache"
+    label = "文档解析缓存"
+    # 分块逻辑变化时递增，使旧的分块结果失效
+    version = 1
+
+    @classmethod
+    def from_config(cls) -> "ParseCache":
+        return cls(path=config.PARSE_CACHE_PATH, max_bytes=config.PARSE_CACHE_MAX_SIZE)
+
+    @staticmethod
+    def file_digest(path: str, block_size: int = 1024 * 1024) -> str:
+        """计算文件内容的 sha256"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @classmethod
+    def make_key(cls, kind: str, digest: str, **params: Any) -> str:
+        """根据缓存类型（text / chunks）、文件哈希和影响结果的参数生成缓存键"""
+        raw = json.dumps({"kind": kind, "digest": digest, "version": cls.version, **params},
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from app.core.logger import logger
+
+
+def chunk_key(chunk: Dict[str, Any]) -> str:
+    """文档块的稳定标识：chunk_id 加内容哈希，内容变化后不会误用旧结果"""
+    content = chunk.get('content', '')
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+    return f"{chunk.get('chunk_id', '')}:{digest}"
+
+
+def question_hash(question: str) -> str:
+    return hashlib.sha1(question.encode('utf-8')).hexdigest()[:16]
+
+
+class CheckpointJournal:
+    """
+    只追加的构建检查点日志 (JSONL)
+
+    每行一条记录：
+    - {"type": "questions", "chunk": <chunk_key>, "questions": [...]}  某文档块已生成的问题
+    - {"type": "item", "chunk": <chunk_key>, "question": <question_hash>, "data": {...}}  已完成的数据点
+    每条记录写入后立即 flush，进程崩溃最多丢失最后一行；恢复时忽略残缺行。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.questions: Dict[str, List[str]] = {}
+        self.items: Dict[tuple, Dict[str, Any]] = {}
+        self._file = None
+
+    def load(self) -> "CheckpointJournal":
+        """读取已有日志"""
+        if not os.path.exists(self.path):
+            return self
+        skipped = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    skipped += 1
+                    continue
+                if record.get('type') == 'questions':
+                    self.questions[record['chunk']] = record['questions']
+                elif record.get('type') == 'item':
+                    self.items[(record['chunk'], record['question'])] = record['data']
+        logger.info(f"已加载检查点 {self.path}: {len(self.questions)} 个文档块, {len(self.items)} 个数据点"
+                    + (f", 忽略 {skipped} 行残缺记录" if skipped else ""))
+        return self
+
+    def _append(self, record: Dict[str, Any]):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def get_questions(self, key: str) -> Optional[List[str]]:
+        return self.questions.get(key)
+
+    def record_questions(self, key: str, questions: List[str]):
+        self._append({"type": "questions", "chunk": key, "questions": list(questions)})
+
+    def get_item(self, key: str, question: str) -> Optional[Dict[str, Any]]:
+        return self.items.get((key, question_hash(question)))
+
+    def record_item(self, key: str, question: str, data: Dict[str, Any]):
+        self._append({"type": "item", "chunk": key, "question": question_hash(question), "data": data})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
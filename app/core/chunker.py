@@ -0,0 +1,270 @@
+import re
+from collections import deque
+from typing import Iterable, Iterator, Optional, Tuple
+
+# 句子结束符：每个结束符之后都是一个切分点，与 re.split(r'(?<=[。！？.!?])', text) 一致
+SENTENCE_END = re.compile(r'[。！？.!?]')
+_NON_SPACE = re.compile(r'\S')
+
+
+def sentence_spans(text: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+    """
+    惰性产出 text[start:end] 中每个句子的 (起始, 结束) 偏移
+
+    每个句子以结束符收尾，最后一段可能没有结束符；不会产出空区间。
+    """
+    if end is None:
+        end = len(text)
+    pos = start
+    for match in SENTENCE_END.finditer(text, start, end):
+        yield pos, match.end()
+        pos = match.end()
+    if pos < end:
+        yield pos, end
+
+
+def pack_sentences(text: str, max_len: int, compat: bool = True) -> Iterator[str]:
+    """
+    把句子依次装入不超过 max_len 的块（不重叠），用于拆分过长的 Markdown 段落
+
+    compat=True 时与旧实现逐字一致：首个句子超长时会先产出一个空块，超长句子整体保留；
+    compat=False 时不产出空块，超长句子按 max_len 硬切分。
+    """
+    start = end = 0
+    for s, e in sentence_spans(text):
+        pieces = [(s, e)] if compat else _hard_split(s, e, max_len)
+        for s, e in pieces:
+            if (end - start) + (e - s) > max_len and (compat or end > start):
+                yield text[start:end]
+                start = s
+            elif end == start:
+                start = s
+            end = e
+    if end > start:
+        yield text[start:end]
+
+
+def _hard_split(start: int, end: int, size: int) -> Iterator[Tuple[int, int]]:
+    while end - start > size:
+        yield start, start + size
+        start += size
+    yield start, end
+
+
+def _pending_sentences(buf: str, pos: int, final: bool) -> Iterator[Tuple[int, int, bool]]:
+    """
+    产出 buf[pos:] 中待处理的句子 (起始, 结束, 是否以结束符收尾)
+
+    非最后一段时，末尾未结束的句子留到下一个片段；只含空白的末句被跳过。
+    """
+    for match in SENTENCE_END.finditer(buf, pos):
+        yield pos, match.end(), True
+        pos = match.end()
+    if final and pos < len(buf) and _NON_SPACE.search(buf, pos) is not None:
+        yield pos, len(buf), False
+
+
+class TextChunker:
+    """
+    基于偏移量的线性时间文本分块器
+
+    按句子累积文本，超过 chunk_size 时输出一个块，并按 chunk_overlap 保留重叠部分。
+    当前块只以 (起始, 结束) 偏移表示，输出时才切片，不做字符串拼接；
+    split_stream 逐段读取输入，只保留当前块和未结束的句子，内存占用与输入大小无关。
+
+    compat=True 时与旧版 _split_text 的输出逐字一致（包括其重叠规则：块末尾的
+    chunk_overlap 个字符内有结束符时从该结束符之后开始重叠，因此以句子结尾的块通常没有重叠）。
+    compat=False 时：
+    - 重叠由块末尾若干完整句子组成，总长度不超过 chunk_overlap；末句本身过长时取末尾 chunk_overlap 个字符
+    - 超过 chunk_size 的句子按 chunk_size 硬切分，重叠加新句子超长时放弃重叠，块长度不会超过 chunk_size
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int = 0, compat: bool = True):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.compat = compat
+
+    def split(self, text: str) -> Iterator[str]:
+        """对完整文本分块"""
+        return self.split_stream([text])
+
+    def split_stream(self, blocks: Iterable[str]) -> Iterator[str]:
+        """对按顺序到达的文本片段分块，片段边界可以落在句子中间"""
+        for chunk, _, _ in self.split_spans(blocks):
+            yield chunk
+
+    def split_spans(self, blocks: Iterable[str]) -> Iterator[Tuple[str, int, int]]:
+        """与 split_stream 相同，同时产出每个块在整个输入中的 (起始, 结束) 偏移"""
+        size = self.chunk_size
+        buf = ""
+        # buf[0] 在整个输入中的偏移
+        base = 0
+        # 当前块为 buf[cs:ce]；pos 之前的句子都已处理；last_end 为最后一个结束符的位置；
+        # starts 记录当前块内各句子的起点（仅非兼容模式计算重叠时使用）
+        cs = ce = pos = 0
+        last_end = -1
+        starts = deque()
+        emitted = False
+        pending = iter(blocks)
+        final = False
+        while not final:
+            block = next(pending, None)
+            if block is None:
+                final = True
+            elif not block:
+                continue
+            else:
+                # 丢弃当前块之前已处理的文本，偏移随之平移
+                keep = cs if ce > cs else pos
+                if keep:
+                    buf = buf[keep:]
+                    base += keep
+                    cs, ce, pos, last_end = cs - keep, ce - keep, pos - keep, last_end - keep
+                    if ce < 0:
+                        cs = ce = 0
+                    for i in range(len(starts)):
+                        starts[i] -= keep
+                buf += block
+
+            for s, e, terminated in self._pieces(buf, pos, final):
+                pos = e
+                if (ce - cs) + (e - s) > size and ce > cs:
+                    emitted = True
+                    yield buf[cs:ce], base + cs, base + ce
+                    cs = self._overlap_start(cs, ce, last_end, starts)
+                    if not self.compat:
+                        if (ce - cs) + (e - s) > size:
+                            cs = ce
+                        while starts and starts[0] < cs:
+                            starts.popleft()
+                if ce == cs:
+                    cs = s
+                    starts.clear()
+                if not self.compat:
+                    starts.append(s)
+                ce = e
+                if terminated:
+                    last_end = e - 1
+
+        if ce > cs:
+            emitted = True
+            yield buf[cs:ce], base + cs, base + ce
+
+        # 只有空白内容时退回到按字符定长切分
+        if not emitted and buf:
+            step = max(1, size - self.chunk_overlap)
+            for i in range(0, len(buf), step):
+                yield buf[i:i + size], base + i, base + min(i + size, len(buf))
+
+    def _pieces(self, buf: str, pos: int, final: bool) -> Iterator[Tuple[int, int, bool]]:
+        """待处理的句子；非兼容模式下超长句子被硬切分"""
+        if self.compat:
+            yield from _pending_sentences(buf, pos, final)
+            return
+        size = self.chunk_size
+        for start, end, terminated in _pending_sentences(buf, pos, final):
+            if end - start > size:
+                for s, e in _hard_split(start, end, size):
+                    yield s, e, terminated and e == end
+            else:
+                yield start, end, terminated
+
+    def _overlap_start(self, cs: int, ce: int, last_end: int, starts: deque) -> int:
+        """计算输出当前块后保留的重叠部分的起点"""
+        overlap = self.chunk_overlap
+        if overlap <= 0 or ce - cs <= overlap:
+            return ce
+        if self.compat:
+            if last_end >= cs and last_end >= ce - overlap:
+                return last_end + 1
+            return ce - overlap
+        # 从后往前保留完整句子
+        start = ce
+        for s in reversed(starts):
+            if ce - s > overlap:
+                break
+            start = s
+        return start if start < ce else ce - overlap
+
+
+class TokenChunker:
+    """
+    按 token 预算分块
+
+    句子的 token 数由分词器（任何提供 count(text) -> int 的对象）计算，每个块的 token 数
+    不超过 max_tokens；重叠由块末尾若干完整句子组成，总 token 数不超过 overlap_tokens。
+    超过预算的单个句子按字符比例切分。与 TextChunker 一样只保存偏移量并支持流式输入。
+    """
+
+    def __init__(self, tokenizer, max_tokens: int, overlap_tokens: int = 0):
+        self.tokenizer = tokenizer
+        self.max_tokens = max(1, int(max_tokens))
+        self.overlap_tokens = max(0, int(overlap_tokens))
+
+    def split(self, text: str) -> Iterator[Tuple[str, int]]:
+        """对完整文本分块，产出 (块文本, token 数)"""
+        return self.split_stream([text])
+
+    def split_stream(self, blocks: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """对按顺序到达的文本片段分块，产出 (块文本, token 数)"""
+        for chunk, tokens, _, _ in self.split_spans(blocks):
+            yield chunk, tokens
+
+    def split_spans(self, blocks: Iterable[str]) -> Iterator[Tuple[str, int, int, int]]:
+        """与 split_stream 相同，同时产出每个块在整个输入中的 (起始, 结束) 偏移"""
+        budget = self.max_tokens
+        buf = ""
+        base = pos = 0
+        # 当前块内的句子 (起始, 结束, token 数)
+        current = deque()
+        total = 0
+        pending = iter(blocks)
+        final = False
+        while not final:
+            block = next(pending, None)
+            if block is None:
+                final = True
+            elif not block:
+                continue
+            else:
+                keep = current[0][0] if current else pos
+                if keep:
+                    buf = buf[keep:]
+                    base += keep
+                    pos -= keep
+                    current = deque((s - keep, e - keep, n) for s, e, n in current)
+                buf += block
+
+            for start, end, _ in _pending_sentences(buf, pos, final):
+                pos = end
+                for s, e, n in self._measure(buf, start, end):
+                    if total + n > budget and current:
+                        first, last = current[0][0], current[-1][1]
+                        yield buf[first:last], total, base + first, base + last
+                        # 保留末尾完整句子作为重叠，重叠加新句子超出预算时放弃重叠
+                        kept = 0
+                        for i in range(len(current) - 1, -1, -1):
+                            if kept + current[i][2] > self.overlap_tokens:
+                                break
+                            kept += current[i][2]
+                        while current and total > kept:
+                            total -= current.popleft()[2]
+                        if total + n > budget:
+                            current.clear()
+                            total = 0
+                    current.append((s, e, n))
+                    total += n
+
+        if current:
+            start, end = current[0][0], current[-1][1]
+            yield buf[start:end], total, base + start, base + end
+
+    def _measure(self, buf: str, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+        """计算句子的 token 数，超出预算时按字符比例切成若干段"""
+        tokens = self.tokenizer.count(buf[start:end])
+        if tokens <= self.max_tokens:
+            yield start, end, tokens
+            return
+        step = max(1, (end - start) * self.max_tokens // tokens)
+        for s, e in _hard_split(start, end, step):
+            yield s, e, self.tokenizer.count(buf[s:e])
@@ -0,0 +1,134 @@
+import time
+from typing import Any, Dict, Optional
+
+from app.core.logger import logger
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class LLMUnavailableError(RuntimeError):
+    """LLM 调用最终失败（重试用尽或所有端点熔断），启用错误预算时代替后备响应抛出"""
+
+
+class ErrorBudgetExceeded(RuntimeError):
+    """构建期间 LLM 调用失败比例超出错误预算，构建提前终止"""
+
+
+class CircuitBreaker:
+    """
+    单个端点的熔断器，由该端点上的所有请求共享
+
+    - closed: 正常放行，连续失败 failure_threshold 次后打开
+    - open: 拒绝请求，cooldown 秒后进入半开
+    - half_open: 只放行 probes 个探测请求，成功则关闭，失败则重新打开
+    trip() 可以直接打开熔断器并指定时长，用于 429 的 Retry-After 或认证失败。
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0, probes: int = 1):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.probes = max(1, probes)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.probing = 0
+        self.opens = 0
+
+    def _refresh(self, now: float):
+        if self.state == OPEN and now >= self.opened_until:
+            self.state = HALF_OPEN
+            self.probing = 0
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """是否可以向该端点发送请求（不占用半开状态的探测名额）"""
+        self._refresh(time.monotonic() if now is None else now)
+        if self.state == OPEN:
+            return False
+        return self.state == CLOSED or self.probing < self.probes
+
+    def retry_after(self, now: Optional[float] = None) -> float:
+        """距离可以再次发送请求的秒数"""
+        now = time.monotonic() if now is None else now
+        self._refresh(now)
+        return max(0.0, self.opened_until - now) if self.state == OPEN else 0.0
+
+    def on_start(self):
+        if self.state == HALF_OPEN:
+            self.probing += 1
+
+    def on_end(self):
+        if self.state == HALF_OPEN and self.probing:
+            self.probing -= 1
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info("熔断器关闭，端点恢复")
+        self.state = CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回熔断器是否因此打开"""
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.trip(self.cooldown)
+            return True
+        return False
+
+    def trip(self, duration: float):
+        now = time.monotonic()
+        if self.state != OPEN:
+            self.opens += 1
+        self.state = OPEN
+        self.probing = 0
+        self.opened_until = max(self.opened_until, now + duration)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "opens": self.opens, "retry_after": round(self.retry_after(), 1)}
+
+
+class ErrorBudget:
+    """
+    构建级别的 LLM 调用错误预算
+
+    调用次数达到 min_calls 后，失败比例超过 max_ratio 即视为耗尽；耗尽后 check() 抛出 ErrorBudgetExceeded，
+    构建不再继续调度新的请求，避免端点长时间不可用时用后备内容填满数据集。max_ratio 为 0 时不限制。
+    """
+
+    def __init__(self, max_ratio: float = 0.0, min_calls: int = 20):
+        self.max_ratio = max_ratio
+        self.min_calls = max(1, min_calls)
+        self.calls = 0
+        self.failures = 0
+        self._reported = False
+
+    @classmethod
+    def from_config(cls) -> "ErrorBudget":
+        from app.core.config import config
+
+        return cls(config.LLM_ERROR_BUDGET, min_calls=config.LLM_ERROR_BUDGET_MIN_CALLS)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_ratio > 0
+
+    @property
+    def exhausted(self) -> bool:
+        return (self.enabled and self.calls >= self.min_calls
+                and self.failures > self.calls * self.max_ratio)
+
+    def record(self, ok: bool):
+        self.calls += 1
+        if not ok:
+            self.failures += 1
+        if self.exhausted and not self._reported:
+            self._reported = True
+            logger.error(f"LLM 错误预算耗尽: {self.failures}/{self.calls} 次调用失败 "
+                         f"(上限 {self.max_ratio:.0%})，停止构建")
+
+    def check(self):
+        if self.exhausted:
+            raise ErrorBudgetExceeded(f"LLM 调用失败 {self.failures}/{self.calls} 次，超出错误预算 "
+                                      f"{self.max_ratio:.0%}，请检查端点后使用 --resume 继续")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "failures": self.failures, "max_ratio": self.max_ratio}
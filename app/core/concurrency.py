@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from app.core.logger import logger
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    自适应并发控制器 (AIMD)
+
+    用法与 asyncio.Semaphore 相同 (`async with limiter:`)，但并发上限会随运行情况调整：
+    - 每完成一轮（约等于当前上限个请求）且 p95 延迟、错误率都健康时，上限 +1
+    - 遇到 429、5xx 或超时等过载信号时，上限按比例收缩
+    adaptive=False 时退化为固定上限的信号量。
+    """
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: Optional[int] = None,
+                 adaptive: bool = True, latency_tolerance: float = 2.0, error_threshold: float = 0.1,
+                 backoff_ratio: float = 0.5, window: int = 50):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit or initial))
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.error_threshold = error_threshold
+        self.backoff_ratio = backoff_ratio
+        self._limit = min(self.max_limit, max(self.min_limit, int(initial)))
+        self._inflight = 0
+        self._waiters = deque()
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._since_adjust = 0
+        self._baseline = None
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.peak_limit = self._limit
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def acquire(self):
+        while self._inflight >= self._limit:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # 已被唤醒但随即取消时，把机会让给下一个等待者
+                if fut.done() and not fut.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+        self._inflight += 1
+
+    def release(self):
+        self._inflight -= 1
+        self._wake()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def _wake(self):
+        free = self._limit - self._inflight
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    def _p95(self) -> float:
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def record_success(self, latency: float):
+        """记录一次成功请求的耗时，并在每轮结束时尝试加性增长"""
+        self._latencies.append(latency)
+        self._outcomes.append(True)
+        self._since_adjust += 1
+        if not self.adaptive or self._since_adjust < self._limit or len(self._latencies) < 5:
+            return
+        self._since_adjust = 0
+
+        p95 = self._p95()
+        if self._baseline is None or p95 < self._baseline:
+            self._baseline = p95
+        healthy = p95 <= self._baseline * self.latency_tolerance and self._error_rate() <= self.error_threshold
+        if healthy and self._limit < self.max_limit:
+            self._limit += 1
+            self.increases += 1
+            self.peak_limit = max(self.peak_limit, self._limit)
+            logger.debug(f"并发上限提升至 {self._limit} (p95={p95:.2f}s)")
+            self._wake()
+        elif not healthy:
+            # 延迟持续偏高时保持上限，同时让基线缓慢上移以适应负载变化
+            self._baseline *= 1.02
+
+    def record_failure(self, overload: bool = True):
+        """记录一次失败请求；过载信号触发乘性收缩"""
+        self._outcomes.append(False)
+        if not self.adaptive or not overload:
+            return
+        now = time.monotonic()
+        # 同一轮内的连续失败只收缩一次，避免一次突发把上限压到底
+        cooldown = self._baseline if self._baseline else 1.0
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        new_limit = max(self.min_limit, int(self._limit * self.backoff_ratio))
+        if new_limit < self._limit:
+            self._limit = new_limit
+            self.decreases += 1
+            logger.warning(f"检测到过载，并发上限降至 {self._limit}")
+        self._since_adjust = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self._limit,
+            "inflight": self._inflight,
+            "waiting": len(self._waiters),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "peak_limit": self.peak_limit,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "p95_latency": round(self._p95(), 3) if self._latencies else None,
+            "error_rate": round(self._error_rate(), 3),
+        }
@@ -62,6 +62,38 @@ class Config:
     # Chunk length range
     CHUNK_MIN_LEN = int(os.getenv("DOCUMENT_MIN_CHUNK_SIZE", "1500").split('#')[0].strip())
     CHUNK_MAX_LEN = int(os.getenv("DOCUMENT_MAX_CHUNK_SIZE", "2000").split('#')[0].strip())
+    # Keep chunk boundaries identical to earlier releases; False enables sentence-aligned overlap
+    # and hard limits on chunk length
+    CHUNK_COMPAT_MODE = os.getenv("CHUNK_COMPAT_MODE", "True") == "True"
+    # Chunk length unit: "chars" or "tokens" (token mode uses CHUNK_MIN/MAX_TOKENS and CHUNK_TOKENIZER)
+    CHUNK_UNIT = os.getenv("CHUNK_UNIT", "chars")
+    CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "estimate")
+    CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", 600))
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 1000))
+    # Tokens of chunk text per generated question (token mode)
+    TOKENS_PER_QUESTION = int(os.getenv("TOKENS_PER_QUESTION", 200))
+    # Parse-result cache (extracted text and chunk lists keyed by file content hash)
+    PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "False") == "True"
+    PARSE_CACHE_PATH = os.getenv("PARSE_CACHE_PATH", ".cache/parse_cache.sqlite")
+    PARSE_CACHE_MAX_SIZE = int(os.getenv("PARSE_CACHE_MAX_SIZE", 1024 * 1024 * 1024))
+    # .txt files at least this large are chunked as they are read by astream_chunks, one chunk at a
+    # time and without the parse cache, so peak memory does not grow with the file (0 = never)
+    TXT_STREAM_MIN_BYTES = int(os.getenv("TXT_STREAM_MIN_BYTES", 64 * 1024 * 1024))
+    # PDF backend: "auto" (PyMuPDF or pypdf when installed), "pymupdf", "pypdf" or "textract";
+    # textract is always the fallback
+    PDF_BACKEND = os.getenv("PDF_BACKEND", "auto")
+    # Processes used to extract the pages of one PDF (native backends only)
+    PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", 4))
+    # Near-duplicate chunk filtering before question generation (MinHash LSH over character shingles).
+    # Signatures are pure Python: about 40 ms per 2,000-character chunk at 64 perms, scaling with
+    # NUM_PERM x chunk length; they run in a worker thread so in-flight LLM calls are not stalled
+    CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP_ENABLED", "False") == "True"
+    CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", 0.85))
+    CHUNK_DEDUP_NUM_PERM = int(os.getenv("CHUNK_DEDUP_NUM_PERM", 64))
+    CHUNK_DEDUP_SHINGLE_SIZE = int(os.getenv("CHUNK_DEDUP_SHINGLE_SIZE", 5))
+    # Cross-chunk near-duplicate question merging before the answer stage
+    QUESTION_DEDUP_ENABLED = os.getenv("QUESTION_DEDUP_ENABLED", "False") == "True"
+    QUESTION_DEDUP_THRESHOLD = float(os.getenv("QUESTION_DEDUP_THRESHOLD", 0.8))
     # LLM API config
     API_KEY = os.getenv("LLM_API_KEY", "your-api-key")
     BASE_URL = os.getenv("LLM_API_BASE", "http://localhost:8000/v1")
@@ -80,7 +112,65 @@ class Config:
     ENABLE_LABEL = os.getenv("ENABLE_LABEL", "False") == "True"
     ENABLE_OPTIMIZE = os.getenv("ENABLE_OPTIMIZE", "True") == "True"
     ENABLE_REASONING_CONTENT = os.getenv("ENABLE_REASONING_CONTENT", "False") == "True"
+    # Request answer, CoT and labels as one JSON object in a single call (falls back per field)
+    FUSED_GENERATION = os.getenv("FUSED_GENERATION", "False") == "True"
+    # Answer up to N questions of one chunk in a single call (1 = one call per question); the reply
+    # budget ANSWER_BATCH_MAX_TOKENS reserves ANSWER_BATCH_TOKENS_PER_ANSWER tokens per question
+    ANSWER_BATCH_SIZE = int(os.getenv("ANSWER_BATCH_SIZE", 1))
+    ANSWER_BATCH_MAX_TOKENS = int(os.getenv("ANSWER_BATCH_MAX_TOKENS", 4096))
+    ANSWER_BATCH_TOKENS_PER_ANSWER = int(os.getenv("ANSWER_BATCH_TOKENS_PER_ANSWER", 512))
+    # Send the first answer request of each chunk alone and release its siblings once it returns,
+    # so the provider's prefix cache holds the shared instructions + chunk context
+    PROMPT_CACHE_WARMUP = os.getenv("PROMPT_CACHE_WARMUP", "False") == "True"
+    # Per-endpoint starting concurrency; the total scales with the number of LLM_ENDPOINTS
     MAX_LLM_CONCURRENCY = int(os.getenv("MAX_LLM_CONCURRENCY", 10))
+    # Endpoint pool: JSON list of {"base_url", "api_key", "model", "weight", "name"} (empty = LLM_API_BASE only);
+    # missing api_key/model fall back to LLM_API_KEY/LLM_MODEL
+    LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+    LLM_ROUTING = os.getenv("LLM_ROUTING", "least_outstanding")  # or "latency"
+    LLM_ENDPOINT_FAILURE_THRESHOLD = int(os.getenv("LLM_ENDPOINT_FAILURE_THRESHOLD", 3))
+    LLM_ENDPOINT_COOLDOWN = float(os.getenv("LLM_ENDPOINT_COOLDOWN", 30))
+    LLM_ENDPOINT_SLOW_FACTOR = float(os.getenv("LLM_ENDPOINT_SLOW_FACTOR", 3.0))
+    # Each endpoint has a circuit breaker (opens after LLM_ENDPOINT_FAILURE_THRESHOLD consecutive failures,
+    # half-opens after LLM_ENDPOINT_COOLDOWN); with every circuit open, requests pause up to this many
+    # seconds for a probe to succeed, then fail fast (0 = fail immediately)
+    LLM_CIRCUIT_MAX_WAIT = float(os.getenv("LLM_CIRCUIT_MAX_WAIT", 60))
+    # Build-wide error budget: abort the build once more than this fraction of LLM calls failed
+    # (after LLM_ERROR_BUDGET_MIN_CALLS calls); failed calls then raise instead of returning placeholders.
+    # 0 = disabled
+    LLM_ERROR_BUDGET = float(os.getenv("LLM_ERROR_BUDGET", 0))
+    LLM_ERROR_BUDGET_MIN_CALLS = int(os.getenv("LLM_ERROR_BUDGET_MIN_CALLS", 20))
+    # Adaptive (AIMD) concurrency: MAX_LLM_CONCURRENCY is the starting limit
+    LLM_ADAPTIVE_CONCURRENCY = os.getenv("LLM_ADAPTIVE_CONCURRENCY", "True") == "True"
+    LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+    LLM_CONCURRENCY_CEILING = int(os.getenv("LLM_CONCURRENCY_CEILING", 64))
+    # Build pipeline stage workers (0 = derive from MAX_LLM_CONCURRENCY)
+    PIPELINE_QUESTION_WORKERS = int(os.getenv("PIPELINE_QUESTION_WORKERS", 0))
+    PIPELINE_ANSWER_WORKERS = int(os.getenv("PIPELINE_ANSWER_WORKERS", 0))
+    # Build checkpoint journal (empty = disabled unless a path is passed explicitly)
+    CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "")
+    # Offline batch mode (build_dataset(mode="batch")) through OpenAI-compatible /files + /batches
+    BATCH_DIR = os.getenv("BATCH_DIR", ".cache/batches")
+    BATCH_COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h")
+    BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", 30))
+    BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 50000))
+    BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", 1))
+    # A wave is submitted once no new request was registered for this many seconds
+    BATCH_SETTLE_DELAY = float(os.getenv("BATCH_SETTLE_DELAY", 0.5))
+    # LLM HTTP connection pool
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+    LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 30))
+    LLM_HTTP2 = os.getenv("LLM_HTTP2", "False") == "True"
+    # LLM rate limits (0 = unlimited)
+    LLM_RPM = int(os.getenv("LLM_RPM", 0))
+    LLM_TPM = int(os.getenv("LLM_TPM", 0))
+    # Persistent LLM response cache
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "False") == "True"
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")
+    LLM_CACHE_MAX_SIZE = int(os.getenv("LLM_CACHE_MAX_SIZE", 1024 * 1024 * 1024))
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 0))
+    LLM_CACHE_READ_ONLY = os.getenv("LLM_CACHE_READ_ONLY", "False") == "True"
     # Dataset config
     DEFAULT_SAMPLE_SIZE = int(os.getenv("DEFAULT_SAMPLE_SIZE", "3"))
     # API
@@ -2,7 +2,7 @@ import os
 import json
 import re
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, AsyncIterator, AsyncIterable, Iterable
 import asyncio
 import httpx
 from tqdm.asyncio import tqdm as tqdm_async
@@ -12,6 +12,32 @@ import random
 import time
 import logging
 from app.core.llm import AsyncLLM
+from app.core.batch import BatchLLM, BatchTransport, OpenAIBatchTransport
+from app.core.checkpoint import CheckpointJournal, chunk_key
+from app.core.circuit import ErrorBudget
+from app.core.dedup import ChunkDeduplicator, QuestionDeduplicator
+from app.core.document import DocumentProcessor
+from app.core.manifest import BuildManifest
+from app.core.prompt import layered_prompt
+from app.core.storage import StreamingJSONWriter, write_records
+
+ChunkSource = Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]]
+
+
+async def _resolved(value: Any) -> Any:
+    """把已有结果包装为协程，便于与待生成的任务一起 gather"""
+    return value
+
+
+async def _aiter_chunks(chunks: ChunkSource) -> AsyncIterator[Dict[str, Any]]:
+    """统一遍历同步和异步的文档块来源"""
+    if hasattr(chunks, '__aiter__'):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
 
 class DatasetBuilder:
     """数据集构建器，用于从文档块构建训练数据集"""
@@ -25,8 +51,18 @@ class DatasetBuilder:
         self.enable_cot = config.ENABLE_COT
         self.enable_label = config.ENABLE_LABEL
         self.enable_optimize = config.ENABLE_OPTIMIZE
+        self.fused_generation = config.FUSED_GENERATION
+        self.answer_batch_size = config.ANSWER_BATCH_SIZE
+        self.prompt_cache_warmup = config.PROMPT_CACHE_WARMUP
         self.max_concurrency = config.MAX_LLM_CONCURRENCY
-        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.checkpoint_path = config.CHECKPOINT_PATH
+        self.chunk_dedup = config.CHUNK_DEDUP_ENABLED
+        self.question_dedup = config.QUESTION_DEDUP_ENABLED
+        # 最近一次构建的文档块 / 问题去重结果（未启用去重时为 None）
+        self.last_dedup: Optional[ChunkDeduplicator] = None
+        self.last_question_dedup: Optional[QuestionDeduplicator] = None
+        # 批处理模式的传输层，为空时使用 OpenAI 兼容的 /files + /batches 接口
+        self.batch_transport: Optional[BatchTransport] = None
         self.headers = {"Authorization": f"Bearer {self.api_key}"}
         # 初始化LLM客户端
         self.llm = AsyncLLM(
@@ -37,222 +73,52 @@ class DatasetBuilder:
             max_concurrency=self.max_concurrency,
             system_prompt=self.system_prompt
         )
+        # 与 LLM 客户端共用同一个自适应并发控制器
+        self.semaphore = self.llm.semaphore
         logger.info("DatasetBuilder 初始化")
 
-    async def build_dataset(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    async def aclose(self):
+        """释放 LLM 客户端占用的连接池"""
+        await self.llm.aclose()
+
+    async def build_dataset(self, chunks: ChunkSource, resume: bool = False,
+                            checkpoint_path: Optional[str] = None, mode: str = "online") -> List[Dict[str, Any]]:
         """
-        构建数据集 - 全异步处理
+        构建数据集 - 全异步流水线处理
         
         Args:
-            chunks: 文档块列表
+            chunks: 文档块列表，或边解析边产出文档块的（异步）迭代器
+            resume: 是否从检查点恢复，跳过已完成的问题和数据点
+            checkpoint_path: 检查点日志路径，默认使用 CHECKPOINT_PATH 配置，为空则不记录
+            mode: "online" 逐个调用 LLM 接口；"batch" 按阶段分波次提交批处理接口，适合不要求时效的离线任务
             
         Returns:
             List[Dict[str, Any]]: 数据集
         """
-        if not chunks:
-            logger.warning("没有文档块，无法构建数据集")
+        if mode not in ("online", "batch"):
+            raise ValueError(f"未知的构建模式: {mode}")
+        if not self._log_chunk_source(chunks):
             return []
-            
-        logger.info(f"开始构建数据集，共 {len(chunks)} 个文档块")
         
-        # 步骤 1: 并行为每个文档块生成问题
-        async def generate_questions_for_chunk(chunk):
-            try:
-                chunk_id = chunk.get('chunk_id', '')
-                file_name = chunk.get('file', '')
-                content = chunk.get('content', '')
-                summary = chunk.get('summary', '')
-                
-                # 根据文本长度确定问题数量
-                question_count = max(1, len(content) // 240)
-                
-                # 生成问题
-                questions = await self._generate_questions(content, question_count)
-                
-                # 返回问题列表，每个问题包含完整的块信息
-                return [{
-                    "chunk_id": chunk_id,
-                    "file": file_name,
-                    "summary": summary,
-                    "content": content,
-                    "question": q
-                } for q in questions]
-            except Exception as e:
-                logger.error(f"为文档块 {chunk.get('chunk_id', 'unknown')} 生成问题失败: {str(e)}")
-                return []  # 返回空列表而不是使整个处理失败
-        
-        # 并行处理所有文档块
-        chunk_tasks = [generate_questions_for_chunk(chunk) for chunk in chunks]
-        chunk_results = await tqdm_async.gather(*chunk_tasks, desc="生成问题")
-        
-        # 合并所有问题
-        all_questions = []
-        for result in chunk_results:
-            all_questions.extend(result)
-        
-        logger.info(f"已生成 {len(all_questions)} 个问题，开始生成答案...")
-        
-        # 步骤 2: 并行为每个问题生成答案和相关内容
-        async def process_question(item):
-            try:
-                # 获取问题和上下文
-                question = item["question"]
-                context = item["content"]
-                
-                # 定义要执行的任务
-                tasks = [self._generate_answer(question, context)]
-                
-                # 如果启用了思维链，添加到任务中
-                if self.enable_cot:
-                    tasks.append(self._generate_cot(question))
-                
-                # 如果启用了标签生成，添加到任务中
-                if self.enable_label:
-                    tasks.append(self._generate_labels(question))
-                
-                # 同时执行所有任务
-                results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                # 整理结果，处理可能的异常
-                data_point = dict(item)
-                
-                # 处理答案结果 (第一个任务)
-                if isinstance(results[0], Exception):
-                    logger.error(f"生成答案失败: {str(results[0])}")
-                    data_point["answer"] = f"处理过程中发生错误: {str(results[0])}"
-                    data_point["error"] = True
-                else:
-                    print(f"\n=== 处理答案结果 ===")
-                    print(f"结果类型: {type(results[0])}")
-                    if isinstance(results[0], dict):
-                        for k, v in results[0].items():
-                            if isinstance(v, str):
-                                print(f"{k}: {v[:100]}...")
-                            else:
-                                print(f"{k}: {type(v)}")
-                    else:
-                        print(f"结果内容: {str(results[0])[:100]}...")
-                    
-                    # 处理新的答案格式
-                    if isinstance(results[0], dict):
-                        if 'choices' in results[0]:
-                            # 直接处理API返回的JSON
-                            print("处理API原始返回")
-                            message = results[0]['choices'][0]['message']
-                            data_point["answer"] = message.get('content', '').strip()
-                            if 'reasoning_content' in message:
-                                print(f"找到推理内容: {message['reasoning_content'][:50]}...")
-                                data_point["reasoning_content"] = message['reasoning_content'].strip()
-                        elif 'content' in results[0]:
-                            # 处理格式化后的返回
-                            print("处理格式化返回")
-                            data_point["answer"] = results[0]['content']
-                            if 'reasoning_content' in results[0]:
-                                print(f"找到推理内容: {results[0]['reasoning_content'][:50]}...")
-                                data_point["reasoning_content"] = results[0]['reasoning_content']
-                        else:
-                            # 无法识别的格式
-                            print("无法识别的字典格式，直接使用字符串表示")
-                            data_point["answer"] = str(results[0])
-                    else:
-                        # 简单字符串返回
-                        print("处理简单字符串返回")
-                        data_point["answer"] = results[0]
-                
-                # 处理其他任务结果
-                task_index = 1
-                if self.enable_cot:
-                    if isinstance(results[task_index], Exception):
-                        logger.error(f"生成思维链失败: {str(results[task_index])}")
-                        data_point["cot"] = f"处理过程中发生错误: {str(results[task_index])}"
-                    else:
-                        data_point["cot"] = results[task_index]
-                    task_index += 1
-                
-                if self.enable_label:
-                    if isinstance(results[task_index], Exception):
-                        logger.error(f"生成标签失败: {str(results[task_index])}")
-                        data_point["labels"] = ["错误"]
-                    else:
-                        data_point["labels"] = results[task_index]
-                    task_index += 1
-                
-                # 只有当没有错误且启用了优化时才执行优化任务
-                if self.enable_optimize and not data_point.get("error", False):
-                    optimize_tasks = []
-                    
-                    # 只优化没有错误的内容
-                    if "answer" in data_point and not isinstance(data_point["answer"], Exception):
-                        optimize_tasks.append(self._optimize_answer(data_point["answer"]))
-                    
-                    if self.enable_cot and "cot" in data_point and not isinstance(data_point["cot"], Exception):
-                        optimize_tasks.append(self._optimize_cot(data_point["cot"]))
-                    
-                    if optimize_tasks:
-                        optimize_results = await asyncio.gather(*optimize_tasks, return_exceptions=True)
-                        
-                        # 更新优化结果
-                        result_index = 0
-                        if "answer" in data_point and not isinstance(data_point["answer"], Exception):
-                            if not isinstance(optimize_results[result_index], Exception):
-                                data_point["answer"] = optimize_results[result_index]
-                            result_index += 1
-                        
-                        if self.enable_cot and "cot" in data_point and not isinstance(data_point["cot"], Exception):
-                            if not isinstance(optimize_results[result_index], Exception):
-                                data_point["cot"] = optimize_results[result_index]
-                
-                return data_point
-            except Exception as e:
-                logger.error(f"处理问题失败: {item.get('question', '')[:30]}... - {str(e)}")
-                # 返回一个带有错误标记的条目，而不是完全失败
-                return {
-                    **item,
-                    "answer": f"处理过程中发生错误: {str(e)}",
-                    "error": True
-                }
+        results = []
+        journal = self._open_journal(checkpoint_path, resume)
+        try:
+            if mode == "batch":
+                results = await self._run_batch(chunks, journal)
+            else:
+                # 每个问题生成后立即进入答案阶段，不再等待所有文档块的问题生成完毕
+                async for seq, data_point in self._run_pipeline(chunks, journal):
+                    results.append((seq, data_point))
+        finally:
+            if journal is not None:
+                journal.close()
         
-        # 动态计算最佳批处理大小
-        max_concurrency = getattr(self, 'max_concurrency', 10)
-        total_questions = len(all_questions)
-        
-        # 根据问题总数和并发数动态调整批处理大小
-        if total_questions <= max_concurrency:
-            # 问题数少于并发数，一次处理所有问题
-            batch_size = total_questions
-        elif total_questions <= max_concurrency * 3:
-            # 问题数适中，设置较大的批处理大小
-            batch_size = max(max_concurrency, total_questions // 2)
-        else:
-            # 问题数较多，使用较小的批处理大小避免内存问题
-            batch_size = min(30, max(5, max_concurrency))
+        if not results and not hasattr(chunks, '__len__'):
+            logger.warning("文档块来源为空，未生成任何数据点")
         
-        logger.info(f"使用批处理大小: {batch_size}, 总并发数: {max_concurrency}")
-        dataset = []
-        
-        # 计算总批次数
-        total_batches = (total_questions + batch_size - 1) // batch_size
-        for i in range(0, total_questions, batch_size):
-            batch = all_questions[i:i+batch_size]
-            batch_tasks = [process_question(item) for item in batch]
-            
-            # 使用tqdm显示进度
-            batch_desc = f"生成答案 [批次 {i//batch_size+1}/{total_batches}]"
-            batch_results = await tqdm_async.gather(*batch_tasks, desc=batch_desc)
-            
-            # 收集所有结果，包括有错误的（便于后期分析）
-            dataset.extend(batch_results)
-            
-            # 计算批次成功率
-            success_count = sum(1 for item in batch_results if not item.get("error", False))
-            if batch_results:
-                success_rate = success_count / len(batch_results) * 100
-                logger.info(f"批次 {i//batch_size+1}/{total_batches} 完成: "
-                           f"成功率 {success_rate:.1f}% ({success_count}/{len(batch_results)})")
-            
-            # 短暂休息，避免API限制
-            if i + batch_size < total_questions:
-                await asyncio.sleep(0.5)
+        # 按文档块和问题的原始顺序输出
+        results.sort(key=lambda r: r[0])
+        dataset = [data_point for _, data_point in results]
         
         # 最终统计
         success_count = sum(1 for item in dataset if not item.get("error", False))
@@ -260,6 +126,7 @@ class DatasetBuilder:
         
         logger.info(f"数据集构建完成，共 {len(dataset)} 个数据点 "
                   f"(成功: {success_count}, 失败: {error_count})")
+        logger.info(f"LLM 调用统计: {self.llm.stats()}")
         
         # 可选：过滤掉出错的数据点
         if error_count > 0:
@@ -269,115 +136,761 @@ class DatasetBuilder:
         
         return dataset
     
-    def save_dataset(self, dataset: List[Dict[str, Any]], output_path: str):
+    async def build_incremental(self, file_paths: Iterable[str], manifest: BuildManifest,
+                                processor: Optional[DocumentProcessor] = None, chunk_size: Optional[int] = None,
+                                chunk_overlap: int = 200, workers: int = 1, resume: bool = False,
+                                checkpoint_path: Optional[str] = None) -> List[Dict[str, Any]]:
         """
-        保存数据集
+        增量构建数据集：只为新增或内容变化的文档块生成问答
+        
+        内容未变的文件直接复用清单中的结果（不重新解析），变化文件中内容未变的文档块同样复用，
+        已从输入中删除的文件不再出现在结果中。构建完成后保存新的清单。
         
         Args:
-            dataset: 数据集
-            output_path: 输出路径
+            file_paths: 文档路径列表
+            manifest: 已加载的构建清单
+            processor: 文档处理器，默认新建
+            chunk_size: 块大小
+            chunk_overlap: 块重叠大小
+            workers: 并行解析进程数
+            resume: 是否从检查点恢复
+            checkpoint_path: 检查点日志路径
+            
+        Returns:
+            List[Dict[str, Any]]: 按文件和文档块顺序排列的数据集
         """
+        processor = processor or DocumentProcessor()
+        all_digests = {file_path: manifest.file_digest(file_path) for file_path in (str(fp) for fp in file_paths)}
+        manifest.expect_files(all_digests)
+        digests = {}
+        for file_path, digest in all_digests.items():
+            if manifest.reuse_file(file_path, digest):
+                continue
+            # 未复用的文件先占位，保持输出顺序与输入一致
+            manifest.record_file(file_path, digest, [])
+            digests[file_path] = digest
+        logger.info(f"增量构建: {len(manifest.files) - len(digests)} 个文件未变化, {len(digests)} 个文件需要解析, "
+                    f"{len(manifest.deleted_files())} 个文件已删除")
+        
+        # 复用文档块中的问题先加入问题去重索引，新文档块不会再生成与之重复的问题；来源为清单中的键
+        question_dedup = QuestionDeduplicator.from_config() if self.question_dedup else None
+        
+        def seed_questions(key: str):
+            if question_dedup is not None:
+                for item in manifest.chunks.get(key, []):
+                    question_dedup.seed(item.get("question", ""), key)
+        
+        for key in list(manifest.chunks):
+            seed_questions(key)
+        
+        # 流水线中第 i 个文档块在清单中的键
+        pending_keys = []
+        
+        async def changed_chunks():
+            async for file_path, chunks in processor.aprocess_documents(
+                    list(digests), chunk_size=chunk_size, chunk_overlap=chunk_overlap, workers=workers):
+                keys = manifest.chunk_keys(file_path, chunks)
+                manifest.record_file(file_path, digests[file_path], keys)
+                for chunk, key in zip(chunks, keys):
+                    if manifest.reuse_chunk(key, chunk):
+                        seed_questions(key)
+                    else:
+                        pending_keys.append(key)
+                        yield chunk
+        
+        generated: Dict[str, List[tuple]] = {}
+        failed = set()
+        journal = self._open_journal(checkpoint_path, resume)
         try:
-            # 确保输出目录存在
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            async for (index, q_index), data_point in self._run_pipeline(changed_chunks(), journal,
+                                                                         question_dedup=question_dedup):
+                key = pending_keys[index]
+                if data_point.get("error", False):
+                    failed.add(key)
+                else:
+                    generated.setdefault(key, []).append((q_index, data_point))
+        finally:
+            if journal is not None:
+                journal.close()
+        
+        # 被去重跳过的文档块记为空结果并记录原始块，原始块仍在输入中时下次构建直接复用
+        if self.last_dedup is not None:
+            for skipped in self.last_dedup.skipped:
+                manifest.record_duplicate(pending_keys[skipped["index"]], pending_keys[skipped["original"]])
+        
+        # 问题被合并的文档块记录保留这些问题的块，那些块变化或删除后重新生成，问题不会从数据集中丢失；
+        # 保留问题的块本次有失败的数据点时，依赖它的块也不写入清单
+        if question_dedup is not None:
+            sources: Dict[str, set] = {}
+            for skipped in question_dedup.skipped:
+                key = pending_keys[skipped["index"]]
+                original = skipped["original"]
+                # 新文档块以流水线序号为来源，复用的文档块以清单中的键为来源
+                original = pending_keys[original] if isinstance(original, int) else original
+                if original != key:
+                    sources.setdefault(key, set()).add(original)
+            for key, originals in sources.items():
+                manifest.record_question_duplicates(key, sorted(originals))
+                # 所有问题都被合并的文档块没有数据点，同样记录，避免每次构建都重新生成
+                generated.setdefault(key, [])
+                if originals & failed:
+                    failed.add(key)
+        
+        # 有失败数据点的文档块仍输出成功部分，但不写入清单，下次构建时重新生成；没有产出的文档块同样会重新生成
+        for key, pairs in generated.items():
+            items = [data_point for _, data_point in sorted(pairs, key=lambda p: p[0])]
+            manifest.record_chunk(key, items, complete=key not in failed)
+        manifest.save()
+        
+        dataset = manifest.dataset()
+        logger.info(f"增量构建完成，共 {len(dataset)} 个数据点 (复用文档块: {manifest.reused_chunks}, "
+                    f"新生成文档块: {len(pending_keys)}, 含失败的文档块: {len(failed)})")
+        logger.info(f"LLM 调用统计: {self.llm.stats()}")
+        return dataset
+    
+    def _log_chunk_source(self, chunks: ChunkSource) -> bool:
+        """记录文档块来源；已知为空时返回 False"""
+        if not hasattr(chunks, '__len__'):
+            logger.info("开始构建数据集，文档块边解析边处理")
+            return True
+        if not chunks:
+            logger.warning("没有文档块，无法构建数据集")
+            return False
+        logger.info(f"开始构建数据集，共 {len(chunks)} 个文档块")
+        return True
+    
+    def _pipeline_workers(self):
+        """计算问题阶段和答案阶段的工作协程数量"""
+        question_workers = config.PIPELINE_QUESTION_WORKERS or max(1, self.max_concurrency)
+        # 答案阶段的工作协程数要覆盖自适应并发可能达到的上限，保证端点持续饱和
+        answer_workers = config.PIPELINE_ANSWER_WORKERS or max(
+            self.max_concurrency * 2, self.llm.semaphore.max_limit
+        )
+        return question_workers, answer_workers
+    
+    async def iter_dataset(self, chunks: ChunkSource, resume: bool = False,
+                           checkpoint_path: Optional[str] = None,
+                           include_content: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        以异步迭代器方式构建数据集，每个数据点完成后立即产出
+        
+        与 build_dataset 不同，结果不会在内存中累积，按完成顺序产出，
+        失败的数据点会被跳过。
+        
+        Args:
+            chunks: 文档块列表，或边解析边产出文档块的（异步）迭代器
+            resume: 是否从检查点恢复
+            checkpoint_path: 检查点日志路径
+            include_content: 是否在数据点中保留文档块原文，关闭可进一步降低内存占用
             
+        Yields:
+            Dict[str, Any]: 数据点
+        """
+        if not self._log_chunk_source(chunks):
+            return
+        
+        journal = self._open_journal(checkpoint_path, resume)
+        try:
+            async for _, data_point in self._run_pipeline(chunks, journal):
+                if data_point.get("error", False):
+                    continue
+                if not include_content:
+                    data_point.pop("content", None)
+                yield data_point
+        finally:
+            if journal is not None:
+                journal.close()
+    
+    def _open_journal(self, checkpoint_path: Optional[str], resume: bool) -> Optional[CheckpointJournal]:
+        """打开检查点日志；非恢复模式下清空旧日志重新记录"""
+        path = checkpoint_path or self.checkpoint_path
+        if not path:
+            if resume:
+                logger.warning("未指定检查点路径，无法恢复，将重新构建")
+            return None
+        journal = CheckpointJournal(path)
+        if resume:
+            return journal.load()
+        if os.path.exists(path):
+            logger.info(f"非恢复模式，清空旧检查点: {path}")
+            os.remove(path)
+        return journal
+    
+    async def _run_pipeline(self, chunks: ChunkSource, journal: Optional[CheckpointJournal] = None,
+                            question_dedup: Optional[QuestionDeduplicator] = None):
+        """
+        生产者/消费者流水线：文档块 -> 问题 -> 答案(思维链/标签/优化)
+        
+        各阶段之间通过有界队列连接，队列满时上游自动等待（背压），
+        文档块来源为异步迭代器时，解析与生成同时进行，队列满时也会暂停读取来源。
+        启用文档块去重时，与已读取的块近似重复的块在进入问题阶段前被跳过（序号仍按来源计数）；
+        启用问题去重时，与其他文档块已产出的问题近似重复的问题不进入答案阶段（可传入已加入历史问题的 question_dedup）。
+        同一文档块的答案请求连续入队；启用 prompt_cache_warmup 时先发送第一批，返回后再放行其余批次。
+        LLM 端点的实际并发仍由 AsyncLLM 的并发控制器约束。
+        提供检查点日志时，每个完成的数据点立即写入日志，已记录的问题和数据点直接复用。
+        
+        Yields:
+            Tuple[Tuple[int, int], Dict[str, Any]]: ((文档块序号, 问题序号), 数据点)，按完成顺序产出
+        """
+        question_workers, answer_workers = self._pipeline_workers()
+        budget = self._reset_error_budget()
+        chunk_queue = asyncio.Queue(maxsize=question_workers * 2)
+        question_queue = asyncio.Queue(maxsize=answer_workers * 2)
+        result_queue = asyncio.Queue(maxsize=answer_workers * 2)
+        done = object()
+        
+        streaming = not hasattr(chunks, '__len__')
+        dedup = ChunkDeduplicator.from_config() if self.chunk_dedup else None
+        self.last_dedup = dedup
+        if question_dedup is None and self.question_dedup:
+            question_dedup = QuestionDeduplicator.from_config()
+        self.last_question_dedup = question_dedup
+        chunk_bar = tqdm_async(total=0 if streaming else len(chunks), desc="生成问题")
+        answer_bar = tqdm_async(total=0, desc="生成答案")
+        
+        async def feed():
+            index = 0
+            source = _aiter_chunks(chunks)
+            loop = asyncio.get_running_loop()
+            try:
+                async for chunk in source:
+                    if streaming:
+                        chunk_bar.total += 1
+                        chunk_bar.refresh()
+                    # MinHash 签名是纯 Python 计算，长文档块需要几十毫秒，放到线程中执行，
+                    # 避免阻塞进行中的 LLM 请求和限流器；同一时刻只有一个 check 在执行
+                    if dedup is not None and not await loop.run_in_executor(None, dedup.check, index, chunk):
+                        chunk_bar.update(1)
+                    else:
+                        await chunk_queue.put((index, chunk))
+                    index += 1
+                if dedup is not None:
+                    dedup.log_summary()
+            finally:
+                # 提前结束时及时关闭来源，停止后台解析
+                await source.aclose()
+                if hasattr(chunks, 'aclose'):
+                    await chunks.aclose()
+            for _ in range(question_workers):
+                await chunk_queue.put(done)
+        
+        async def question_worker():
+            while True:
+                entry = await chunk_queue.get()
+                if entry is done:
+                    return
+                index, chunk = entry
+                key = chunk_key(chunk) if journal is not None else None
+                questions = journal.get_questions(key) if journal is not None else None
+                if questions is not None:
+                    items = self._question_items(chunk, questions)
+                else:
+                    items = await self._generate_questions_for_chunk(chunk)
+                    if journal is not None and items:
+                        journal.record_questions(key, [item["question"] for item in items])
+                # 错误预算耗尽时终止流水线，已完成的数据点保留在检查点中
+                budget.check()
+                chunk_bar.update(1)
+                answer_bar.total += len(items)
+                answer_bar.refresh()
+                pending = []
+                for q_index, item in enumerate(items):
+                    if question_dedup is not None and not question_dedup.check(item["question"], item["chunk_id"], index):
+                        answer_bar.update(1)
+                        continue
+                    resumed = journal.get_item(key, item["question"]) if journal is not None else None
+                    if resumed is not None:
+                        answer_bar.update(1)
+                        await result_queue.put(((index, q_index), resumed))
+                    else:
+                        pending.append(((index, q_index), item))
+                # 同一文档块的问题按批连续进入答案阶段（未启用批量时每批一个问题）；
+                # 启用预热时其余批次等待第一批返回，使其复用服务端已缓存的指令和参考内容前缀
+                batches = list(self._answer_batches(pending))
+                warm = asyncio.Event() if self.prompt_cache_warmup and len(batches) > 1 else None
+                for position, batch in enumerate(batches):
+                    await question_queue.put((batch, key, warm, position == 0))
+        
+        async def answer_worker():
+            while True:
+                entry = await question_queue.get()
+                if entry is done:
+                    return
+                batch, key, warm, leader = entry
+                if warm is not None and not leader:
+                    await warm.wait()
+                try:
+                    data_points = await self._answer_batch(batch)
+                finally:
+                    # 第一批先于同块的其他批次出队，等待中的批次不会阻塞它
+                    if warm is not None and leader:
+                        warm.set()
+                for (seq, item), data_point in zip(batch, data_points):
+                    # 失败的数据点不写入检查点，恢复时会重新生成
+                    if journal is not None and not data_point.get("error", False):
+                        journal.record_item(key, item["question"], data_point)
+                    answer_bar.update(1)
+                    await result_queue.put((seq, data_point))
+                budget.check()
+        
+        async def close_answer_stage(upstream):
+            # 文档块来源和问题阶段全部结束后通知答案阶段退出
+            await asyncio.wait(upstream)
+            for _ in range(answer_workers):
+                await question_queue.put(done)
+        
+        async def supervise():
+            upstream = [asyncio.create_task(feed())]
+            upstream += [asyncio.create_task(question_worker()) for _ in range(question_workers)]
+            tasks = upstream + [asyncio.create_task(close_answer_stage(upstream))]
+            tasks += [asyncio.create_task(answer_worker()) for _ in range(answer_workers)]
+            try:
+                # 同时监视所有阶段：任一阶段出错（如答案阶段耗尽错误预算）时，
+                # 其他阶段可能正阻塞在有界队列上，必须立即感知并取消
+                finished, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in finished:
+                    if task.exception() is not None:
+                        raise task.exception()
+                if question_dedup is not None:
+                    question_dedup.log_summary(self._calls_per_question())
+            except Exception:
+                await result_queue.put(done)
+                raise
+            finally:
+                # 异常或被取消时停止所有仍在运行的工作协程
+                pending = [task for task in tasks if not task.done()]
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+            await result_queue.put(done)
+        
+        logger.info(f"流水线并发: 问题阶段 {question_workers}, 答案阶段 {answer_workers}")
+        supervisor = asyncio.create_task(supervise())
+        try:
+            while True:
+                entry = await result_queue.get()
+                if entry is done:
+                    break
+                yield entry
+            # 流水线内部异常向调用方抛出
+            await supervisor
+        finally:
+            if not supervisor.done():
+                supervisor.cancel()
+                await asyncio.gather(supervisor, return_exceptions=True)
+            chunk_bar.close()
+            answer_bar.close()
+    
+    def _reset_error_budget(self) -> ErrorBudget:
+        """每次构建使用新的错误预算，与 LLM 客户端共享"""
+        self.llm.error_budget = ErrorBudget.from_config()
+        return self.llm.error_budget
+
+    def _calls_per_question(self) -> int:
+        """每个问题在答案阶段的 LLM 调用次数：答案、思维链、标签及各自的优化"""
+        calls = 1 if self._use_fused() else 1 + int(self.enable_cot) + int(self.enable_label)
+        if self.enable_optimize:
+            calls += 1 + int(self.enable_cot)
+        return calls
+    
+    async def _run_batch(self, chunks: ChunkSource, journal: Optional[CheckpointJournal] = None) -> List[tuple]:
+        """
+        批处理模式：所有文档块同时推进，每个阶段的请求合并为一个批处理波次提交
+
+        文档块去重、问题去重、批量答案和检查点与流水线模式相同；来源为迭代器时先读取全部文档块。
+        
+        Returns:
+            List[tuple]: [((文档块序号, 问题序号), 数据点)]
+        """
+        dedup = ChunkDeduplicator.from_config() if self.chunk_dedup else None
+        self.last_dedup = dedup
+        question_dedup = QuestionDeduplicator.from_config() if self.question_dedup else None
+        self.last_question_dedup = question_dedup
+        self._reset_error_budget()
+        entries = []
+        index = 0
+        async for chunk in _aiter_chunks(chunks):
+            if dedup is None or dedup.check(index, chunk):
+                entries.append((index, chunk))
+            index += 1
+        if dedup is not None:
+            dedup.log_summary()
+
+        transport = self.batch_transport
+        if transport is None:
+            transport = OpenAIBatchTransport.from_config(self.llm.base_url, self.llm.api_key)
+        batch_llm = BatchLLM(self.llm, transport, config.BATCH_DIR, poll_interval=config.BATCH_POLL_INTERVAL,
+                             max_requests=config.BATCH_MAX_REQUESTS, retries=config.BATCH_RETRIES,
+                             settle_delay=config.BATCH_SETTLE_DELAY)
+        llm, self.llm = self.llm, batch_llm
+        try:
+            per_chunk = await batch_llm.run(
+                [self._batch_chunk(index, chunk, journal, question_dedup) for index, chunk in entries])
+        finally:
+            self.llm = llm
+            if self.batch_transport is None:
+                await transport.aclose()
+        if question_dedup is not None:
+            question_dedup.log_summary(self._calls_per_question())
+        logger.info(f"批处理完成: {batch_llm.waves} 个波次, {batch_llm.requests} 个请求 (失败 {batch_llm.failed})")
+        return [entry for results in per_chunk for entry in results]
+
+    async def _batch_chunk(self, index: int, chunk: Dict[str, Any], journal: Optional[CheckpointJournal],
+                           question_dedup: Optional[QuestionDeduplicator]) -> List[tuple]:
+        """批处理模式下单个文档块的完整流程：问题 -> 答案（思维链/标签）-> 优化"""
+        key = chunk_key(chunk) if journal is not None else None
+        questions = journal.get_questions(key) if journal is not None else None
+        if questions is not None:
+            items = self._question_items(chunk, questions)
+        else:
+            items = await self._generate_questions_for_chunk(chunk)
+            if journal is not None and items:
+                journal.record_questions(key, [item["question"] for item in items])
+        self.llm.error_budget.check()
+        results, pending = [], []
+        for q_index, item in enumerate(items):
+            if question_dedup is not None and not question_dedup.check(item["question"], item["chunk_id"], index):
+                continue
+            resumed = journal.get_item(key, item["question"]) if journal is not None else None
+            if resumed is not None:
+                results.append(((index, q_index), resumed))
+            else:
+                pending.append(((index, q_index), item))
+        batches = list(self._answer_batches(pending))
+        for batch, data_points in zip(batches, await asyncio.gather(*(self._answer_batch(b) for b in batches))):
+            for (seq, item), data_point in zip(batch, data_points):
+                if journal is not None and not data_point.get("error", False):
+                    journal.record_item(key, item["question"], data_point)
+                results.append((seq, data_point))
+        self.llm.error_budget.check()
+        return results
+
+    async def _generate_questions_for_chunk(self, chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """为单个文档块生成问题，每个问题携带所属块的信息"""
+        try:
+            content = chunk.get('content', '')
+
+            # 根据文本长度确定问题数量；按 token 分块的文档块按 token 数计算，使每次调用的成本可预期
+            tokens = chunk.get('metadata', {}).get('tokens')
+            if tokens is not None:
+                question_count = max(1, tokens // config.TOKENS_PER_QUESTION)
+            else:
+                question_count = max(1, len(content) // 240)
+
+            # 生成问题
+            questions = await self._generate_questions(content, question_count)
+
+            return self._question_items(chunk, questions)
+        except Exception as e:
+            logger.error(f"为文档块 {chunk.get('chunk_id', 'unknown')} 生成问题失败: {str(e)}")
+            return []  # 返回空列表而不是使整个处理失败
+
+    def _question_items(self, chunk: Dict[str, Any], questions: List[str]) -> List[Dict[str, Any]]:
+        """返回问题列表，每个问题包含完整的块信息"""
+        return [{
+            "chunk_id": chunk.get('chunk_id', ''),
+            "file": chunk.get('file', ''),
+            "summary": chunk.get('summary', ''),
+            "content": chunk.get('content', ''),
+            "question": q
+        } for q in questions]
+
+    def _answer_batch_limit(self) -> int:
+        """每次批量答案调用的问题数：不超过 ANSWER_BATCH_SIZE，且预留的输出 token 不超过批量输出上限"""
+        if self.answer_batch_size <= 1:
+            return 1
+        per_answer = config.ANSWER_BATCH_TOKENS_PER_ANSWER
+        if self._use_fused() and self.enable_cot:
+            # 每个问题同时输出思维链，预留加倍
+            per_answer *= 2
+        return max(1, min(self.answer_batch_size, config.ANSWER_BATCH_MAX_TOKENS // max(1, per_answer)))
+
+    def _answer_batches(self, pending: List[tuple]) -> Iterable[List[tuple]]:
+        size = self._answer_batch_limit()
+        for start in range(0, len(pending), size):
+            yield pending[start:start + size]
+
+    async def _answer_batch(self, batch: List[tuple]) -> List[Dict[str, Any]]:
+        """为一批 (序号, 问题) 生成数据点，单个问题不使用批量 prompt"""
+        if len(batch) == 1:
+            return [await self._process_question(batch[0][1])]
+        return await self._process_question_batch([item for _, item in batch])
+
+    async def _process_question_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        同一文档块的多个问题共用一次调用生成答案，其余步骤（思维链、标签、优化）与单个问题相同
+
+        批量结果中缺失或无法解析的问题退回到逐个生成。
+        """
+        prepared = await self._generate_answers_batch([item["question"] for item in items], items[0]["content"])
+        return list(await asyncio.gather(*(
+            self._process_question(item, prepared=prepared.get(i)) for i, item in enumerate(items)
+        )))
+
+    async def _process_question(self, item: Dict[str, Any],
+                                prepared: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        为单个问题生成答案，以及可选的思维链、标签和优化
+
+        prepared 为批量调用中已生成的字段（answer / cot / labels），只为缺失的字段单独调用
+        """
+        try:
+            # 获取问题和上下文
+            question = item["question"]
+            context = item["content"]
+
+            # 合并生成模式下先一次性请求所有字段，缺失或解析失败的字段再单独调用
+            if prepared is not None:
+                fused = prepared
+            else:
+                fused = await self._generate_fused(question, context) if self._use_fused() else {}
+
+            # 定义要执行的任务
+            tasks = [_resolved(fused["answer"]) if "answer" in fused else self._generate_answer(question, context)]
+
+            # 如果启用了思维链，添加到任务中
+            if self.enable_cot:
+                tasks.append(_resolved(fused["cot"]) if "cot" in fused else self._generate_cot(question))
+
+            # 如果启用了标签生成，添加到任务中
+            if self.enable_label:
+                tasks.append(_resolved(fused["labels"]) if "labels" in fused else self._generate_labels(question))
+
+            # 同时执行所有任务
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            # 整理结果，处理可能的异常
+            data_point = dict(item)
+
+            # 处理答案结果 (第一个任务)
+            if isinstance(results[0], Exception):
+                logger.error(f"生成答案失败: {str(results[0])}")
+                data_point["answer"] = f"处理过程中发生错误: {str(results[0])}"
+                data_point["error"] = True
+            else:
+                print(f"\n=== 处理答案结果 ===")
+                print(f"结果类型: {type(results[0])}")
+                if isinstance(results[0], dict):
+                    for k, v in results[0].items():
+                        if isinstance(v, str):
+                            print(f"{k}: {v[:100]}...")
+                        else:
+                            print(f"{k}: {type(v)}")
+                else:
+                    print(f"结果内容: {str(results[0])[:100]}...")
+
+                # 处理新的答案格式
+                if isinstance(results[0], dict):
+                    if 'choices' in results[0]:
+                        # 直接处理API返回的JSON
+                        print("处理API原始返回")
+                        message = results[0]['choices'][0]['message']
+                        data_point["answer"] = message.get('content', '').strip()
+                        if 'reasoning_content' in message:
+                            print(f"找到推理内容: {message['reasoning_content'][:50]}...")
+                            data_point["reasoning_content"] = message['reasoning_content'].strip()
+                    elif 'content' in results[0]:
+                        # 处理格式化后的返回
+                        print("处理格式化返回")
+                        data_point["answer"] = results[0]['content']
+                        if 'reasoning_content' in results[0]:
+                            print(f"找到推理内容: {results[0]['reasoning_content'][:50]}...")
+                            data_point["reasoning_content"] = results[0]['reasoning_content']
+                    else:
+                        # 无法识别的格式
+                        print("无法识别的字典格式，直接使用字符串表示")
+                        data_point["answer"] = str(results[0])
+                else:
+                    # 简单字符串返回
+                    print("处理简单字符串返回")
+                    data_point["answer"] = results[0]
+
+            # 处理其他任务结果
+            task_index = 1
+            if self.enable_cot:
+                if isinstance(results[task_index], Exception):
+                    logger.error(f"生成思维链失败: {str(results[task_index])}")
+                    data_point["cot"] = f"处理过程中发生错误: {str(results[task_index])}"
+                else:
+                    data_point["cot"] = results[task_index]
+                task_index += 1
+
+            if self.enable_label:
+                if isinstance(results[task_index], Exception):
+                    logger.error(f"生成标签失败: {str(results[task_index])}")
+                    data_point["labels"] = ["错误"]
+                else:
+                    data_point["labels"] = results[task_index]
+                task_index += 1
+
+            # 只有当没有错误且启用了优化时才执行优化任务
+            if self.enable_optimize and not data_point.get("error", False):
+                optimize_tasks = []
+
+                # 只优化没有错误的内容
+                if "answer" in data_point and not isinstance(data_point["answer"], Exception):
+                    optimize_tasks.append(self._optimize_answer(data_point["answer"]))
+
+                if self.enable_cot and "cot" in data_point and not isinstance(data_point["cot"], Exception):
+                    optimize_tasks.append(self._optimize_cot(data_point["cot"]))
+
+                if optimize_tasks:
+                    optimize_results = await asyncio.gather(*optimize_tasks, return_exceptions=True)
+
+                    # 更新优化结果
+                    result_index = 0
+                    if "answer" in data_point and not isinstance(data_point["answer"], Exception):
+                        if not isinstance(optimize_results[result_index], Exception):
+                            data_point["answer"] = optimize_results[result_index]
+                        result_index += 1
+
+                    if self.enable_cot and "cot" in data_point and not isinstance(data_point["cot"], Exception):
+                        if not isinstance(optimize_results[result_index], Exception):
+                            data_point["cot"] = optimize_results[result_index]
+
+            return data_point
+        except Exception as e:
+            logger.error(f"处理问题失败: {item.get('question', '')[:30]}... - {str(e)}")
+            # 返回一个带有错误标记的条目，而不是完全失败
+            return {
+                **item,
+                "answer": f"处理过程中发生错误: {str(e)}",
+                "error": True
+            }
+
+    def save_dataset(self, dataset: Iterable[Dict[str, Any]], output_path: str):
+        """
+        保存数据集（流式写入，完成后原子替换目标文件）
+        
+        Args:
+            dataset: 数据集，可以是列表或任意可迭代对象
+            output_path: 输出路径
+        """
+        try:
             # 根据文件格式保存
             suffix = Path(output_path).suffix.lower()
-            if suffix == ".json":
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(dataset, f, ensure_ascii=False, indent=2)
-            elif suffix == ".jsonl":
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    for item in dataset:
-                        f.write(json.dumps(item, ensure_ascii=False) + '\n')
-            else:
+            if suffix not in (".json", ".jsonl"):
                 # 默认使用 JSONL 格式
                 output_path = str(Path(output_path).with_suffix(".jsonl"))
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    for item in dataset:
-                        f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                suffix = ".jsonl"
+            write_records(str(output_path), dataset, suffix[1:])
                         
             logger.info(f"数据集已保存: {output_path}")
         except Exception as e:
             logger.error(f"保存数据集失败: {str(e)}")
 
-    def export_dataset(self, dataset: List[Dict[str, Any]], output_dir: str, formats: List[str], file_format: str = "json"):
+    def export_dataset(self, dataset: Iterable[Dict[str, Any]], output_dir: str, formats: List[str], file_format: str = "json"):
         """
         导出数据集为多种格式
         
+        单次遍历数据集，每条数据转换后同时追加到所有格式的输出文件，
+        不会在内存中生成各格式的完整副本。
+        
         Args:
-            dataset: 数据集
+            dataset: 数据集，可以是列表或任意可迭代对象（如 iter_dataset 的同步封装）
             output_dir: 输出目录
             formats: 导出格式列表，如 ["alpaca", "sharegpt"]
             file_format: 文件格式，如 "json" 或 "jsonl"
         """
-        os.makedirs(output_dir, exist_ok=True)
+        writers = self._open_export_writers(output_dir, formats, file_format)
+        if not writers:
+            return
+        try:
+            for item in dataset:
+                for convert, writer in writers.values():
+                    writer.write(convert(item))
+        except BaseException:
+            for _, writer in writers.values():
+                writer.abort()
+            raise
+        self._close_export_writers(writers)
+
+    async def aexport_dataset(self, dataset: AsyncIterable[Dict[str, Any]], output_dir: str, formats: List[str],
+                              file_format: str = "json") -> int:
+        """
+        异步导出：边生成边写入，可直接消费 iter_dataset 的结果
         
+        Returns:
+            int: 导出的数据条数
+        """
+        writers = self._open_export_writers(output_dir, formats, file_format)
+        count = 0
+        try:
+            async for item in dataset:
+                for convert, writer in writers.values():
+                    writer.write(convert(item))
+                count += 1
+        except BaseException:
+            for _, writer in writers.values():
+                writer.abort()
+            raise
+        self._close_export_writers(writers)
+        return count
+
+    def _open_export_writers(self, output_dir: str, formats: List[str], file_format: str):
+        """为每种导出格式打开一个流式写入器"""
+        os.makedirs(output_dir, exist_ok=True)
+        converters = {"alpaca": self._to_alpaca, "sharegpt": self._to_sharegpt}
+        writers = {}
         for fmt in formats:
-            if fmt == "alpaca":
-                export_data = self._export_alpaca(dataset)
-                out_path = os.path.join(output_dir, f"dataset-alpaca.{file_format}")
-            elif fmt == "sharegpt":
-                export_data = self._export_sharegpt(dataset)
-                out_path = os.path.join(output_dir, f"dataset-sharegpt.{file_format}")
-            else:
+            if fmt not in converters:
                 logger.warning(f"不支持的导出格式: {fmt}")
                 continue
-                
-            self._save_output(export_data, out_path, file_format)
-            logger.info(f"已导出 {fmt} 格式: {out_path}")
+            out_path = os.path.join(output_dir, f"dataset-{fmt}.{file_format}")
+            writers[fmt] = (converters[fmt], StreamingJSONWriter(out_path, file_format))
+        return writers
+
+    def _close_export_writers(self, writers):
+        for fmt, (_, writer) in writers.items():
+            writer.close()
+            logger.info(f"已导出 {fmt} 格式: {writer.path} ({writer.count} 条)")
     
-    def _export_alpaca(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _export_alpaca(self, data: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """导出为 Alpaca 格式"""
-        result = []
-        for item in data:
-            # 打印调试信息
-            print(f"\n=== 处理数据点 ===")
-            print(f"问题: {item['question'][:50]}...")
-            print(f"回答: {item['answer'][:50]}...")
-            print(f"reasoning_content存在: {'reasoning_content' in item}")
-            if 'reasoning_content' in item:
-                print(f"reasoning_content: {item['reasoning_content'][:50]}...")
-            print(f"config.ENABLE_REASONING_CONTENT: {config.ENABLE_REASONING_CONTENT}")
-            
-            # 构建输出
-            output = ""
-            if config.ENABLE_REASONING_CONTENT and 'reasoning_content' in item:
-                print("添加推理内容到输出")
-                output = f"<think>\n{item.get('reasoning_content', '')}\n</think>\n\n{self._clean_markdown_json(item['answer'])}"
-            else:
-                output = self._clean_markdown_json(item["answer"])
-            
-            result.append({
-                "instruction": self._clean_markdown_json(item["question"]),
-                "input": "",
-                "output": self._clean_optimized_output(output),
-                "system": self.system_prompt or ""
-            })
-            
-        return result
+        return [self._to_alpaca(item) for item in data]
     
-    def _export_sharegpt(self, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _to_alpaca(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """将单个数据点转换为 Alpaca 格式"""
+        # 打印调试信息
+        print(f"\n=== 处理数据点 ===")
+        print(f"问题: {item['question'][:50]}...")
+        print(f"回答: {item['answer'][:50]}...")
+        print(f"reasoning_content存在: {'reasoning_content' in item}")
+        if 'reasoning_content' in item:
+            print(f"reasoning_content: {item['reasoning_content'][:50]}...")
+        print(f"config.ENABLE_REASONING_CONTENT: {config.ENABLE_REASONING_CONTENT}")
+        
+        # 构建输出
+        output = ""
+        if config.ENABLE_REASONING_CONTENT and 'reasoning_content' in item:
+            print("添加推理内容到输出")
+            output = f"<think>\n{item.get('reasoning_content', '')}\n</think>\n\n{self._clean_markdown_json(item['answer'])}"
+        else:
+            output = self._clean_markdown_json(item["answer"])
+        
+        return {
+            "instruction": self._clean_markdown_json(item["question"]),
+            "input": "",
+            "output": self._clean_optimized_output(output),
+            "system": self.system_prompt or ""
+        }
+    
+    def _export_sharegpt(self, data: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """导出为 ShareGPT 格式"""
-        result = []
-        for item in data:
-            messages = []
-            if self.system_prompt:
-                messages.append({"role": "system", "content": self.system_prompt})
-            messages.append({"role": "user", "content": self._clean_markdown_json(item["question"])})
-            messages.append({"role": "assistant", "content": self._clean_optimized_output(self._clean_markdown_json(item["answer"]))})
-            result.append({"messages": messages})
-        return result
+        return [self._to_sharegpt(item) for item in data]
+    
+    def _to_sharegpt(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """将单个数据点转换为 ShareGPT 格式"""
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": self._clean_markdown_json(item["question"])})
+        messages.append({"role": "assistant", "content": self._clean_optimized_output(self._clean_markdown_json(item["answer"]))})
+        return {"messages": messages}
     
-    def _save_output(self, data: List[Dict[str, Any]], output_path: str, file_format: str = "json"):
+    def _save_output(self, data: Iterable[Dict[str, Any]], output_path: str, file_format: str = "json"):
         """保存输出文件"""
-        if file_format == "jsonl":
-            with open(output_path, "w", encoding="utf-8") as f:
-                for item in data:
-                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
-        else:
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+        write_records(output_path, data, "jsonl" if file_format == "jsonl" else "json")
 
     def _clean_markdown_json(self, text: str) -> str:
         """清理 Markdown 中的 JSON 格式"""
@@ -547,9 +1060,9 @@ Based on the text provided by the user(length: {len(context)} characters), gener
         """生成答案"""
         logger.info(f"生成答案: 问题: {question[:20]}...")
         
-        # 构建 prompt
+        # 构建 prompt：静态指令在前，参考内容居中，问题在最后，便于服务端复用同一文档块的前缀缓存
         if self.language == '中文':
-            prompt = f"""
+            instructions = """
 # Role: 微调数据集生成专家
 ## Profile:
 - Description: 你是一名微调数据集生成专家，擅长从给定的内容中生成准确的问题答案，确保答案的准确性和相关性，你要直接回答用户问题，所有信息已内化为你的专业知识。
@@ -568,18 +1081,13 @@ Based on the text provided by the user(length: {len(context)} characters), gener
 4. 接着，生成与问题相关的准确答案
 5. 最后，确保答案的准确性和相关性
 
-## 参考内容：
-{context}
-
-## 问题
-{question}
-
 ## Constrains:
 1. 答案必须基于给定的内容
 2. 答案必须准确，必须与问题相关，不能胡编乱造
 """
+            prompt = layered_prompt(instructions, f"## 参考内容：\n{context}", f"## 问题\n{question}")
         else:
-            prompt = f"""
+            instructions = """
 # Role: Fine-tuning Dataset Generation Expert
 ## Profile:
 - Description: You are a fine-tuning dataset generation expert, skilled at generating accurate question-answer pairs from given content, ensuring answer accuracy and relevance. You should directly answer user questions, with all information internalized as your professional knowledge.
@@ -598,16 +1106,11 @@ Based on the text provided by the user(length: {len(context)} characters), gener
 4. Next, generate accurate answers related to the question
 5. Finally, ensure answer accuracy and relevance
 
-## Reference Content:
-{context}
-
-## Question
-{question}
-
 ## Constraints:
 1. Answers must be based on the given content
 2. Answers must be accurate and relevant to the question, no fabrication
 """
+            prompt = layered_prompt(instructions, f"## Reference Content:\n{context}", f"## Question\n{question}")
         
         # 调用统一的LLM服务
         response = await self.llm.call_llm_advanced(prompt)
@@ -630,6 +1133,209 @@ Based on the text provided by the user(length: {len(context)} characters), gener
             return content
         return str(response)
 
+    def _use_fused(self) -> bool:
+        """只有除答案外还需要思维链或标签时，合并生成才能减少调用"""
+        return self.fused_generation and (self.enable_cot or self.enable_label)
+
+    def _fused_prompt(self, question: str, context: str) -> str:
+        """合并生成的 prompt：要求以一个 JSON 对象返回答案及已启用的思维链、标签"""
+        if self.language == '中文':
+            fields = ['  "answer": "基于参考内容的完整答案，不提及文献来源或引用标记"']
+            if self.enable_cot:
+                fields.append('  "cot": "得出答案的详细推理过程（思维链）"')
+            if self.enable_label:
+                fields.append('  "labels": ["领域标签1", "领域标签2"]')
+            schema = ",\n".join(fields)
+            instructions = f"""
+# Role: 微调数据集生成专家
+- Description: 你是一名微调数据集生成专家，根据参考内容为问题生成准确的答案{'、推理过程' if self.enable_cot else ''}{'和 2-3 个领域标签' if self.enable_label else ''}。
+
+## 输出格式
+只输出一个 JSON 对象，字段名使用英文双引号，不要输出任何其他内容：
+{{
+{schema}
+}}
+
+## Constrains:
+1. 答案必须基于给定的内容，必须准确且与问题相关，不能胡编乱造
+2. 直接回答问题，所有信息已内化为你的专业知识
+"""
+            return layered_prompt(instructions, f"## 参考内容：\n{context}", f"## 问题\n{question}")
+        fields = ['  "answer": "A complete answer based on the reference content, without source or citation marks"']
+        if self.enable_cot:
+            fields.append('  "cot": "The detailed reasoning (chain of thought) that leads to the answer"')
+        if self.enable_label:
+            fields.append('  "labels": ["Domain label 1", "Domain label 2"]')
+        schema = ",\n".join(fields)
+        instructions = f"""
+# Role: Fine-tuning Dataset Generation Expert
+- Description: You are a fine-tuning dataset generation expert. Based on the reference content, generate an accurate answer{', the reasoning process' if self.enable_cot else ''}{' and 2-3 domain labels' if self.enable_label else ''} for the question.
+
+## Output Format
+Output only one JSON object with double-quoted field names and nothing else:
+{{
+{schema}
+}}
+
+## Constraints:
+1. Answers must be based on the given content, accurate and relevant to the question, no fabrication
+2. Answer directly, with all information internalized as your professional knowledge
+"""
+        return layered_prompt(instructions, f"## Reference Content:\n{context}", f"## Question\n{question}")
+
+    def _parse_json_value(self, text: str, expected: type = dict) -> Any:
+        """从模型输出中解析 JSON 对象（或数组），容忍代码块标记和前后的多余文字，失败时返回 None"""
+        text = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", text.strip(), flags=re.IGNORECASE)
+        candidates = [text]
+        start, end = (text.find('{'), text.rfind('}')) if expected is dict else (text.find('['), text.rfind(']'))
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+        for candidate in candidates:
+            try:
+                obj = json.loads(candidate)
+            except (TypeError, ValueError):
+                continue
+            if isinstance(obj, expected):
+                return obj
+        return None
+
+    def _response_message(self, response: Any) -> tuple:
+        """返回 (内容, 推理内容)"""
+        if isinstance(response, dict) and 'choices' in response:
+            message = response['choices'][0]['message']
+            return message.get('content', ''), (message.get('reasoning_content') or '').strip()
+        return str(response), ''
+
+    def _extract_fields(self, obj: Dict[str, Any], with_extras: bool = True,
+                        reasoning_content: str = '') -> Dict[str, Any]:
+        """从结构化结果中取出有效的 answer 以及（with_extras 时）已启用的 cot、labels 字段"""
+        fields: Dict[str, Any] = {}
+        answer = obj.get("answer")
+        if isinstance(answer, str) and answer.strip():
+            answer = answer.strip()
+            if config.ENABLE_REASONING_CONTENT and reasoning_content:
+                fields["answer"] = {'content': answer, 'reasoning_content': reasoning_content}
+            else:
+                fields["answer"] = answer
+        if not with_extras:
+            return fields
+        cot = obj.get("cot")
+        if self.enable_cot and isinstance(cot, str) and cot.strip():
+            fields["cot"] = self._clean_optimized_output(cot)
+        labels = obj.get("labels")
+        if self.enable_label and isinstance(labels, list) and labels:
+            fields["labels"] = [str(label).strip() for label in labels if str(label).strip()]
+        elif self.enable_label and isinstance(labels, str) and labels.strip():
+            fields["labels"] = [labels.strip()]
+        return fields
+
+    async def _generate_fused(self, question: str, context: str) -> Dict[str, Any]:
+        """
+        一次调用生成答案及已启用的思维链、标签
+
+        Returns:
+            解析成功的字段 {"answer", "cot", "labels"}，失败时为空字典，缺失的字段由调用方单独生成
+        """
+        logger.info(f"合并生成答案/思维链/标签: 问题: {question[:20]}...")
+        try:
+            response = await self.llm.call_llm_advanced(self._fused_prompt(question, context))
+            content, reasoning_content = self._response_message(response)
+        except Exception as e:
+            logger.warning(f"合并生成失败，改为单独调用: {str(e)}")
+            return {}
+
+        fields = self._extract_fields(self._parse_json_value(content) or {}, reasoning_content=reasoning_content)
+        expected = 1 + int(self.enable_cot) + int(self.enable_label)
+        if len(fields) < expected:
+            missing = [name for name, enabled in (("answer", True), ("cot", self.enable_cot), ("labels", self.enable_label))
+                       if enabled and name not in fields]
+            logger.warning(f"合并生成结果缺少字段 {missing}，这些字段改为单独调用")
+        return fields
+
+    def _batch_answer_prompt(self, questions: List[str], context: str) -> str:
+        """批量答案的 prompt：同一参考内容下的多个问题，要求按编号返回 JSON 数组"""
+        extras = self._use_fused()
+        numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+        if self.language == '中文':
+            fields = ['"id": 问题编号', '"answer": "基于参考内容的完整答案，不提及文献来源或引用标记"']
+            if extras and self.enable_cot:
+                fields.append('"cot": "得出答案的详细推理过程（思维链）"')
+            if extras and self.enable_label:
+                fields.append('"labels": ["领域标签1", "领域标签2"]')
+            instructions = f"""
+# Role: 微调数据集生成专家
+- Description: 你是一名微调数据集生成专家，根据同一段参考内容分别回答问题列表中的每个问题，每个答案独立完整。
+
+## 输出格式
+只输出一个 JSON 数组，每个问题对应一个对象，按问题编号顺序排列，不要输出任何其他内容：
+[
+  {{{", ".join(fields)}}}
+]
+
+## Constrains:
+1. 答案必须基于给定的内容，必须准确且与问题相关，不能胡编乱造
+2. 直接回答问题，答案之间不要互相引用
+"""
+            return layered_prompt(instructions, f"## 参考内容：\n{context}", f"## 问题列表\n{numbered}")
+        fields = ['"id": question number', '"answer": "A complete answer based on the reference content, without source or citation marks"']
+        if extras and self.enable_cot:
+            fields.append('"cot": "The detailed reasoning (chain of thought) that leads to the answer"')
+        if extras and self.enable_label:
+            fields.append('"labels": ["Domain label 1", "Domain label 2"]')
+        instructions = f"""
+# Role: Fine-tuning Dataset Generation Expert
+- Description: You are a fine-tuning dataset generation expert. Answer each question in the question list separately, based on the same reference content. Every answer must stand on its own.
+
+## Output Format
+Output only one JSON array with one object per question, in question-number order, and nothing else:
+[
+  {{{", ".join(fields)}}}
+]
+
+## Constraints:
+1. Answers must be based on the given content, accurate and relevant to the question, no fabrication
+2. Answer directly and do not refer to other answers
+"""
+        return layered_prompt(instructions, f"## Reference Content:\n{context}", f"## Questions\n{numbered}")
+
+    async def _generate_answers_batch(self, questions: List[str], context: str) -> Dict[int, Dict[str, Any]]:
+        """
+        一次调用为同一上下文的多个问题生成答案（合并生成模式下同时生成思维链和标签）
+
+        Returns:
+            {问题下标: 解析成功的字段}，未出现在结果中的问题由调用方逐个生成
+        """
+        logger.info(f"批量生成答案: {len(questions)} 个问题")
+        try:
+            response = await self.llm.call_llm_advanced(self._batch_answer_prompt(questions, context),
+                                                        max_tokens=config.ANSWER_BATCH_MAX_TOKENS)
+            content, _ = self._response_message(response)
+        except Exception as e:
+            logger.warning(f"批量生成答案失败，改为逐个生成: {str(e)}")
+            return {}
+
+        entries = self._parse_json_value(content, list) or []
+        entries = [entry for entry in entries if isinstance(entry, dict)]
+        prepared: Dict[int, Dict[str, Any]] = {}
+        # 优先按编号对应；没有编号时仅在数量一致的情况下按顺序对应
+        by_position = len(entries) == len(questions) and not any("id" in entry for entry in entries)
+        for position, entry in enumerate(entries):
+            if by_position:
+                index = position
+            else:
+                try:
+                    index = int(entry.get("id")) - 1
+                except (TypeError, ValueError):
+                    continue
+            if not 0 <= index < len(questions) or index in prepared:
+                continue
+            fields = self._extract_fields(entry, with_extras=self._use_fused())
+            if "answer" in fields:
+                prepared[index] = fields
+        if len(prepared) < len(questions):
+            logger.warning(f"批量答案只解析出 {len(prepared)}/{len(questions)} 个，其余问题逐个生成")
+        return prepared
+
     async def _generate_cot(self, question: str) -> str:
         """生成思维链"""
         logger.info(f"生成思维链: 问题: {question[:20]}...")
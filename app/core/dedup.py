@@ -0,0 +1,247 @@
+import hashlib
+import random
+import re
+import zlib
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from app.core.logger import logger
+
+_WHITESPACE = re.compile(r'\s+')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+# 大于 2^32 的素数，用于 (a * h + b) mod p 形式的随机置换
+_PRIME = 4294967311
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize(text: str) -> str:
+    """去重前的文本规范化：小写并合并空白"""
+    return _WHITESPACE.sub(' ', text).strip().lower()
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """字符 n-gram 集合（对中文同样适用），文本短于 size 时以整段文本作为唯一的 shingle"""
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    选择 LSH 分桶参数 (bands, rows)
+
+    相似度为 s 的两段文本至少落入同一个桶的概率为 1 - (1 - s^rows)^bands，
+    其拐点约为 (1/bands)^(1/rows)。取拐点不高于阈值且最接近阈值的组合，
+    候选对随后按签名估计的相似度再次过滤，因此宁可多召回。
+    """
+    best = (num_perm, 1)
+    best_gap = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        knee = (1 / bands) ** (1 / rows)
+        if knee <= threshold and (best_gap is None or threshold - knee < best_gap):
+            best, best_gap = (bands, rows), threshold - knee
+    return best
+
+
+class MinHashLSH:
+    """
+    基于 MinHash + LSH 的近似重复检测索引（纯 Python 实现）
+
+    每段文本计算 num_perm 个 MinHash 值作为签名，签名分为若干 band 建立哈希桶，
+    查询时只与同桶的文本比较，整体开销与已索引的文本数量基本无关。
+    两段文本的相似度（shingle 集合的 Jaccard 系数）由签名中相同位置相等的比例估计。
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _lsh_params(threshold, num_perm)
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+        self._buckets: List[Dict[tuple, List[Hashable]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[Hashable, tuple] = {}
+        # 规范化文本完全相同的情况直接按哈希命中，无需计算签名
+        self._exact: Dict[str, Hashable] = {}
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def signature(self, text: str) -> tuple:
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in shingles(text, self.shingle_size)]
+        return tuple(min([(a * h + b) % _PRIME for h in hashes]) & _MAX_HASH for a, b in self._perms)
+
+    def _band_keys(self, signature: tuple) -> Iterable[tuple]:
+        rows = self.rows
+        for band in range(self.bands):
+            yield signature[band * rows:(band + 1) * rows]
+
+    def query(self, text: str) -> Tuple[Optional[Hashable], float, Optional[tuple]]:
+        """
+        查找与 text 相似度不低于阈值的已索引文本
+
+        Returns:
+            (最相似文本的键或 None, 估计相似度, 签名)；签名可传给 add 避免重复计算
+        """
+        text = normalize(text)
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        if digest in self._exact:
+            return self._exact[digest], 1.0, None
+        signature = self.signature(text)
+        best, best_score = None, 0.0
+        seen = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            for key in buckets.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                other = self._signatures[key]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+                if score > best_score:
+                    best, best_score = key, score
+        if best is not None and best_score >= self.threshold:
+            return best, best_score, signature
+        return None, best_score, signature
+
+    def add(self, key: Hashable, text: str, signature: Optional[tuple] = None):
+        text = normalize(text)
+        self._exact.setdefault(hashlib.sha1(text.encode('utf-8')).hexdigest(), key)
+        if signature is None:
+            signature = self.signature(text)
+        self._signatures[key] = signature
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+
+class ChunkDeduplicator:
+    """
+    文档块近似去重，位于文档解析和问答生成之间
+
+    与已保留的文档块相似度达到阈值的块被跳过，不再生成问题和答案。
+    跳过记录保存在 skipped 中：
+    {"index": 来源中的序号, "chunk_id", "duplicate_of", "original": 被保留块的序号, "similarity", "chars"}。
+    """
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, shingle_size: int = 5):
+        self.index = MinHashLSH(threshold, num_perm=num_perm, shingle_size=shingle_size)
+        self.skipped: List[Dict[str, Any]] = []
+        self.kept = 0
+        # 索引以来源中的序号为键，不同文件的 chunk_id 可能相同
+        self._ids: Dict[int, str] = {}
+
+    @classmethod
+    def from_config(cls) -> "ChunkDeduplicator":
+        from app.core.config import config
+
+        return cls(config.CHUNK_DEDUP_THRESHOLD, num_perm=config.CHUNK_DEDUP_NUM_PERM,
+                   shingle_size=config.CHUNK_DEDUP_SHINGLE_SIZE)
+
+    def check(self, index: int, chunk: Dict[str, Any]) -> bool:
+        """判断来源中第 index 个文档块是否应保留；保留的块加入索引"""
+        content = chunk.get('content', '')
+        if not content.strip():
+            self.kept += 1
+            return True
+        chunk_id = chunk.get('chunk_id') or str(index)
+        duplicate_of, similarity, signature = self.index.query(content)
+        if duplicate_of is not None:
+            self.skipped.append({
+                "index": index,
+                "chunk_id": chunk_id,
+                "duplicate_of": self._ids[duplicate_of],
+                "original": duplicate_of,
+                "similarity": round(similarity, 3),
+                "chars": len(content),
+            })
+            logger.debug(f"跳过重复文档块 {chunk_id} (与 {self._ids[duplicate_of]} 相似度 {similarity:.2f})")
+            return False
+        self.index.add(index, content, signature)
+        self._ids[index] = chunk_id
+        self.kept += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kept": self.kept,
+            "skipped": len(self.skipped),
+            "skipped_chars": sum(item["chars"] for item in self.skipped),
+        }
+
+    def log_summary(self):
+        stats = self.stats()
+        if stats["skipped"]:
+            logger.info(f"文档块去重: 保留 {stats['kept']} 个, 跳过 {stats['skipped']} 个重复块 "
+                        f"(共 {stats['skipped_chars']} 字符)")
+
+
+class QuestionDeduplicator:
+    """
+    跨文档块的问题去重，位于问题生成和答案生成之间
+
+    各文档块独立生成问题，重叠的块和相似段落会产生大量近似相同的问题；
+    与已保留问题相似度达到阈值的问题被合并（不再生成答案、思维链、标签和优化）。
+    比较前去掉标点并规范化空白，问题较短，默认使用 3 字符的 shingle。
+    跳过记录保存在 skipped 中：
+    {"question", "chunk_id", "duplicate_of": 被保留的问题, "index": 来源块, "original": 保留该问题的来源块, "similarity"}，
+    来源块为调用方传入的 source（如文档块序号），增量构建据此记录文档块之间的依赖。
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, shingle_size: int = 3):
+        self.index = MinHashLSH(threshold, num_perm=num_perm, shingle_size=shingle_size)
+        self.skipped: List[Dict[str, Any]] = []
+        self.kept = 0
+        self._questions: List[str] = []
+        self._sources: List[Hashable] = []
+
+    @classmethod
+    def from_config(cls) -> "QuestionDeduplicator":
+        from app.core.config import config
+
+        return cls(config.QUESTION_DEDUP_THRESHOLD, num_perm=config.CHUNK_DEDUP_NUM_PERM)
+
+    def check(self, question: str, chunk_id: str = "", source: Hashable = None) -> bool:
+        """判断问题是否应保留；保留的问题加入索引"""
+        text = _PUNCTUATION.sub(' ', question)
+        if not text.strip():
+            self.kept += 1
+            return True
+        duplicate_of, similarity, signature = self.index.query(text)
+        if duplicate_of is not None:
+            self.skipped.append({
+                "question": question,
+                "chunk_id": chunk_id,
+                "duplicate_of": self._questions[duplicate_of],
+                "index": source,
+                "original": self._sources[duplicate_of],
+                "similarity": round(similarity, 3),
+            })
+            return False
+        self._add(question, text, source, signature)
+        self.kept += 1
+        return True
+
+    def seed(self, question: str, source: Hashable = None):
+        """把已有结果（如增量构建中复用的文档块）中的问题加入索引，不计入本次保留的数量"""
+        text = _PUNCTUATION.sub(' ', question)
+        if text.strip():
+            self._add(question, text, source)
+
+    def _add(self, question: str, text: str, source: Hashable, signature: Optional[tuple] = None):
+        self.index.add(len(self._questions), text, signature)
+        self._questions.append(question)
+        self._sources.append(source)
+
+    def stats(self, calls_per_question: int = 1) -> Dict[str, Any]:
+        return {
+            "kept": self.kept,
+            "skipped": len(self.skipped),
+            "saved_calls": len(self.skipped) * calls_per_question,
+        }
+
+    def log_summary(self, calls_per_question: int = 1):
+        stats = self.stats(calls_per_question)
+        if stats["skipped"]:
+            logger.info(f"问题去重: 保留 {stats['kept']} 个, 合并 {stats['skipped']} 个重复问题, "
+                        f"节省约 {stats['saved_calls']} 次 LLM 调用")
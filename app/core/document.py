@@ -1,9 +1,70 @@
+import asyncio
+import bisect
 import os
-import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Iterable, Iterator, Optional, Tuple
 from app.core.logger import logger
 from app.core.config import config
+from app.core.cache import ParseCache
+from app.core.chunker import TextChunker, TokenChunker
+from app.core.pdf import iter_pdf_pages, resolve_backend
+from app.core.reader import iter_text, read_text
+from app.core.splitter import MarkdownSplitter
+from app.core.tokenizer import get_tokenizer
+
+# 解析失败时 textract 分支返回的占位内容前缀，这类结果不写入缓存
+_PLACEHOLDER_PREFIX = "无法解析文档"
+
+# 工作进程内复用的文档处理器，按分块参数缓存
+_worker_processors: Dict[tuple, "DocumentProcessor"] = {}
+
+
+def _process_document_worker(file_path: str, chunk_size: Optional[int], chunk_overlap: int,
+                             settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """进程池中执行的文档处理函数；显式传入分块参数，spawn 模式下也能沿用主进程的配置"""
+    key = tuple(sorted(settings.items()))
+    processor = _worker_processors.get(key)
+    if processor is None:
+        processor = DocumentProcessor()
+        processor.apply_chunk_settings(settings)
+        # 已按文件并行，单个 PDF 不再启动页面进程池
+        processor.pdf_workers = 1
+        _worker_processors[key] = processor
+    return processor.process_document(file_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _kill_pool(executor: ProcessPoolExecutor):
+    """终止进程池中的所有工作进程（用于处理超时卡死的解析任务）"""
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        try:
+            process.kill()
+        except Exception:
+            pass
+    try:
+        executor.shutdown(wait=False, cancel_futures=True)
+    except TypeError:  # Python 3.8 不支持 cancel_futures
+        executor.shutdown(wait=False)
+
+
+async def _aiter_in_thread(iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """在后台线程中推进同步迭代器，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    # 生成器不能被并发推进，单线程执行器保证 next() 和 close() 依次执行
+    executor = ThreadPoolExecutor(max_workers=1)
+    finished = object()
+    try:
+        while True:
+            entry = await loop.run_in_executor(executor, next, iterator, finished)
+            if entry is finished:
+                break
+            yield entry
+    finally:
+        executor.submit(iterator.close)
+        executor.shutdown(wait=False)
+
 
 class DocumentProcessor:
     """文档处理器，用于解析和处理文档内容"""
@@ -12,7 +73,52 @@ class DocumentProcessor:
         self.supported_formats = [".pdf", ".docx", ".txt", ".md"]
         self.chunk_min_len = config.CHUNK_MIN_LEN
         self.chunk_max_len = config.CHUNK_MAX_LEN
-        logger.info("DocumentProcessor 初始化，使用 textract 解析文档")
+        self.chunk_compat = config.CHUNK_COMPAT_MODE
+        # chunk_unit 为 "tokens" 时，块长度上下限和 chunk_size / chunk_overlap 均以 token 计
+        self.chunk_unit = config.CHUNK_UNIT
+        self.tokenizer_name = config.CHUNK_TOKENIZER
+        self.tokenizer = None
+        if self.chunk_unit == "tokens":
+            self.chunk_min_len = config.CHUNK_MIN_TOKENS
+            self.chunk_max_len = config.CHUNK_MAX_TOKENS
+            self.tokenizer = get_tokenizer(self.tokenizer_name)
+        self.cache = ParseCache.from_config() if config.PARSE_CACHE_ENABLED else None
+        self._digest_memo = None
+        # 原生 PDF 后端（None 表示使用 textract）及按页并行提取的进程数
+        self.pdf_backend = resolve_backend(config.PDF_BACKEND)
+        self.pdf_workers = config.PDF_PAGE_WORKERS
+        logger.info(f"DocumentProcessor 初始化，PDF 使用 {self.pdf_backend or 'textract'} 解析，其他二进制文档使用 textract")
+    
+    def chunk_settings(self) -> Dict[str, Any]:
+        """影响分块结果的全部参数，用于传给工作进程和生成缓存键"""
+        return {
+            "chunk_min_len": self.chunk_min_len,
+            "chunk_max_len": self.chunk_max_len,
+            "chunk_compat": self.chunk_compat,
+            "chunk_unit": self.chunk_unit,
+            "tokenizer": getattr(self.tokenizer, "name", self.tokenizer_name) if self.tokenizer else None,
+        }
+    
+    def apply_chunk_settings(self, settings: Dict[str, Any]):
+        self.chunk_min_len = settings["chunk_min_len"]
+        self.chunk_max_len = settings["chunk_max_len"]
+        self.chunk_compat = settings["chunk_compat"]
+        self.chunk_unit = settings["chunk_unit"]
+        if settings["tokenizer"]:
+            self.tokenizer_name = settings["tokenizer"]
+            self.tokenizer = get_tokenizer(self.tokenizer_name)
+    
+    def _file_digest(self, file_path: Path) -> Optional[str]:
+        """文件内容哈希；同一文件先后用于文本缓存和分块缓存时只计算一次"""
+        try:
+            stat = file_path.stat()
+            stamp = (str(file_path), stat.st_size, stat.st_mtime_ns)
+            if self._digest_memo is None or self._digest_memo[0] != stamp:
+                self._digest_memo = (stamp, ParseCache.file_digest(str(file_path)))
+            return self._digest_memo[1]
+        except OSError as e:
+            logger.warning(f"计算文件哈希失败，跳过解析缓存 {file_path}: {str(e)}")
+            return None
     
     def parse_document(self, file_path: str) -> str:
         """
@@ -34,20 +140,34 @@ class DocumentProcessor:
             logger.error(f"不支持的文件格式: {suffix}")
             return ""
             
+        cache_key = None
+        if self.cache is not None:
+            digest = self._file_digest(file_path)
+            if digest:
+                cache_key = ParseCache.make_key("text", digest, suffix=suffix)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"使用缓存的解析结果: {file_path}")
+                    return cached
+        
         logger.info(f"解析文档: {file_path}")
         
         try:
             # 使用 textract 解析二进制文档 (.pdf, .docx 等)
             if suffix in [".pdf", ".docx"]:
-                return self._parse_with_textract(file_path)
+                text = self._parse_with_textract(file_path)
             # 使用内置方法解析文本文档 (.txt, .md)
             elif suffix in [".txt", ".md"]:
-                return self._parse_txt(file_path)
-            
-            return ""
+                text = self._parse_txt(file_path)
+            else:
+                text = ""
         except Exception as e:
             logger.error(f"解析文档失败 {file_path}: {str(e)}")
             return ""
+        
+        if cache_key and text and not text.startswith(_PLACEHOLDER_PREFIX):
+            self.cache.set(cache_key, text)
+        return text
     
     def process_document(self, file_path: str, chunk_size: int = None, chunk_overlap: int = 200) -> List[Dict[str, Any]]:
         """
@@ -61,52 +181,364 @@ class DocumentProcessor:
         Returns:
             List[Dict[str, Any]]: 文档块列表
         """
+        if chunk_size is None:
+            chunk_size = self.chunk_max_len
+        
+        cache_key = self._chunk_cache_key(file_path, chunk_size, chunk_overlap)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"使用缓存的文档块: {file_path} ({len(cached)} 个)")
+                return cached
+        
+        # 纯文本文件边读取边分块，不在内存中保留全文；返回值仍是完整的块列表，
+        # 需要峰值内存与文件大小无关时使用 iter_txt_chunks / astream_chunks
+        if file_path.lower().endswith('.txt') and Path(file_path).is_file():
+            logger.info(f"解析文档: {file_path}")
+            try:
+                result = self._chunk_text(file_path, iter_text(file_path), chunk_size, chunk_overlap)
+            except Exception as e:
+                logger.error(f"解析 TXT 文件失败: {str(e)}")
+                return []
+            if cache_key and result:
+                self.cache.set(cache_key, result)
+            return result
+        
+        # PDF 优先使用原生后端按页提取，失败或没有提取到文本时退回 textract
+        if file_path.lower().endswith('.pdf') and self.pdf_backend and Path(file_path).is_file():
+            result = self._process_pdf(file_path, chunk_size, chunk_overlap)
+            if result:
+                if cache_key:
+                    self.cache.set(cache_key, result)
+                return result
+        
         content = self.parse_document(file_path)
         if not content:
             return []
-            
-        if chunk_size is None:
-            chunk_size = self.chunk_max_len
         
         # 处理 Markdown 文档
         if file_path.lower().endswith('.md'):
-            return self._process_markdown(Path(file_path), content)
-            
-        # 分割文档
-        chunks = self._split_text(content, chunk_size, chunk_overlap)
+            result = self._process_markdown(Path(file_path), content)
+        else:
+            result = self._chunk_text(file_path, [content], chunk_size, chunk_overlap)
         
-        # 创建文档块列表
-        result = []
-        for i, chunk in enumerate(chunks):
-            result.append({
-                "id": f"{Path(file_path).stem}_{i}",
+        if cache_key and result and not content.startswith(_PLACEHOLDER_PREFIX):
+            self.cache.set(cache_key, result)
+        return result
+    
+    def _chunk_cache_key(self, file_path: str, chunk_size: int, chunk_overlap: int) -> Optional[str]:
+        """文档块缓存键：文件内容哈希 + 路径（块中记录了来源）+ 分块参数"""
+        if self.cache is None or not Path(file_path).is_file():
+            return None
+        digest = self._file_digest(Path(file_path))
+        if not digest:
+            return None
+        params = dict(self.chunk_settings())
+        if file_path.lower().endswith('.pdf'):
+            params["pdf_backend"] = self.pdf_backend or "textract"
+        return ParseCache.make_key(
+            "chunks", digest,
+            path=str(file_path),
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            **params,
+        )
+    
+    def _process_pdf(self, file_path: str, chunk_size: int, chunk_overlap: int) -> List[Dict[str, Any]]:
+        """使用原生后端按页提取 PDF 文本并分块，块的 metadata 中记录起止页码；失败时返回空列表"""
+        logger.info(f"解析文档: {file_path} (PDF 后端: {self.pdf_backend})")
+        # 每页文本在拼接结果中的结束偏移及对应页码
+        page_ends: List[int] = []
+        page_numbers: List[int] = []
+        
+        def pages() -> Iterator[str]:
+            end = 0
+            for number, text in iter_pdf_pages(file_path, self.pdf_backend, workers=self.pdf_workers):
+                if not text.strip():
+                    continue
+                text += "\n"
+                end += len(text)
+                page_ends.append(end)
+                page_numbers.append(number)
+                yield text
+        
+        try:
+            return self._chunk_text(file_path, pages(), chunk_size, chunk_overlap, pages=(page_ends, page_numbers))
+        except Exception as e:
+            logger.warning(f"{self.pdf_backend} 解析 PDF 失败，改用 textract {file_path}: {str(e)}")
+            return []
+    
+    def _chunk_text(self, file_path: str, blocks: Iterable[str], chunk_size: int, chunk_overlap: int,
+                    pages: Optional[Tuple[List[int], List[int]]] = None) -> List[Dict[str, Any]]:
+        """
+        把按顺序到达的文本片段分割为文档块列表
+        
+        pages 为 (各页结束偏移, 页码) 时，在块的 metadata 中记录 page_start / page_end
+        """
+        result = list(self._iter_chunks(file_path, blocks, chunk_size, chunk_overlap, pages=pages))
+        for chunk in result:
+            chunk["metadata"]["total_chunks"] = len(result)
+        logger.info(f"文档已分割为 {len(result)} 个块")
+        return result
+    
+    def _iter_chunks(self, file_path: str, blocks: Iterable[str], chunk_size: int, chunk_overlap: int,
+                     pages: Optional[Tuple[List[int], List[int]]] = None) -> Iterator[Dict[str, Any]]:
+        """逐个产出文档块；总块数在分割结束前未知，metadata 中的 total_chunks 为 None，由调用方按需填写"""
+        # 分割文档，得到 (块文本, 起始偏移, 结束偏移, token 数)；按 token 分块时才记录 token 数
+        if self.chunk_unit == "tokens":
+            chunker = TokenChunker(self.tokenizer, chunk_size, chunk_overlap)
+            pieces = ((text, start, end, tokens) for text, tokens, start, end in chunker.split_spans(blocks))
+        else:
+            chunker = TextChunker(chunk_size, chunk_overlap, compat=self.chunk_compat)
+            pieces = ((text, start, end, None) for text, start, end in chunker.split_spans(blocks))
+        
+        stem = Path(file_path).stem
+        for i, (chunk, start, end, tokens) in enumerate(pieces):
+            item = {
+                "id": f"{stem}_{i}",
                 "content": chunk,
                 "summary": self._generate_summary(chunk),
                 "file": str(file_path),
-                "chunk_id": f"{Path(file_path).stem}_part_{i+1}",
+                "chunk_id": f"{stem}_part_{i+1}",
                 "metadata": {
                     "source": str(file_path),
                     "chunk_id": i,
-                    "total_chunks": len(chunks)
+                    "total_chunks": None
                 }
-            })
+            }
+            if tokens is not None:
+                item["metadata"]["tokens"] = tokens
+            if pages and pages[0]:
+                page_ends, page_numbers = pages
+                item["metadata"]["page_start"] = page_numbers[bisect.bisect_right(page_ends, start)]
+                item["metadata"]["page_end"] = page_numbers[bisect.bisect_left(page_ends, end)]
+            yield item
+    
+    def _streams_txt(self, file_path: str) -> bool:
+        """超过 TXT_STREAM_MIN_BYTES 的 .txt 文件在 astream_chunks 中逐块产出，不整体缓存"""
+        threshold = config.TXT_STREAM_MIN_BYTES
+        if threshold <= 0 or not file_path.lower().endswith('.txt'):
+            return False
+        try:
+            return os.path.getsize(file_path) >= threshold
+        except OSError:
+            return False
+    
+    def iter_txt_chunks(self, file_path: str, chunk_size: int = None,
+                        chunk_overlap: int = 200) -> Iterator[Dict[str, Any]]:
+        """
+        边读取边分块，逐个产出 .txt 文件的文档块，峰值内存与文件大小无关
+        
+        不读写解析缓存（缓存需要完整的块列表），metadata 中的 total_chunks 为 None。
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_max_len
+        logger.info(f"流式解析文档: {file_path}")
+        count = 0
+        try:
+            for chunk in self._iter_chunks(file_path, iter_text(file_path), chunk_size, chunk_overlap):
+                count += 1
+                yield chunk
+        except Exception as e:
+            logger.error(f"解析 TXT 文件失败: {str(e)}")
+        logger.info(f"文档已分割为 {count} 个块")
+    
+    def process_documents(self, file_paths: Iterable[str], chunk_size: int = None, chunk_overlap: int = 200,
+                          workers: int = 1, ordered: bool = True,
+                          timeout: Optional[float] = None) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        批量处理文档，workers > 1 时在进程池中并行解析和分块
+        
+        Args:
+            file_paths: 文档路径列表
+            chunk_size: 块大小
+            chunk_overlap: 块重叠大小
+            workers: 并行进程数，1 表示在当前进程串行处理
+            ordered: 是否按输入顺序产出结果；False 时按完成顺序产出
+            timeout: 单个文件的处理超时（秒），默认使用 DOCUMENT_EXTRACTION_TIMEOUT，仅并行模式生效
             
-        logger.info(f"文档已分割为 {len(result)} 个块")
-        return result
+        工作进程异常退出（段错误、被 OOM 终止等）时重建进程池，当时正在处理的文件重新提交并单独运行，
+        再次崩溃的文件按失败处理。
+            
+        Yields:
+            Tuple[str, List[Dict[str, Any]]]: (文档路径, 文档块列表)，失败、超时或导致进程崩溃的文件产出空列表
+        """
+        file_paths = [str(fp) for fp in file_paths]
+        if workers is None or workers <= 1 or len(file_paths) <= 1:
+            for file_path in file_paths:
+                try:
+                    yield file_path, self.process_document(file_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+                except Exception as e:
+                    logger.error(f"处理文档失败 {file_path}: {str(e)}")
+                    yield file_path, []
+            return
+        
+        if timeout is None:
+            timeout = config.DOCUMENT_EXTRACTION_TIMEOUT
+        workers = min(workers, len(file_paths))
+        logger.info(f"使用 {workers} 个进程并行处理 {len(file_paths)} 个文档")
+        
+        queue = list(enumerate(file_paths))
+        queue.reverse()
+        finished: Dict[int, List[Dict[str, Any]]] = {}
+        next_index = 0
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # 同时提交的任务数不超过进程数，提交时间近似于开始处理的时间，用于计算单文件超时
+        pending: Dict[Any, Tuple[int, str, float]] = {}
+        # 进程池崩溃时正在处理的文件；重新提交时单独运行，以便确定再次崩溃的原因
+        suspects = set()
+        
+        def restart():
+            nonlocal executor
+            _kill_pool(executor)
+            executor = ProcessPoolExecutor(max_workers=workers)
+        
+        def submit():
+            while queue and len(pending) < workers:
+                index, file_path = queue[-1]
+                if pending and (index in suspects or any(i in suspects for i, _, _ in pending.values())):
+                    return
+                queue.pop()
+                try:
+                    future = executor.submit(_process_document_worker, file_path, chunk_size, chunk_overlap,
+                                             self.chunk_settings())
+                except BrokenProcessPool:
+                    queue.append((index, file_path))
+                    if pending:
+                        # 正在处理的任务会报告崩溃，由主循环统一恢复
+                        return
+                    restart()
+                    continue
+                pending[future] = (index, file_path, time.monotonic())
+        
+        try:
+            submit()
+            while pending:
+                now = time.monotonic()
+                wait_for = None
+                if timeout:
+                    wait_for = max(0.0, min(start + timeout for _, _, start in pending.values()) - now)
+                done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+                
+                broken = []
+                for future in done:
+                    index, file_path, _ = pending.pop(future)
+                    try:
+                        finished[index] = future.result()
+                    except BrokenProcessPool:
+                        broken.append((index, file_path))
+                        continue
+                    except Exception as e:
+                        # 单个文件失败不影响其他文件
+                        logger.error(f"处理文档失败 {file_path}: {str(e)}")
+                        finished[index] = []
+                    if not ordered:
+                        yield file_path, finished.pop(index)
+                
+                if broken:
+                    # 工作进程异常退出后进程池不可再用，无法得知是哪个文件导致的，
+                    # 所有未完成的文件重新提交；已经历过一次崩溃的文件按失败处理
+                    broken += [(index, file_path) for index, file_path, _ in pending.values()]
+                    pending.clear()
+                    retried = 0
+                    for index, file_path in broken:
+                        if index in suspects:
+                            logger.error(f"处理文档时工作进程崩溃: {file_path}")
+                            finished[index] = []
+                            if not ordered:
+                                yield file_path, finished.pop(index)
+                        else:
+                            suspects.add(index)
+                            queue.append((index, file_path))
+                            retried += 1
+                    logger.warning(f"文档解析进程异常退出，重建进程池并重新处理 {retried} 个文件")
+                    queue.sort(reverse=True)
+                    restart()
+                
+                if timeout:
+                    now = time.monotonic()
+                    expired = [f for f, (_, _, start) in pending.items() if now - start >= timeout]
+                    if expired:
+                        # 卡死的工作进程无法单独回收，重建进程池并重新提交其余未完成的文件
+                        for future in expired:
+                            index, file_path, _ = pending.pop(future)
+                            logger.error(f"处理文档超时 ({timeout} 秒): {file_path}")
+                            finished[index] = []
+                            if not ordered:
+                                yield file_path, finished.pop(index)
+                        for future, (index, file_path, _) in pending.items():
+                            queue.append((index, file_path))
+                        queue.sort(reverse=True)
+                        pending.clear()
+                        restart()
+                
+                if ordered:
+                    while next_index in finished:
+                        yield file_paths[next_index], finished.pop(next_index)
+                        next_index += 1
+                submit()
+        finally:
+            if pending or queue:
+                _kill_pool(executor)
+            else:
+                executor.shutdown(wait=True)
+    
+    async def aprocess_documents(self, file_paths: Iterable[str], chunk_size: int = None, chunk_overlap: int = 200,
+                                 workers: int = 1, ordered: bool = True,
+                                 timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        process_documents 的异步版本，解析在后台线程中进行，不阻塞事件循环
+        
+        每个文件处理完成后立即产出，调用方可以在后续文件仍在解析时开始消费。
+        参数与 process_documents 相同。
+        """
+        results = self.process_documents(file_paths, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                         workers=workers, ordered=ordered, timeout=timeout)
+        entries = _aiter_in_thread(results)
+        try:
+            async for entry in entries:
+                yield entry
+        finally:
+            # 提前结束时立即关闭生成器，回收进程池
+            await entries.aclose()
+    
+    async def astream_chunks(self, file_paths: Iterable[str], chunk_size: int = None, chunk_overlap: int = 200,
+                             workers: int = 1, ordered: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        逐个产出所有文档的文档块，可直接传给 DatasetBuilder.build_dataset，
+        使文档解析与问答生成重叠进行
+        
+        超过 TXT_STREAM_MIN_BYTES 的 .txt 文件按输入顺序边读取边产出，不在内存中保留整个文件的块列表；
+        其余文件按原方式（可并行）整体处理。
+        """
+        file_paths = [str(fp) for fp in file_paths]
+        group: List[str] = []
+        for file_path in file_paths + [None]:
+            if file_path is not None and not self._streams_txt(file_path):
+                group.append(file_path)
+                continue
+            if group:
+                documents = self.aprocess_documents(group, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                                    workers=workers, ordered=ordered)
+                try:
+                    async for _, chunks in documents:
+                        for chunk in chunks:
+                            yield chunk
+                finally:
+                    await documents.aclose()
+                group = []
+            if file_path is not None:
+                stream = _aiter_in_thread(self.iter_txt_chunks(file_path, chunk_size, chunk_overlap))
+                try:
+                    async for chunk in stream:
+                        yield chunk
+                finally:
+                    await stream.aclose()
     
     def _parse_txt(self, file_path: Path) -> str:
-        """解析 TXT 文件"""
+        """解析 TXT 文件，编码根据文件开头的样本检测一次（UTF-8 / GBK）"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except UnicodeDecodeError:
-            # 如果 UTF-8 失败，尝试其他编码
-            try:
-                with open(file_path, 'r', encoding='gbk') as f:
-                    return f.read()
-            except Exception as e:
-                logger.error(f"解析 TXT 文件失败 (GBK): {str(e)}")
-                return ""
+            return read_text(str(file_path))
         except Exception as e:
             logger.error(f"解析 TXT 文件失败: {str(e)}")
             return ""
@@ -122,55 +554,17 @@ class DocumentProcessor:
                 return f"无法解析文档 {file_path.name}（缺少 textract），请安装可选依赖: pip install 'fastdatasets[doc]'"
 
             logger.info(f"使用 textract 解析文件: {file_path}")
-            text = textract.process(str(file_path)).decode('utf-8')
-            return text
-        except UnicodeDecodeError:
+            output = textract.process(str(file_path))
             try:
-                # 尝试其他编码
-                text = textract.process(str(file_path)).decode('gbk')
-                return text
-            except Exception as e:
-                logger.error(f"textract 解析文件失败 (GBK): {str(e)}")
-                # 如果解析失败，返回占位内容
-                return f"无法解析文档 {file_path.name}，这是一个占位内容。"
+                return output.decode('utf-8')
+            except UnicodeDecodeError:
+                # 尝试其他编码，无需再次运行 textract
+                return output.decode('gbk')
         except Exception as e:
             logger.error(f"textract 解析文件失败: {str(e)}")
             # 如果解析失败，返回占位内容
             return f"无法解析文档 {file_path.name}，这是一个占位内容。"
     
-    def _extract_outline(self, text: str) -> List[Dict[str, Any]]:
-        """提取 Markdown 文本大纲（所有标题）"""
-        outline = []
-        for match in re.finditer(r'^(#{1,6})\s+(.+?)(?:\s*\{#[\w-]+\})?\s*$', text, re.MULTILINE):
-            level = len(match.group(1))
-            title = match.group(2).strip()
-            outline.append({'level': level, 'title': title, 'position': match.start()})
-        return outline
-    
-    def _split_by_headings(self, text: str, outline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """按标题分割 Markdown 文本"""
-        if not outline:
-            return [{'heading': None, 'level': 0, 'content': text, 'position': 0}]
-        sections = []
-        # 前言
-        if outline[0]['position'] > 0:
-            front = text[:outline[0]['position']].strip()
-            if front:
-                sections.append({'heading': None, 'level': 0, 'content': front, 'position': 0})
-        # 标题分块
-        for i, current in enumerate(outline):
-            next_pos = outline[i+1]['position'] if i+1 < len(outline) else len(text)
-            heading_line = text[current['position']:].split('\n', 1)[0]
-            start = current['position'] + len(heading_line) + 1
-            content = text[start:next_pos].strip()
-            sections.append({
-                'heading': current['title'],
-                'level': current['level'],
-                'content': content,
-                'position': current['position']
-            })
-        return sections
-    
     def _generate_summary(self, text: str, max_length: int = 100) -> str:
         """为文本块生成摘要"""
         if not text:
@@ -178,11 +572,14 @@ class DocumentProcessor:
         # 简单实现：取前N个字符
         return text[:max_length].replace("\n", " ")
     
+    def markdown_splitter(self) -> MarkdownSplitter:
+        """按当前分块参数创建 Markdown 分块引擎"""
+        return MarkdownSplitter(self.chunk_min_len, self.chunk_max_len, compat=self.chunk_compat,
+                                tokenizer=self.tokenizer if self.chunk_unit == "tokens" else None)
+    
     def _process_markdown(self, file_path: Path, content: str) -> List[Dict[str, Any]]:
         """处理 Markdown 内容"""
-        outline = self._extract_outline(content)
-        sections = self._split_by_headings(content, outline)
-        chunks = self._split_sections(sections, outline)
+        chunks = self.markdown_splitter().split(content)
         
         result = []
         for i, chunk in enumerate(chunks):
@@ -199,101 +596,11 @@ class DocumentProcessor:
                     "total_chunks": len(chunks)
                 }
             })
+            if self.chunk_unit == "tokens":
+                result[-1]["metadata"]["tokens"] = self.tokenizer.count(chunk['content'])
         
         return result
     
-    def _generate_section_summary(self, section: Dict[str, Any], outline: List[Dict[str, Any]]) -> str:
-        """为 Markdown 段落生成摘要"""
-        content = section.get('content', '').strip()
-        if content:
-            return content[:100]
-        if (not section.get('heading') and section.get('level', 0) == 0):
-            doc_title = outline[0]['title'] if outline and outline[0]['level'] == 1 else '文档'
-            return f"{doc_title} 前言"
-        if section.get('heading'):
-            idx = next((i for i, o in enumerate(outline) if o['title'] == section['heading'] and o['level'] == section['level']), -1)
-            if idx == -1:
-                return section['heading']
-            parent_titles = []
-            parent_level = section['level'] - 1
-            for i in range(idx-1, -1, -1):
-                if outline[i]['level'] == parent_level:
-                    parent_titles.insert(0, outline[i]['title'])
-                    parent_level -= 1
-            if parent_titles:
-                return ' > '.join(parent_titles) + ' > ' + section['heading']
-            return section['heading']
-        return '未命名段落'
-    
-    def _split_sections(self, sections: List[Dict[str, Any]], outline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """合并过短段落，拆分过长段落，生成摘要"""
-        result = []
-        buffer = None
-        for section in sections:
-            content = section['content'].strip()
-            if len(content) < self.chunk_min_len:
-                if buffer:
-                    buffer['content'] += '\n\n' + (f"{'#'*section['level']} {section['heading']}\n" if section['heading'] else '') + content
-                else:
-                    buffer = section.copy()
-            else:
-                if buffer:
-                    merged = buffer['content'] + '\n\n' + content
-                    if len(merged) <= self.chunk_max_len:
-                        buffer['content'] = merged
-                        result.append({
-                            'summary': self._generate_section_summary(buffer, outline), 
-                            'content': buffer['content'],
-                            'heading': buffer.get('heading')
-                        })
-                        buffer = None
-                    else:
-                        result.append({
-                            'summary': self._generate_section_summary(buffer, outline), 
-                            'content': buffer['content'],
-                            'heading': buffer.get('heading')
-                        })
-                        result.append({
-                            'summary': self._generate_section_summary(section, outline), 
-                            'content': content,
-                            'heading': section.get('heading')
-                        })
-                        buffer = None
-                else:
-                    if len(content) > self.chunk_max_len:
-                        # 按句子或定长切分
-                        sentences = re.split(r'(?<=[。！？.!?])', content)
-                        chunk = ''
-                        for sent in sentences:
-                            if len(chunk) + len(sent) > self.chunk_max_len:
-                                result.append({
-                                    'summary': self._generate_section_summary(section, outline), 
-                                    'content': chunk,
-                                    'heading': section.get('heading')
-                                })
-                                chunk = sent
-                            else:
-                                chunk += sent
-                        if chunk:
-                            result.append({
-                                'summary': self._generate_section_summary(section, outline), 
-                                'content': chunk,
-                                'heading': section.get('heading')
-                            })
-                    else:
-                        result.append({
-                            'summary': self._generate_section_summary(section, outline), 
-                            'content': content,
-                            'heading': section.get('heading')
-                        })
-        if buffer:
-            result.append({
-                'summary': self._generate_section_summary(buffer, outline), 
-                'content': buffer['content'],
-                'heading': buffer.get('heading')
-            })
-        return result
-    
     def _split_text(self, text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
         """
         将文本分割成块
@@ -308,51 +615,5 @@ class DocumentProcessor:
         """
         if not text:
             return []
-            
-        # 尝试按句子分割
-        sentences = re.split(r'(?<=[。！？.!?])', text)
-        
-        # 组合句子成块
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-                
-            # 如果当前块 + 新句子超过最大长度，保存当前块并开始新块
-            if len(current_chunk) + len(sentence) > chunk_size and current_chunk:
-                chunks.append(current_chunk)
-                # 保留部分重叠内容
-                if chunk_overlap > 0 and len(current_chunk) > chunk_overlap:
-                    # 找到最后一个句子结束符的位置
-                    overlap_pos = max(current_chunk.rfind("。"), current_chunk.rfind("！"), 
-                                   current_chunk.rfind("？"), current_chunk.rfind("."), 
-                                   current_chunk.rfind("!"), current_chunk.rfind("?"))
-                    
-                    if overlap_pos != -1 and overlap_pos >= len(current_chunk) - chunk_overlap:
-                        current_chunk = current_chunk[overlap_pos+1:]
-                    else:
-                        current_chunk = current_chunk[-chunk_overlap:] if len(current_chunk) > chunk_overlap else current_chunk
-                else:
-                    current_chunk = ""
-            
-            current_chunk += sentence
-        
-        # 添加最后一个块
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        # 如果没有成功分块，回退到简单的字符分割
-        if not chunks:
-            chunks = []
-            i = 0
-            text_len = len(text)
-            
-            while i < text_len:
-                end = min(i + chunk_size, text_len)
-                chunk = text[i:end]
-                chunks.append(chunk)
-                i += chunk_size - chunk_overlap
-                
-        return chunks
\ No newline at end of file
+        # 基于偏移量按句子累积，兼容模式下与旧实现的输出一致
+        return list(TextChunker(chunk_size, chunk_overlap, compat=self.chunk_compat).split(text))
\ No newline at end of file
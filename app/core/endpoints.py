@@ -0,0 +1,183 @@
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.circuit import CircuitBreaker
+from app.core.logger import logger
+
+# 路由策略：least_outstanding 按 (进行中请求数 + 1) / 权重 选择；latency 再乘以延迟的滑动平均
+ROUTING = ("least_outstanding", "latency")
+
+
+class Endpoint:
+    """一个 OpenAI 兼容的 LLM 端点及其运行状态"""
+
+    def __init__(self, base_url: str, api_key: str, model_name: str, weight: float = 1.0,
+                 name: Optional[str] = None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model_name = model_name
+        self.weight = max(float(weight), 0.01)
+        self.name = name or base_url
+        self.outstanding = 0
+        # 成功请求耗时的指数滑动平均（秒），尚无样本时为 None
+        self.latency: Optional[float] = None
+        # 端点池按其失败阈值和冷却时间重新创建
+        self.breaker = CircuitBreaker()
+        self.requests = 0
+        self.errors = 0
+
+    def healthy(self, now: Optional[float] = None) -> bool:
+        return self.breaker.available(now)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "healthy": self.healthy(),
+            "circuit": self.breaker.stats(),
+        }
+
+
+class EndpointPool:
+    """
+    多端点负载均衡和故障转移
+
+    每次请求（包括重试）调用 select 选择端点：优先选择健康且不慢的端点，其中负载最低的一个；
+    每个端点有一个熔断器：连续失败 failure_threshold 次后打开，cooldown 秒内不再被选中，
+    之后半开放行一个探测请求，成功才恢复；
+    延迟滑动平均超过最快端点 slow_factor 倍的端点视为变慢，只在没有其他端点时使用。
+    同一请求重试时排除已失败过的端点，从而自动切换到其他副本。
+    """
+
+    def __init__(self, endpoints: Iterable[Endpoint], routing: str = "least_outstanding",
+                 failure_threshold: int = 3, cooldown: float = 30.0, slow_factor: float = 3.0,
+                 smoothing: float = 0.3):
+        self.endpoints: List[Endpoint] = list(endpoints)
+        if not self.endpoints:
+            raise ValueError("端点列表不能为空")
+        if routing not in ROUTING:
+            logger.warning(f"未知的路由策略 {routing}，使用 least_outstanding")
+            routing = "least_outstanding"
+        self.routing = routing
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.smoothing = smoothing
+        for endpoint in self.endpoints:
+            endpoint.breaker = CircuitBreaker(self.failure_threshold, cooldown)
+
+    @classmethod
+    def from_config(cls, base_url: str, api_key: str, model_name: str) -> "EndpointPool":
+        """
+        按 LLM_ENDPOINTS 创建端点池；未配置时只包含单个默认端点
+
+        LLM_ENDPOINTS 为 JSON 数组，每项 {"base_url", "api_key", "model", "weight", "name"}，
+        缺少的 api_key / model 使用默认端点的值。
+        """
+        from app.core.config import config
+
+        endpoints = []
+        raw = (config.LLM_ENDPOINTS or "").strip()
+        if raw:
+            try:
+                for item in json.loads(raw):
+                    endpoints.append(Endpoint(item["base_url"], item.get("api_key") or api_key,
+                                              item.get("model") or model_name, weight=item.get("weight", 1.0),
+                                              name=item.get("name")))
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"LLM_ENDPOINTS 配置无效，使用默认端点: {str(e)}")
+                endpoints = []
+        if not endpoints:
+            endpoints = [Endpoint(base_url, api_key, model_name)]
+        return cls(endpoints, routing=config.LLM_ROUTING,
+                   failure_threshold=config.LLM_ENDPOINT_FAILURE_THRESHOLD,
+                   cooldown=config.LLM_ENDPOINT_COOLDOWN, slow_factor=config.LLM_ENDPOINT_SLOW_FACTOR)
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def _slow(self, endpoint: Endpoint, fastest: Optional[float]) -> bool:
+        return (endpoint.latency is not None and fastest is not None and self.slow_factor > 0
+                and endpoint.latency > fastest * self.slow_factor)
+
+    def _ranked(self, exclude: Iterable[Endpoint] = ()) -> List[Endpoint]:
+        """
+        健康端点按优先级排序：未失败过 > 不慢 > 负载得分低
+
+        已失败过的端点只要熔断器未打开，仍优先于熔断的端点；所有端点都熔断时才按恢复时间返回熔断的端点。
+        """
+        now = time.monotonic()
+        excluded = set(map(id, exclude))
+        healthy = [e for e in self.endpoints if e.healthy(now)]
+        if not healthy:
+            # 全部熔断时选择最早恢复的端点
+            return sorted(self.endpoints, key=lambda e: e.breaker.retry_after(now))
+        latencies = [e.latency for e in healthy if e.latency is not None]
+        fastest = min(latencies) if latencies else None
+
+        def score(endpoint: Endpoint) -> float:
+            load = (endpoint.outstanding + 1) / endpoint.weight
+            if self.routing == "latency":
+                # 尚无样本的端点按最快端点估计，保证新端点能获得流量
+                return load * (endpoint.latency or fastest or 1.0)
+            return load
+
+        return sorted(healthy, key=lambda e: (id(e) in excluded, self._slow(e, fastest), score(e)))
+
+    def select(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """选择一个端点，exclude 为本次请求已失败的端点（没有其他健康端点时仍可能被选中）"""
+        return self._ranked(exclude)[0]
+
+    def has_alternative(self, exclude: Iterable[Endpoint]) -> bool:
+        """除 exclude 外是否还有健康的端点，有则重试时无需退避等待"""
+        now = time.monotonic()
+        excluded = set(map(id, exclude))
+        return any(id(e) not in excluded and e.healthy(now) for e in self.endpoints)
+
+    def available(self) -> bool:
+        """是否至少有一个端点可以接收请求"""
+        now = time.monotonic()
+        return any(e.healthy(now) for e in self.endpoints)
+
+    def retry_after(self) -> float:
+        """所有端点都熔断时，距离最早恢复（半开）的秒数"""
+        now = time.monotonic()
+        return min(e.breaker.retry_after(now) for e in self.endpoints)
+
+    def begin(self, endpoint: Endpoint):
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        endpoint.breaker.on_start()
+
+    def end(self, endpoint: Endpoint):
+        endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        endpoint.breaker.on_end()
+
+    def record_success(self, endpoint: Endpoint, elapsed: float):
+        endpoint.breaker.record_success()
+        if endpoint.latency is None:
+            endpoint.latency = elapsed
+        else:
+            endpoint.latency += self.smoothing * (elapsed - endpoint.latency)
+
+    def record_failure(self, endpoint: Endpoint, cooldown: Optional[float] = None):
+        """
+        记录一次失败；达到连续失败阈值时熔断器打开，指定 cooldown（如 429 的 Retry-After）时直接打开
+        """
+        endpoint.errors += 1
+        breaker = endpoint.breaker
+        if cooldown:
+            breaker.trip(cooldown)
+        elif breaker.record_failure():
+            cooldown = breaker.cooldown
+        if cooldown:
+            logger.warning(f"LLM 端点 {endpoint.name} 熔断 {cooldown:.0f} 秒 "
+                           f"(连续失败 {breaker.consecutive_failures} 次)")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [endpoint.stats() for endpoint in self.endpoints]
@@ -9,17 +9,147 @@ import traceback
 import os
 from app.core.config import config
 from app.core.logger import logger
+from app.core.ratelimit import RateLimiter
+from app.core.concurrency import AdaptiveConcurrencyLimiter
+from app.core.cache import LLMCache
+from app.core.circuit import ErrorBudget, LLMUnavailableError
+from app.core.endpoints import EndpointPool
 
 class AsyncLLM:
-    def __init__(self, model_name=None, base_url=None, api_key=None, language=None, max_concurrency=None, system_prompt=None):
+    def __init__(self, model_name=None, base_url=None, api_key=None, language=None, max_concurrency=None, system_prompt=None,
+                 transport=None, rate_limiter=None, cache=None, pool=None):
         self.model_name = model_name or config.MODEL_NAME
         self.base_url = base_url or config.BASE_URL
         self.api_key = api_key or config.API_KEY
         self.language = language or config.LANGUAGE
         self.max_concurrency = max_concurrency or config.MAX_LLM_CONCURRENCY
         self.system_prompt = system_prompt or getattr(config, 'SYSTEM_PROMPT', None)
-        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        # 端点池（LLM_ENDPOINTS），每次请求和重试时选择负载最低的健康端点
+        self.pool = pool or EndpointPool.from_config(self.base_url, self.api_key, self.model_name)
+        # 未配置多端点时，唯一的端点随 LLM_API_BASE 等环境变量更新
+        self._follow_env = pool is None and not (config.LLM_ENDPOINTS or "").strip()
+        # 自适应并发控制 (AIMD)，max_concurrency 为每个端点的初始上限，总并发随端点数量扩展
+        replicas = len(self.pool)
+        self.semaphore = AdaptiveConcurrencyLimiter(
+            initial=self.max_concurrency * replicas,
+            min_limit=config.LLM_MIN_CONCURRENCY,
+            max_limit=max(self.max_concurrency, config.LLM_CONCURRENCY_CEILING) * replicas,
+            adaptive=config.LLM_ADAPTIVE_CONCURRENCY,
+        )
         self.headers = {"Authorization": f"Bearer {self.api_key}"}
+        # 按 base_url 维护长连接客户端，连接池在多次调用和重试之间复用
+        self._clients = {}
+        self._client_loop = None
+        # 可选的自定义 httpx 传输层（便于测试或接入代理）
+        self.transport = transport
+        # 共享的 RPM/TPM 限流器，可在多个实例间传入同一个对象
+        self.rate_limiter = rate_limiter or RateLimiter(config.LLM_RPM, config.LLM_TPM)
+        # 可选的持久化响应缓存
+        if cache is None and config.LLM_CACHE_ENABLED:
+            cache = LLMCache.from_config()
+        self.cache = cache
+        # 服务端返回的 token 用量（不含本地缓存命中），cached_tokens 为命中服务端前缀缓存的 prompt token
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+        # 错误预算，DatasetBuilder 在每次构建开始时替换为新的预算
+        self.error_budget = ErrorBudget.from_config()
+
+    def stats(self) -> dict:
+        """返回并发控制器和限流器的运行统计"""
+        stats = {
+            "concurrency": self.semaphore.stats(),
+            "rate_limit": self.rate_limiter.stats(),
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if len(self.pool) > 1:
+            stats["endpoints"] = self.pool.stats()
+        if self.error_budget.enabled:
+            stats["error_budget"] = self.error_budget.stats()
+        if self.usage["requests"]:
+            usage = dict(self.usage)
+            usage["cached_ratio"] = round(usage["cached_tokens"] / usage["prompt_tokens"], 3) if usage["prompt_tokens"] else 0.0
+            stats["usage"] = usage
+        return stats
+
+    def _record_usage(self, response_json) -> None:
+        """累计响应中的 usage 字段，兼容 OpenAI / vLLM 的 prompt_tokens_details 和 DeepSeek 的 prompt_cache_hit_tokens"""
+        usage = response_json.get("usage") if isinstance(response_json, dict) else None
+        if not isinstance(usage, dict):
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") if isinstance(details, dict) else None
+        if cached is None:
+            cached = usage.get("prompt_cache_hit_tokens")
+        self.usage["requests"] += 1
+        self.usage["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+        self.usage["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+        self.usage["cached_tokens"] += int(cached or 0)
+
+    def _build_payload(self, prompt, max_tokens, model_name=None) -> dict:
+        """组装 chat/completions 请求体"""
+        data = {
+            "model": model_name or self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens
+        }
+        
+        # 可选: 添加系统提示
+        if self.system_prompt:
+            data["messages"].insert(0, {"role": "system", "content": self.system_prompt})
+        
+        # 可选: 调整温度等参数
+        if hasattr(config, 'TEMPERATURE') and config.TEMPERATURE is not None:
+            data["temperature"] = float(config.TEMPERATURE)
+        
+        if hasattr(config, 'TOP_P') and config.TOP_P is not None:
+            data["top_p"] = float(config.TOP_P)
+        return data
+
+    def _get_client(self, base_url=None) -> httpx.AsyncClient:
+        """获取 base_url（默认为当前 base_url）对应的共享客户端，不存在时按连接池配置创建"""
+        base_url = base_url or self.base_url
+        loop = asyncio.get_running_loop()
+        if self._client_loop is not loop:
+            # httpx 客户端绑定事件循环，换了循环（如多次 asyncio.run）时旧连接不可复用
+            self._clients = {}
+            self._client_loop = loop
+
+        client = self._clients.get(base_url)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(
+                max_connections=config.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY,
+            )
+            http2 = config.LLM_HTTP2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("未安装 h2，HTTP/2 不可用，回退到 HTTP/1.1。请运行: pip install 'httpx[http2]'")
+                    http2 = False
+            client = httpx.AsyncClient(limits=limits, http2=http2, timeout=120, transport=self.transport)
+            self._clients[base_url] = client
+            logger.debug(f"创建 LLM 连接池: {base_url} (http2={http2})")
+        return client
+
+    async def aclose(self):
+        """关闭所有共享客户端，释放连接池"""
+        clients = list(self._clients.values())
+        self._clients = {}
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"关闭 LLM 连接池失败: {str(e)}")
+        if self.cache is not None:
+            self.cache.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
     
     # 保持原有的简单接口，但内部使用高级实现
     async def call_llm(self, prompt, max_tokens=2048*2):
@@ -39,7 +169,52 @@ class AsyncLLM:
     
     async def call_llm_advanced(self, prompt, max_tokens=2048*2, retries=8, backoff_factor=1.8, 
                                  dynamic_timeout=True, return_exceptions=False):
-        """高级LLM调用接口，支持错误处理、重试机制、动态超时等功能"""
+        """
+        高级LLM调用接口，支持错误处理、重试机制、动态超时等功能
+
+        最终失败时返回后备响应（return_exceptions 时返回异常对象）；启用错误预算或所有端点均已熔断时改为抛出
+        LLMUnavailableError，失败的数据点会被标记为错误而不是写入后备内容。错误预算耗尽后直接抛出 ErrorBudgetExceeded。
+        """
+        self.error_budget.check()
+        # 缓存命中时直接返回，不占用并发和限流额度，也不计入错误预算
+        if self.cache is not None:
+            cached = self._cached_response(prompt, max_tokens)
+            if cached is not None:
+                return cached
+
+        result = await self._request(prompt, max_tokens, retries, backoff_factor, dynamic_timeout)
+        failed = isinstance(result, Exception)
+        self.error_budget.record(not failed)
+        if not failed or return_exceptions:
+            return result
+        if isinstance(result, LLMUnavailableError):
+            # 熔断后快速失败的请求不能用后备内容代替，否则端点不可用时数据集会被占位答案迅速填满
+            raise result
+        if self.error_budget.enabled:
+            raise LLMUnavailableError(str(result)) from result
+        logger.warning("返回后备响应")
+        return self._fallback_response(prompt)
+
+    def _cached_response(self, prompt, max_tokens):
+        """
+        查找缓存的响应
+
+        缓存键包含实际发送请求的端点模型，端点池中有多个模型时按端点配置顺序依次查找，
+        备用模型的响应不会被当作主模型的响应返回。
+        """
+        if self._follow_env:
+            # 唯一的端点在发送请求时才同步 LLM_MODEL，这里直接读取
+            models = [os.getenv("LLM_MODEL") or self.model_name]
+        else:
+            models = [endpoint.model_name for endpoint in self.pool.endpoints]
+        for model_name in dict.fromkeys(models):
+            cached = self.cache.get(LLMCache.make_key(self._build_payload(prompt, max_tokens, model_name)))
+            if cached is not None:
+                return cached
+        return None
+
+    async def _request(self, prompt, max_tokens, retries, backoff_factor, dynamic_timeout):
+        """发送请求（含重试、端点切换和熔断等待），返回响应 JSON，失败时返回失败原因（异常对象）"""
         # 异步信号量控制
         async with self.semaphore:
             # 重新从环境变量获取配置，确保使用最新设置
@@ -56,13 +231,14 @@ class AsyncLLM:
             # 确保 API URL 格式正确
             if self.base_url and not self.base_url.startswith(('http://', 'https://')):
                 self.base_url = f"https://{self.base_url}"
+            if self._follow_env:
+                endpoint = self.pool.endpoints[0]
+                endpoint.base_url, endpoint.api_key, endpoint.model_name = self.base_url, self.api_key, self.model_name
                 
             # 检查必要参数
             if not self.api_key or not self.base_url or not self.model_name:
                 logger.error("缺少必要的 LLM 配置参数")
-                if return_exceptions:
-                    return RuntimeError("缺少必要的LLM配置参数")
-                return self._fallback_response(prompt)
+                return RuntimeError("缺少必要的LLM配置参数")
             
             # 动态超时设置 - 根据prompt长度调整
             if dynamic_timeout:
@@ -73,10 +249,21 @@ class AsyncLLM:
             else:
                 timeout = 120*10  # 默认超时
             
+            # 限流额度按估算的 prompt token 数加上 max_tokens 计算
+            request_tokens = len(prompt) / 3 + max_tokens
+            
             # 生成一个请求ID用于日志追踪
             request_id = f"req-{random.randint(1000, 9999)}"
             
+            # 本次请求已失败过的端点，重试时优先切换到其他端点
+            tried = []
             for attempt in range(retries):
+                # 从共享额度中取用，超出 RPM/TPM 时在此排队等待；在选择端点之前等待，排队期间不占用端点
+                await self.rate_limiter.acquire(request_tokens)
+                # 所有端点都熔断时暂停等待半开探测，超过等待上限则快速失败，不再逐个退避重试
+                if not self.pool.available() and not await self._wait_for_endpoint(request_id):
+                    return LLMUnavailableError("所有 LLM 端点均已熔断")
+                endpoint = self.pool.select(exclude=tried)
                 try:
                     # 随机化超时时间，避免所有请求同时超时
                     jitter = 1.0 + random.uniform(-0.15, 0.15)  # 随机因子±15%
@@ -87,129 +274,163 @@ class AsyncLLM:
                     logger.debug(f"[{request_id}] API调用超时设置: {current_timeout:.1f}秒 (尝试 {attempt+1}/{retries})")
                     
                     # 准备请求数据
-                    data = {
-                        "model": self.model_name,
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": max_tokens
-                    }
-                    
-                    # 可选: 添加系统提示
-                    if self.system_prompt:
-                        data["messages"].insert(0, {"role": "system", "content": self.system_prompt})
-                    
-                    # 可选: 调整温度等参数
-                    if hasattr(config, 'TEMPERATURE') and config.TEMPERATURE is not None:
-                        data["temperature"] = float(config.TEMPERATURE)
-                    
-                    if hasattr(config, 'TOP_P') and config.TOP_P is not None:
-                        data["top_p"] = float(config.TOP_P)
+                    data = self._build_payload(prompt, max_tokens, endpoint.model_name)
                     
                     # 日志记录开始信息 - 避免记录完整提示内容，只记录前30个字符
                     prompt_preview = prompt[:30].replace('\n', ' ') + "..." if len(prompt) > 30 else prompt
-                    logger.debug(f"[{request_id}] 发送请求到 {self.model_name} (尝试 {attempt+1}/{retries})")
+                    logger.debug(f"[{request_id}] 发送请求到 {endpoint.name} ({endpoint.model_name}) (尝试 {attempt+1}/{retries})")
                     logger.debug(f"[{request_id}] 提示预览: {prompt_preview}")
                     
+                    # 复用长连接池中的客户端，避免每次请求重新握手
+                    client = self._get_client(endpoint.base_url)
                     start_time = time.time()
-                    
-                    # 使用异步上下文管理器创建客户端
-                    async with httpx.AsyncClient(timeout=current_timeout) as client:
-                        try:
-                            # 发送请求
-                            resp = await client.post(
-                                f"{self.base_url}/chat/completions", 
-                                headers=self.headers, 
-                                json=data, 
-                                follow_redirects=True
-                            )
+                    # 从 select 到占用端点之间没有 await：半开状态下只有一个协程能占用探测名额
+                    self.pool.begin(endpoint)
+                    backoff = None
+                    try:
+                        # 发送请求
+                        resp = await client.post(
+                            f"{endpoint.base_url}/chat/completions", 
+                            headers={"Authorization": f"Bearer {endpoint.api_key}"}, 
+                            json=data, 
+                            follow_redirects=True,
+                            timeout=current_timeout
+                        )
                             
-                            # 检查状态码
-                            resp.raise_for_status()
-                            elapsed = time.time() - start_time
+                        # 根据 x-ratelimit-* 响应头同步剩余额度
+                        self.rate_limiter.update_from_headers(resp.headers)
+                        
+                        # 检查状态码
+                        resp.raise_for_status()
+                        elapsed = time.time() - start_time
+                        self.semaphore.record_success(elapsed)
+                        self.pool.record_success(endpoint, elapsed)
                             
-                            # 解析响应
-                            response_json = resp.json()
-                            print(f"完整响应: {response_json}")
+                        # 解析响应
+                        response_json = resp.json()
+                        print(f"完整响应: {response_json}")
+                        self._record_usage(response_json)
                             
-                            # 处理响应格式，返回完整的响应JSON，方便处理推理内容
-                            logger.debug(f"[{request_id}] 请求成功，耗时 {elapsed:.2f}秒")
+                        # 处理响应格式，返回完整的响应JSON，方便处理推理内容
+                        logger.debug(f"[{request_id}] 请求成功，耗时 {elapsed:.2f}秒")
+                        
+                        # 只缓存成功的响应，以实际发送的请求体（含端点模型）为键
+                        if self.cache is not None:
+                            self.cache.set(LLMCache.make_key(data), response_json)
                             
-                            # 返回完整响应JSON
-                            return response_json
+                        # 返回完整响应JSON
+                        return response_json
                             
-                        except httpx.HTTPStatusError as e:
-                            elapsed = time.time() - start_time
-                            status_code = e.response.status_code
-                            error_text = e.response.text[:200] + "..." if len(e.response.text) > 200 else e.response.text
+                    except httpx.HTTPStatusError as e:
+                        elapsed = time.time() - start_time
+                        status_code = e.response.status_code
+                        error_text = e.response.text[:200] + "..." if len(e.response.text) > 200 else e.response.text
                             
-                            logger.error(f"[{request_id}] HTTP 错误 ({elapsed:.2f}秒): {status_code} - {error_text}")
+                        logger.error(f"[{request_id}] HTTP 错误 ({elapsed:.2f}秒): {status_code} - {error_text}")
+                        # 429 和 5xx 视为过载信号，触发并发上限收缩
+                        self.semaphore.record_failure(overload=status_code == 429 or status_code >= 500)
+                        tried.append(endpoint)
                             
-                            if status_code == 401:
-                                logger.error(f"[{request_id}] API 密钥错误或未授权")
-                                if return_exceptions:
-                                    return httpx.HTTPStatusError(f"认证错误: {error_text}", request=e.request, response=e.response)
-                                break  # 认证错误不重试
-                                
-                            elif status_code == 429:
-                                logger.warning(f"[{request_id}] 请求频率限制，将重试")
-                                # 对于频率限制错误，使用更长的等待时间
-                                wait_time = backoff_factor * (2.5 ** attempt)
-                                logger.warning(f"[{request_id}] 等待 {wait_time:.1f} 秒后重试...")
-                                await asyncio.sleep(wait_time)
+                        if status_code == 401:
+                            logger.error(f"[{request_id}] API 密钥错误或未授权")
+                            # 单个端点的密钥错误不影响其他端点
+                            self.pool.record_failure(endpoint, cooldown=self.pool.cooldown)
+                            if self.pool.has_alternative(tried):
                                 continue
+                            # 认证错误不重试
+                            return httpx.HTTPStatusError(f"认证错误: {error_text}", request=e.request, response=e.response)
                                 
-                            elif status_code >= 500:
-                                logger.warning(f"[{request_id}] 服务器错误 ({status_code})，将重试")
-                                wait_time = backoff_factor * (2 ** attempt)
+                        elif status_code == 429:
+                            logger.warning(f"[{request_id}] 请求频率限制，将重试")
+                            # 优先遵循服务端的 Retry-After，否则使用更长的退避时间
+                            retry_after = self.rate_limiter.update_from_headers(e.response.headers)
+                            wait_time = retry_after if retry_after is not None else backoff_factor * (2.5 ** attempt)
+                            if len(self.pool) > 1:
+                                # 多端点时只暂停被限流的端点，其余端点继续服务
+                                self.pool.record_failure(endpoint, cooldown=wait_time)
+                                backoff = wait_time
+                            else:
+                                # 暂停共享限流器，所有协程一起等待，避免集中重试
+                                self.rate_limiter.on_rate_limited(wait_time)
                                 logger.warning(f"[{request_id}] 等待 {wait_time:.1f} 秒后重试...")
-                                await asyncio.sleep(wait_time)
                                 continue
                                 
+                        else:
+                            self.pool.record_failure(endpoint)
+                            if status_code >= 500:
+                                logger.warning(f"[{request_id}] 服务器错误 ({status_code})，将重试")
+                                backoff = backoff_factor * (2 ** attempt)
                             # 其他HTTP错误
-                            if attempt < retries - 1:
-                                wait_time = backoff_factor * (2 ** attempt)
-                                logger.warning(f"[{request_id}] 等待 {wait_time:.1f} 秒后重试...")
-                                await asyncio.sleep(wait_time)
+                            elif attempt < retries - 1:
+                                backoff = backoff_factor * (2 ** attempt)
                             else:
                                 logger.error(f"[{request_id}] 已达到最大重试次数")
-                                if return_exceptions:
-                                    return e
-                                break
+                                return e
+                    finally:
+                        self.pool.end(endpoint)
+                    
+                    # 先释放端点再退避，等待重试的请求不计入端点的未完成请求数，不影响其他请求的路由
+                    if backoff is not None:
+                        await self._retry_wait(request_id, tried, backoff)
                         
                 except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout) as e:
                     elapsed = time.time() - start_time if 'start_time' in locals() else 0
                     logger.warning(f"[{request_id}] 连接/读取错误 ({type(e).__name__}): {str(e)} ({elapsed:.1f}秒)")
+                    self.semaphore.record_failure(overload=True)
+                    self.pool.record_failure(endpoint)
+                    tried.append(endpoint)
                     
                     if attempt < retries - 1:
-                        wait_time = backoff_factor * (2 ** attempt)
-                        logger.warning(f"[{request_id}] 将在 {wait_time:.1f} 秒后重试...")
-                        await asyncio.sleep(wait_time)
+                        await self._retry_wait(request_id, tried, backoff_factor * (2 ** attempt))
                     else:
                         logger.error(f"[{request_id}] 连接失败，已达到最大重试次数: {str(e)}")
-                        if return_exceptions:
-                            return e
+                        return e
                         
                 except Exception as e:
                     elapsed = time.time() - start_time if 'start_time' in locals() else 0
                     logger.error(f"[{request_id}] 调用 LLM API 失败 ({elapsed:.1f}秒): {str(e)}")
+                    self.semaphore.record_failure(overload=False)
+                    self.pool.record_failure(endpoint)
+                    tried.append(endpoint)
                     
                     if isinstance(logging.getLogger().level, int) and logging.getLogger().level <= logging.DEBUG:
                         logger.debug(f"[{request_id}] 异常详情: {traceback.format_exc()}")
                     
                     if attempt < retries - 1:
-                        wait_time = backoff_factor * (2 ** attempt)
-                        logger.warning(f"[{request_id}] 将在 {wait_time:.1f} 秒后重试...")
-                        await asyncio.sleep(wait_time)
+                        await self._retry_wait(request_id, tried, backoff_factor * (2 ** attempt))
                     else:
                         logger.error(f"[{request_id}] 已达到最大重试次数")
-                        if return_exceptions:
-                            return e
+                        return e
             
-            # 所有重试都失败，返回后备响应
-            logger.error(f"[{request_id}] 所有 API 调用尝试都失败，返回后备响应")
-            if return_exceptions:
-                return RuntimeError(f"所有API调用尝试都失败({retries}次)")
-            return self._fallback_response(prompt)
+            logger.error(f"[{request_id}] 所有 API 调用尝试都失败")
+            return RuntimeError(f"所有API调用尝试都失败({retries}次)")
     
+    async def _wait_for_endpoint(self, request_id: str) -> bool:
+        """等待任一端点的熔断器进入半开，最多等待 LLM_CIRCUIT_MAX_WAIT 秒，超时返回 False"""
+        max_wait = config.LLM_CIRCUIT_MAX_WAIT
+        if max_wait > 0:
+            logger.warning(f"[{request_id}] 所有 LLM 端点均已熔断，最多暂停 {max_wait:.0f} 秒")
+        waited = 0.0
+        while not self.pool.available():
+            if waited >= max_wait:
+                logger.error(f"[{request_id}] 端点仍未恢复，快速失败")
+                return False
+            # 半开探测进行中时 retry_after 为 0，按固定间隔检查
+            delay = min(self.pool.retry_after() or 0.5, max_wait - waited)
+            await asyncio.sleep(delay)
+            waited += delay
+        return True
+
+    async def _retry_wait(self, request_id: str, tried: list, wait_time: float):
+        """重试前退避；还有未失败过的健康端点时立即切换过去，端点已熔断时交给熔断等待，均无需退避"""
+        if not self.pool.available():
+            return
+        if len(self.pool) > 1 and self.pool.has_alternative(tried):
+            logger.warning(f"[{request_id}] 切换到其他端点重试")
+            return
+        logger.warning(f"[{request_id}] 将在 {wait_time:.1f} 秒后重试...")
+        await asyncio.sleep(wait_time)
+
     def _fallback_response(self, prompt: str) -> str:
         """当 LLM API 调用失败时的后备响应"""
         logger.warning("使用模拟回复代替 LLM 响应")
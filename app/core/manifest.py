@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from app.core.cache import ParseCache
+from app.core.logger import logger
+
+
+class BuildManifest:
+    """
+    增量构建清单
+
+    记录上一次构建中每个文件的内容哈希及其文档块，以及每个文档块（按文件路径和内容哈希标识，
+    与块在文件中的位置无关）产出的问答数据点：
+    {"version": 2,
+     "files": {<路径>: {"hash": <sha256>, "chunks": [<chunk_key>, ...]}},
+     "chunks": {<chunk_key>: [<数据点>, ...]},
+     "duplicates": {<chunk_key>: <被保留的 chunk_key>},
+     "question_duplicates": {<chunk_key>: [<保留了其重复问题的 chunk_key>, ...]}}
+    增量构建时未变化的文件直接复用结果，无需重新解析；变化文件中内容未变的文档块同样复用，
+    只有新增或修改的文档块才会调用 LLM；删除或插入章节后，其余章节的序号变化也不影响复用。
+    保存时只写入本次构建涉及的文件，已删除文件的结果随之丢弃。
+    被去重跳过的文档块记录其依赖的原始块，原始块不再出现在输入中时重新生成，避免内容从数据集中丢失；
+    部分问题因与其他块的问题重复而被合并的文档块同样记录这些块，任一块不再存在时重新生成。
+    """
+
+    version = 2
+
+    def __init__(self, path: str):
+        self.path = path
+        self.previous_files: Dict[str, Dict[str, Any]] = {}
+        self.previous_chunks: Dict[str, List[Dict[str, Any]]] = {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.chunks: Dict[str, List[Dict[str, Any]]] = {}
+        self.previous_duplicates: Dict[str, str] = {}
+        self.duplicates: Dict[str, str] = {}
+        self.previous_question_duplicates: Dict[str, List[str]] = {}
+        self.question_duplicates: Dict[str, List[str]] = {}
+        # 本次构建输入中存在的文档块
+        self.live = set()
+        self.incomplete = set()
+        self.reused_chunks = 0
+
+    def load(self) -> "BuildManifest":
+        """读取上一次构建的清单，文件损坏或版本不符时视为全量构建"""
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"读取构建清单失败，将全量构建: {str(e)}")
+            return self
+        if data.get("version") != self.version:
+            logger.warning(f"构建清单版本不匹配，将全量构建: {self.path}")
+            return self
+        self.previous_files = data.get("files", {})
+        self.previous_chunks = data.get("chunks", {})
+        self.previous_duplicates = data.get("duplicates", {})
+        self.previous_question_duplicates = data.get("question_duplicates", {})
+        logger.info(f"已加载构建清单 {self.path}: {len(self.previous_files)} 个文件, "
+                    f"{len(self.previous_chunks)} 个文档块")
+        return self
+
+    @staticmethod
+    def file_digest(file_path: str) -> Optional[str]:
+        try:
+            return ParseCache.file_digest(file_path)
+        except OSError as e:
+            logger.warning(f"计算文件哈希失败 {file_path}: {str(e)}")
+            return None
+
+    @staticmethod
+    def chunk_keys(file_path: str, chunks: List[Dict[str, Any]]) -> List[str]:
+        """文档块在清单中的键：文件路径加内容哈希，同一文件中内容相同的块按出现次序区分"""
+        keys, seen = [], {}
+        for chunk in chunks:
+            digest = hashlib.sha1(chunk.get('content', '').encode('utf-8')).hexdigest()[:16]
+            occurrence = seen.get(digest, 0)
+            seen[digest] = occurrence + 1
+            keys.append(f"{file_path}:{digest}" + (f"#{occurrence}" if occurrence else ""))
+        return keys
+
+    def _unchanged(self, file_path: str, digest: Optional[str]) -> bool:
+        previous = self.previous_files.get(file_path)
+        return bool(digest) and previous is not None and previous.get("hash") == digest
+
+    def expect_files(self, digests: Dict[str, Optional[str]]):
+        """复用前登记内容未变的文件，其文档块在本次构建中仍然存在，可以作为重复块的原始块"""
+        for file_path, digest in digests.items():
+            if self._unchanged(file_path, digest):
+                self.live.update(self.previous_files[file_path].get("chunks", []))
+
+    def _original_live(self, key: str) -> bool:
+        """文档块依赖的原始块（重复块的原始块、被合并问题所在的块）是否都仍在本次构建的输入中"""
+        original = self.previous_duplicates.get(key)
+        if original is not None and original not in self.live:
+            return False
+        return all(source in self.live for source in self.previous_question_duplicates.get(key, ()))
+
+    def reuse_file(self, file_path: str, digest: Optional[str]) -> bool:
+        """文件内容未变且所有文档块都可复用时复用其结果，返回是否复用成功"""
+        if not self._unchanged(file_path, digest):
+            return False
+        keys = self.previous_files[file_path].get("chunks", [])
+        if any(key not in self.previous_chunks or not self._original_live(key) for key in keys):
+            return False
+        self.record_file(file_path, digest, keys)
+        for key in keys:
+            self.reuse_chunk(key)
+        return True
+
+    def reuse_chunk(self, key: str, chunk: Optional[Dict[str, Any]] = None) -> bool:
+        """复用上一次构建中同一内容文档块的数据点；给出 chunk 时按其当前位置更新数据点的 chunk_id"""
+        items = self.previous_chunks.get(key)
+        if items is None or not self._original_live(key):
+            return False
+        if key in self.previous_duplicates:
+            self.duplicates[key] = self.previous_duplicates[key]
+        if key in self.previous_question_duplicates:
+            self.question_duplicates[key] = self.previous_question_duplicates[key]
+        if chunk is not None:
+            items = [{**item, "chunk_id": chunk.get('chunk_id', item.get('chunk_id', ''))} for item in items]
+        self.chunks[key] = items
+        self.reused_chunks += 1
+        return True
+
+    def record_file(self, file_path: str, digest: Optional[str], keys: List[str]):
+        self.files[file_path] = {"hash": digest, "chunks": list(keys)}
+        self.live.update(keys)
+
+    def record_duplicate(self, key: str, original: str):
+        """记录被去重跳过的文档块：本身不产出数据点，只在原始块仍存在时复用"""
+        self.chunks[key] = []
+        self.duplicates[key] = original
+        self.incomplete.discard(key)
+
+    def record_question_duplicates(self, key: str, sources: List[str]):
+        """记录文档块中被合并的问题所在的其他块：数据点中不含这些问题，只在这些块仍存在时复用"""
+        self.question_duplicates[key] = list(sources)
+
+    def record_chunk(self, key: str, items: List[Dict[str, Any]], complete: bool = True):
+        """记录文档块的数据点；complete=False 的结果只用于本次输出，不写入清单"""
+        self.chunks[key] = items
+        if complete:
+            self.incomplete.discard(key)
+        else:
+            self.incomplete.add(key)
+
+    def dataset(self) -> List[Dict[str, Any]]:
+        """按文件和文档块顺序展开本次构建的全部数据点"""
+        return [item
+                for entry in self.files.values()
+                for key in entry["chunks"]
+                for item in self.chunks.get(key, [])]
+
+    def deleted_files(self) -> List[str]:
+        return [path for path in self.previous_files if path not in self.files]
+
+    def save(self):
+        """原子写入清单，只保留本次构建引用到的文档块"""
+        referenced = {key for entry in self.files.values() for key in entry["chunks"]} - self.incomplete
+        data = {
+            "version": self.version,
+            "files": self.files,
+            "chunks": {key: items for key, items in self.chunks.items() if key in referenced},
+            "duplicates": {key: original for key, original in self.duplicates.items() if key in referenced},
+            "question_duplicates": {key: sources for key, sources in self.question_duplicates.items()
+                                    if key in referenced},
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logger.info(f"构建清单已保存: {self.path}")
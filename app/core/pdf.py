@@ -0,0 +1,100 @@
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from app.core.logger import logger
+
+# 按优先级排列的原生 PDF 解析后端：PyMuPDF 速度最快，pypdf 为纯 Python 实现
+BACKENDS = ("pymupdf", "pypdf")
+
+
+def resolve_backend(name: str = "auto") -> Optional[str]:
+    """
+    返回可用的原生 PDF 后端名称
+
+    name 为 "auto" 时按 BACKENDS 顺序选择第一个已安装的后端；为 "textract" 或指定后端
+    未安装时返回 None，由调用方退回到 textract。
+    """
+    name = (name or "auto").strip().lower()
+    candidates = BACKENDS if name == "auto" else (name,) if name in BACKENDS else ()
+    for backend in candidates:
+        try:
+            if backend == "pymupdf":
+                import fitz  # type: ignore  # noqa: F401
+            else:
+                import pypdf  # type: ignore  # noqa: F401
+            return backend
+        except ImportError:
+            continue
+    if name not in ("auto", "textract"):
+        logger.warning(f"PDF 解析后端 {name} 不可用，使用 textract")
+    return None
+
+
+def page_count(path: str, backend: str) -> int:
+    if backend == "pymupdf":
+        import fitz  # type: ignore
+
+        with fitz.open(path) as doc:
+            return doc.page_count
+    from pypdf import PdfReader  # type: ignore
+
+    return len(PdfReader(path).pages)
+
+
+def extract_pages(path: str, backend: str, start: int, end: int) -> List[str]:
+    """提取 [start, end) 范围内各页的文本（页码从 0 开始），可在工作进程中执行"""
+    if backend == "pymupdf":
+        import fitz  # type: ignore
+
+        with fitz.open(path) as doc:
+            return [doc[i].get_text() for i in range(start, end)]
+    from pypdf import PdfReader  # type: ignore
+
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_pdf_pages(path: str, backend: str, workers: int = 1,
+                   batch_size: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """
+    按页码顺序产出 (页码, 页面文本)，页码从 1 开始
+
+    workers > 1 时按 batch_size 页一批分发到进程池并行提取（默认每个进程约分到 4 批，每批最多 32 页）；
+    同时进行的批次不超过 2 * workers 个，前面的批次完成后立即产出，调用方可以边提取边分块。
+    """
+    total = page_count(path, backend)
+    serial = workers is None or workers <= 1
+    if not batch_size:
+        batch_size = 32 if serial else min(32, max(1, math.ceil(total / (workers * 4))))
+    ranges = [(i, min(i + batch_size, total)) for i in range(0, total, batch_size)]
+    if serial or len(ranges) <= 1:
+        for start, end in ranges:
+            for offset, text in enumerate(extract_pages(path, backend, start, end)):
+                yield start + offset + 1, text
+        return
+
+    workers = min(workers, len(ranges), os.cpu_count() or 1)
+    if workers <= 1:
+        yield from iter_pdf_pages(path, backend, workers=1, batch_size=batch_size)
+        return
+    logger.info(f"使用 {workers} 个进程并行提取 PDF {path} ({total} 页)")
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for start, end in ranges:
+            pending.append((start, executor.submit(extract_pages, path, backend, start, end)))
+            if len(pending) >= 2 * workers:
+                first, future = pending.popleft()
+                for offset, text in enumerate(future.result()):
+                    yield first + offset + 1, text
+        while pending:
+            first, future = pending.popleft()
+            for offset, text in enumerate(future.result()):
+                yield first + offset + 1, text
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -64,17 +64,17 @@ Based on the text provided by the user (length: {text_len} characters), generate
 4. Next, generate an accurate answer related to the question.
 5. Finally, ensure the accuracy and relevance of the answer.
 
-## Reference Content:
-{text}
-
-## Question
-{question}
-
 ## Constraints:
 1. The answer must be based on the given content.
 2. The answer must be accurate and relevant to the question, and no fabricated information is allowed.
 3. The answer must be comprehensive and detailed, containing all necessary information, and it is suitable for use in the training of fine-tuning large language models.
 {answer_prompt}
+
+## Reference Content:
+{text}
+
+## Question
+{question}
 ''',
     # ... add more prompts as needed
 }
@@ -83,6 +83,14 @@ def get_prompt(name: str = "question", **kwargs):
     prompt = PROMPTS.get(name, PROMPTS["question"])
     return prompt.format(**kwargs)
 
+def layered_prompt(instructions: str, context: str, suffix: str) -> str:
+    """
+    按 "静态指令 -> 文档块上下文 -> 单次请求内容" 的顺序拼接 prompt。
+    服务端前缀缓存（vLLM 自动前缀缓存、OpenAI / DeepSeek 上下文缓存）只复用请求开头完全相同的部分，
+    这样同一文档块的各个问题只有末尾的问题不同，共享的指令和参考内容都能命中缓存。
+    """
+    return f"{instructions.rstrip()}\n\n{context.strip()}\n\n{suffix.strip()}\n"
+
 def generate_distill_prompt(instruction, input_text=""):
     """
     生成知识蒸馏用的prompt，结合instruction和input_text，要求模型生成高质量输出。
@@ -0,0 +1,164 @@
+import asyncio
+import re
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from app.core.logger import logger
+
+
+def parse_duration(value) -> Optional[float]:
+    """
+    解析限流响应头中的时间长度，返回秒数
+
+    支持的输入格式:
+    - "2" / "0.5" -> 秒
+    - "20ms" / "1s" / "6m0s" / "1h2m3s" -> 组合时长
+    """
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    if not text:
+        return None
+    try:
+        return max(0.0, float(text))
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for number, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', text):
+        matched = True
+        number = float(number)
+        if unit == 'ms':
+            total += number / 1000
+        elif unit == 'h':
+            total += number * 3600
+        elif unit == 'm':
+            total += number * 60
+        else:
+            total += number
+    return total if matched else None
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """预占额度，返回需要等待的秒数（额度可透支，由等待时间偿还）"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def sync_remaining(self, remaining: float):
+        """根据服务端返回的剩余额度收紧本地估计"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, float(remaining))
+
+
+class RateLimiter:
+    """
+    共享的请求速率限制器
+
+    同时约束每分钟请求数 (RPM) 和每分钟 token 数 (TPM)。同一次构建中的所有
+    协程从同一份额度中取用，并根据 Retry-After / x-ratelimit-* 响应头进行调整，
+    避免各请求各自退避导致的集中重试。
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.requests = TokenBucket(rpm) if rpm and rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm and tpm > 0 else None
+        self._pause_until = 0.0
+        self.throttled = 0
+        self.rate_limited = 0
+        self.wait_time = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    async def acquire(self, tokens: float = 0):
+        """等待直到可以发送一个消耗约 tokens 个 token 的请求"""
+        waited = 0.0
+        # 服务端要求暂停时，所有协程一起等待
+        while True:
+            delay = self._pause_until - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+            waited += delay
+
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        if delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+
+        if waited > 0:
+            self.throttled += 1
+            self.wait_time += waited
+
+    def on_rate_limited(self, retry_after: float):
+        """收到 429 时暂停整个限流器，而不是单个请求独自退避"""
+        self.rate_limited += 1
+        until = time.monotonic() + max(0.0, retry_after)
+        if until > self._pause_until:
+            self._pause_until = until
+            logger.warning(f"触发服务端限流，全部请求暂停 {retry_after:.1f} 秒")
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> Optional[float]:
+        """
+        根据响应头调整额度
+
+        Returns:
+            Optional[float]: 服务端建议的重试等待秒数（如有）
+        """
+        if not headers:
+            return None
+        retry_after = parse_duration(headers.get('retry-after'))
+        if retry_after is None:
+            retry_after_ms = headers.get('retry-after-ms')
+            if retry_after_ms is not None:
+                retry_after = parse_duration(f"{retry_after_ms}ms")
+
+        for kind, bucket_attr in (('requests', 'requests'), ('tokens', 'tokens')):
+            bucket = getattr(self, bucket_attr)
+            limit = headers.get(f'x-ratelimit-limit-{kind}')
+            if bucket is None and limit is not None:
+                # 未配置本地上限时，采用服务端公布的额度
+                try:
+                    bucket = TokenBucket(int(float(limit)))
+                    setattr(self, bucket_attr, bucket)
+                    logger.info(f"采用服务端限流额度: {kind}={bucket.capacity:.0f}/min")
+                except ValueError:
+                    bucket = None
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            if bucket is not None and remaining is not None:
+                try:
+                    bucket.sync_remaining(float(remaining))
+                except ValueError:
+                    pass
+        return retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rpm": self.requests.capacity if self.requests else None,
+            "tpm": self.tokens.capacity if self.tokens else None,
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited,
+            "wait_time": round(self.wait_time, 2),
+        }
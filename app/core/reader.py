@@ -0,0 +1,55 @@
+import codecs
+from typing import Iterator, Optional, Sequence
+
+from app.core.logger import logger
+
+# 带 BOM 的文件直接按 BOM 确定编码（utf-8-sig 会去掉开头的 BOM）
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def detect_encoding(path: str, sample_size: int = 64 * 1024,
+                    candidates: Sequence[str] = ("utf-8", "gbk")) -> str:
+    """
+    根据文件开头的样本检测编码，只读取一次样本
+
+    依次检查 BOM 和候选编码，样本末尾被截断的多字节字符不影响判断；都无法解码时返回 utf-8，
+    读取时不可解码的字节会被替换。
+    """
+    with open(path, "rb") as f:
+        sample = f.read(sample_size)
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    complete = len(sample) < sample_size
+    for encoding in candidates:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    logger.warning(f"无法识别文件编码，按 utf-8 读取并替换无效字节: {path}")
+    return "utf-8"
+
+
+def iter_text(path: str, encoding: Optional[str] = None, block_size: int = 1024 * 1024) -> Iterator[str]:
+    """
+    按块读取并解码文本文件，内存占用与文件大小无关
+
+    换行符按文本模式统一转换为 \\n，与 open(path).read() 的结果一致。
+    """
+    encoding = encoding or detect_encoding(path)
+    with open(path, "r", encoding=encoding, errors="replace") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+def read_text(path: str, encoding: Optional[str] = None) -> str:
+    """读取整个文本文件，编码检测方式与 iter_text 相同，不会因解码失败而重复读取文件"""
+    return "".join(iter_text(path, encoding))
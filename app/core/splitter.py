@@ -0,0 +1,156 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.chunker import TokenChunker, pack_sentences
+
+# Markdown 标题行，忽略末尾的 {#锚点}
+HEADING = re.compile(r'^(#{1,6})\s+(.+?)(?:\s*\{#[\w-]+\})?\s*$', re.MULTILINE)
+
+# 没有正文的段落使用的摘要文字
+SUMMARY_LABELS = {
+    "zh": {"document": "文档", "preface": "{title} 前言", "unnamed": "未命名段落"},
+    "en": {"document": "Document", "preface": "{title} Introduction", "unnamed": "Unnamed Section"},
+}
+
+
+class MarkdownSplitter:
+    """
+    Markdown 分块引擎，DocumentProcessor 和 DatasetService 共用
+
+    按标题切分段落，合并过短段落、拆分过长段落，并为每个块生成摘要。
+    提取大纲时一次遍历同时计算每个标题的上级标题路径，生成摘要时直接查表，
+    不再为每个段落线性扫描大纲。
+
+    tokenizer 不为空时 min_len / max_len 以 token 计，过长段落按 token 预算拆分；
+    否则以字符计，按句子装箱拆分（compat 含义与 pack_sentences 相同）。
+    """
+
+    def __init__(self, min_len: int, max_len: int, compat: bool = True, tokenizer=None, language: str = "zh"):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.compat = compat
+        self.tokenizer = tokenizer
+        self.labels = SUMMARY_LABELS.get(language, SUMMARY_LABELS["zh"])
+
+    def length(self, text: str) -> int:
+        return self.tokenizer.count(text) if self.tokenizer is not None else len(text)
+
+    def split(self, text: str) -> List[Dict[str, Any]]:
+        """对整篇 Markdown 分块，返回 {'summary', 'content', 'heading'} 列表"""
+        outline = self.extract_outline(text)
+        return self.split_sections(self.split_by_headings(text, outline), outline)
+
+    @staticmethod
+    def extract_outline(text: str) -> List[Dict[str, Any]]:
+        """
+        提取大纲（所有标题），每项额外带有 'path'：摘要使用的标题路径，如 "第一章 > 1.1 > 1.1.1"
+
+        上级标题按级别逐级向前查找：先找最近的 level-1 级标题，再从该标题向前找 level-2 级，依此类推，
+        中间缺少某一级时停止。由于同一标题的上级链就是其父标题的上级链加上父标题本身，
+        记录每一级最近出现的标题即可一次遍历求出所有路径。重名标题（同名同级）共用首次出现时的路径。
+        """
+        outline = []
+        # 各级别最近出现的标题的上级链（含其自身）
+        latest: Dict[int, tuple] = {}
+        first_path: Dict[tuple, str] = {}
+        for match in HEADING.finditer(text):
+            level = len(match.group(1))
+            title = match.group(2).strip()
+            parents = latest.get(level - 1, ())
+            chain = parents + (title,)
+            latest[level] = chain
+            path = first_path.setdefault((title, level), ' > '.join(chain))
+            outline.append({'level': level, 'title': title, 'position': match.start(), 'path': path})
+        return outline
+
+    @staticmethod
+    def split_by_headings(text: str, outline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按标题切分段落，标题之前的内容作为前言（level 0）"""
+        if not outline:
+            return [{'heading': None, 'level': 0, 'content': text, 'position': 0}]
+        sections = []
+        if outline[0]['position'] > 0:
+            front = text[:outline[0]['position']].strip()
+            if front:
+                sections.append({'heading': None, 'level': 0, 'content': front, 'position': 0})
+        for i, current in enumerate(outline):
+            next_pos = outline[i+1]['position'] if i+1 < len(outline) else len(text)
+            # 标题行结束位置，直接查找换行符，避免为每个标题复制剩余全文
+            line_end = text.find('\n', current['position'])
+            start = (line_end if line_end != -1 else len(text)) + 1
+            sections.append({
+                'heading': current['title'],
+                'level': current['level'],
+                'content': text[start:next_pos].strip(),
+                'position': current['position'],
+                'path': current.get('path'),
+            })
+        return sections
+
+    def summarize(self, section: Dict[str, Any], outline: List[Dict[str, Any]]) -> str:
+        """段落摘要：正文前 100 个字符；没有正文时使用标题路径或前言名称"""
+        content = section.get('content', '').strip()
+        if content:
+            return content[:100]
+        if not section.get('heading') and section.get('level', 0) == 0:
+            doc_title = outline[0]['title'] if outline and outline[0]['level'] == 1 else self.labels['document']
+            return self.labels['preface'].format(title=doc_title)
+        if section.get('heading'):
+            return section.get('path') or section['heading']
+        return self.labels['unnamed']
+
+    def split_sections(self, sections: List[Dict[str, Any]], outline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并过短段落，拆分过长段落，生成摘要"""
+        result = []
+        # 待合并的短段落：buffer 记录首个段落的标题信息，内容片段暂存在 parts 中，输出时一次性拼接
+        buffer: Optional[Dict[str, Any]] = None
+        parts: List[str] = []
+        buffer_len = 0
+
+        def emit(section: Dict[str, Any], content: str):
+            # 摘要基于整个段落生成，过长段落切出的各块共用同一摘要
+            result.append({
+                'summary': self.summarize(section, outline),
+                'content': content,
+                'heading': section.get('heading')
+            })
+
+        def flush_buffer():
+            merged = ''.join(parts)
+            emit(dict(buffer, content=merged), merged)
+
+        for section in sections:
+            content = section['content'].strip()
+            content_len = self.length(content)
+            if content_len < self.min_len:
+                if buffer:
+                    part = '\n\n' + (f"{'#'*section['level']} {section['heading']}\n" if section['heading'] else '') + content
+                    parts.append(part)
+                    buffer_len += self.length(part)
+                else:
+                    buffer = section
+                    parts = [section['content']]
+                    buffer_len = self.length(section['content'])
+            else:
+                if buffer:
+                    if buffer_len + self.length('\n\n' + content) <= self.max_len:
+                        parts.append('\n\n' + content)
+                        flush_buffer()
+                    else:
+                        flush_buffer()
+                        emit(section, content)
+                    buffer = None
+                elif content_len > self.max_len:
+                    for chunk in self._split_long(content):
+                        emit(section, chunk)
+                else:
+                    emit(section, content)
+        if buffer:
+            flush_buffer()
+        return result
+
+    def _split_long(self, content: str) -> Iterator[str]:
+        """按句子拆分过长段落"""
+        if self.tokenizer is not None:
+            return (text for text, _ in TokenChunker(self.tokenizer, self.max_len).split(content))
+        return pack_sentences(content, self.max_len, compat=self.compat)
@@ -1,9 +1,78 @@
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List
 from app.core.config import config
 from app.core.logger import logger
 import os
 
+
+class StreamingJSONWriter:
+    """
+    增量写入 JSON 数组或 JSONL 文件
+
+    每条记录到达时立即序列化并写入带缓冲的临时文件，结束时原子重命名为目标文件，
+    导出过程中内存占用与数据集大小无关，中途失败也不会留下半个文件。
+    JSON 格式的输出与 json.dump(data, indent=2) 完全一致。
+    """
+
+    def __init__(self, path: str, file_format: str = "json", buffer_size: int = 1024 * 1024):
+        self.path = path
+        self.file_format = file_format
+        self.tmp_path = f"{path}.tmp"
+        self.count = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.tmp_path, "w", encoding="utf-8", buffering=buffer_size)
+
+    def write(self, item: Any):
+        if self.file_format == "jsonl":
+            self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        else:
+            text = json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            self._file.write(("[\n  " if self.count == 0 else ",\n  ") + text)
+        self.count += 1
+
+    def close(self):
+        """写入结尾并原子替换目标文件"""
+        if self._file is None:
+            return
+        if self.file_format != "jsonl":
+            self._file.write("\n]" if self.count else "[]")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """放弃写入，删除临时文件"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_records(path: str, data: Iterable[Any], file_format: str = "json") -> int:
+    """将记录流式写入文件，返回写入条数"""
+    with StreamingJSONWriter(path, file_format) as writer:
+        for item in data:
+            writer.write(item)
+    return writer.count
+
+
 class JSONStorage:
     def __init__(self, path: str = None):
         self.path = path or config.DATA_PATH
@@ -21,12 +90,11 @@ class JSONStorage:
 
     def save(self, data: List[Dict[str, Any]]):
         try:
-            with open(self.path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_records(self.path, data, "json")
         except Exception as e:
             logger.error(f"Failed to save data: {e}")
 
-    def export(self, data: List[Dict[str, Any]], output_path: str, file_format: str = "json"):
+    def export(self, data: Iterable[Dict[str, Any]], output_path: str, file_format: str = "json"):
         """
         导出数据到文件
         Args:
@@ -34,8 +102,6 @@ class JSONStorage:
             output_path: 输出路径
             file_format: 文件格式，json或jsonl
         """
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
         # 确保文件扩展名正确
         base_path, ext = os.path.splitext(output_path)
         if file_format == "json" and ext != ".json":
@@ -43,14 +109,7 @@ class JSONStorage:
         elif file_format == "jsonl" and ext != ".jsonl":
             output_path = base_path + ".jsonl"
             
-        # 根据格式导出
-        if file_format == "jsonl":
-            with open(output_path, "w", encoding="utf-8") as f:
-                for item in data:
-                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
-        else:
-            # 默认使用json格式，确保是正确的JSON数组格式
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+        # 根据格式流式导出，默认使用json格式，确保是正确的JSON数组格式
+        write_records(output_path, data, "jsonl" if file_format == "jsonl" else "json")
 
 storage = JSONStorage() 
\ No newline at end of file
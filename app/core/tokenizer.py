@@ -0,0 +1,74 @@
+import math
+import re
+from functools import lru_cache
+
+from app.core.logger import logger
+
+# 中日韩文字及全角符号，通常每个字符约为一个 token
+_CJK_RANGES = r'\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef'
+_CJK = re.compile(f'[{_CJK_RANGES}]')
+_WORD = re.compile(f'[^\\s{_CJK_RANGES}]+')
+
+
+class EstimateTokenizer:
+    """离线 token 估算：中日韩字符按 1 个 token 计，其余连续字符约 4 个字符 1 个 token"""
+
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(_CJK.findall(text)) + sum(math.ceil(len(word) / 4) for word in _WORD.findall(text))
+
+
+class TiktokenTokenizer:
+    """基于 tiktoken 的 BPE 分词（OpenAI 系列模型）"""
+
+    def __init__(self, encoding: str = "cl100k_base"):
+        import tiktoken  # type: ignore
+
+        self.name = f"tiktoken:{encoding}"
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+class HFTokenizer:
+    """基于 transformers 的分词器，适用于 Qwen、DeepSeek 等开源模型"""
+
+    def __init__(self, model: str):
+        from transformers import AutoTokenizer  # type: ignore
+
+        self.name = f"hf:{model}"
+        self._tokenizer = AutoTokenizer.from_pretrained(model)
+
+    def count(self, text: str) -> int:
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(spec: str = "estimate"):
+    """
+    按名称获取分词器，同一名称只加载一次
+
+    支持的名称:
+    - "estimate": 离线估算
+    - "tiktoken" / "tiktoken:<encoding>": 需安装 tiktoken
+    - "hf:<模型名或本地路径>": 需安装 transformers
+
+    可选依赖缺失或分词器无法加载（例如离线环境下载失败）时退回到离线估算。
+    任何提供 count(text) -> int 方法的对象都可以直接赋给 DocumentProcessor.tokenizer。
+    """
+    spec = (spec or "estimate").strip()
+    kind, _, arg = spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            return TiktokenTokenizer(arg or "cl100k_base")
+        if kind == "hf" and arg:
+            return HFTokenizer(arg)
+        if kind != "estimate":
+            logger.warning(f"未知的分词器 {spec}，使用离线估算")
+    except Exception as e:
+        logger.warning(f"加载分词器 {spec} 失败，使用离线估算: {str(e)}")
+    return EstimateTokenizer()
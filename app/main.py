@@ -1,6 +1,6 @@
 from fastapi import FastAPI
 from app.core.logger import logger
-from app.api.dataset import router as dataset_router
+from app.api.dataset import router as dataset_router, service as dataset_service
 from app.core.config import config
 
 app = FastAPI(title="FastDatasets")
@@ -9,6 +9,12 @@ app = FastAPI(title="FastDatasets")
 app.include_router(dataset_router, prefix="/api")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    # 关闭 LLM 共享连接池
+    await dataset_service.aclose()
+
+
 @app.get("/")
 async def root():
     logger.info("API服务已启动")
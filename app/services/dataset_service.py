@@ -1,5 +1,4 @@
 import os
-import re
 import json
 import logging
 import asyncio
@@ -7,110 +6,45 @@ from typing import List, Dict, Any
 from app.core.config import config
 from app.core.llm import AsyncLLM
 from app.core.prompt import get_prompt
+from app.core.reader import read_text
+from app.core.splitter import MarkdownSplitter
 from app.core.storage import storage
 from app.core.logger import logger
 
 class TextSplitter:
+    """Markdown splitter used by the service; delegates to the shared MarkdownSplitter engine."""
+
+    @staticmethod
+    def _engine(min_len: int = 0, max_len: int = 0) -> MarkdownSplitter:
+        return MarkdownSplitter(min_len, max_len, language="en")
+
     @staticmethod
     def extract_outline(text: str) -> List[Dict[str, Any]]:
         """Extract markdown headings as outline."""
-        outline = []
-        for match in re.finditer(r'^(#{1,6})\s+(.+?)(?:\s*\{#[\w-]+\})?\s*$', text, re.MULTILINE):
-            level = len(match.group(1))
-            title = match.group(2).strip()
-            outline.append({'level': level, 'title': title, 'position': match.start()})
-        return outline
+        return MarkdownSplitter.extract_outline(text)
 
     @staticmethod
     def split_by_headings(text: str, outline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Split markdown text by headings."""
-        if not outline:
-            return [{'heading': None, 'level': 0, 'content': text, 'position': 0}]
-        sections = []
-        if outline[0]['position'] > 0:
-            front = text[:outline[0]['position']].strip()
-            if front:
-                sections.append({'heading': None, 'level': 0, 'content': front, 'position': 0})
-        for i, current in enumerate(outline):
-            next_pos = outline[i+1]['position'] if i+1 < len(outline) else len(text)
-            heading_line = text[current['position']:].split('\n', 1)[0]
-            start = current['position'] + len(heading_line) + 1
-            content = text[start:next_pos].strip()
-            sections.append({
-                'heading': current['title'],
-                'level': current['level'],
-                'content': content,
-                'position': current['position']
-            })
-        return sections
+        return MarkdownSplitter.split_by_headings(text, outline)
 
     @staticmethod
     def generate_summary(section: Dict[str, Any], outline: List[Dict[str, Any]]) -> str:
-        content = section.get('content', '').strip()
-        if content:
-            return content[:100]
-        if (not section.get('heading') and section.get('level', 0) == 0):
-            doc_title = outline[0]['title'] if outline and outline[0]['level'] == 1 else 'Document'
-            return f"{doc_title} Introduction"
-        if section.get('heading'):
-            idx = next((i for i, o in enumerate(outline) if o['title'] == section['heading'] and o['level'] == section['level']), -1)
-            if idx == -1:
-                return section['heading']
-            parent_titles = []
-            parent_level = section['level'] - 1
-            for i in range(idx-1, -1, -1):
-                if outline[i]['level'] == parent_level:
-                    parent_titles.insert(0, outline[i]['title'])
-                    parent_level -= 1
-            if parent_titles:
-                return ' > '.join(parent_titles) + ' > ' + section['heading']
-            return section['heading']
-        return 'Unnamed Section'
+        return TextSplitter._engine().summarize(section, outline)
 
     @staticmethod
     def split_sections(sections: List[Dict[str, Any]], outline: List[Dict[str, Any]], min_len: int, max_len: int) -> List[Dict[str, Any]]:
-        result = []
-        buffer = None
-        for section in sections:
-            content = section['content'].strip()
-            if len(content) < min_len:
-                if buffer:
-                    buffer['content'] += '\n\n' + (f"{'#'*section['level']} {section['heading']}\n" if section['heading'] else '') + content
-                else:
-                    buffer = section.copy()
-            else:
-                if buffer:
-                    merged = buffer['content'] + '\n\n' + content
-                    if len(merged) <= max_len:
-                        buffer['content'] = merged
-                        result.append({'summary': TextSplitter.generate_summary(buffer, outline), 'content': buffer['content']})
-                        buffer = None
-                    else:
-                        result.append({'summary': TextSplitter.generate_summary(buffer, outline), 'content': buffer['content']})
-                        result.append({'summary': TextSplitter.generate_summary(section, outline), 'content': content})
-                        buffer = None
-                else:
-                    if len(content) > max_len:
-                        sentences = re.split(r'(?<=[.!?。！？])', content)
-                        chunk = ''
-                        for sent in sentences:
-                            if len(chunk) + len(sent) > max_len:
-                                result.append({'summary': TextSplitter.generate_summary(section, outline), 'content': chunk})
-                                chunk = sent
-                            else:
-                                chunk += sent
-                        if chunk:
-                            result.append({'summary': TextSplitter.generate_summary(section, outline), 'content': chunk})
-                    else:
-                        result.append({'summary': TextSplitter.generate_summary(section, outline), 'content': content})
-        if buffer:
-            result.append({'summary': TextSplitter.generate_summary(buffer, outline), 'content': buffer['content']})
-        return result
+        chunks = TextSplitter._engine(min_len, max_len).split_sections(sections, outline)
+        return [{'summary': chunk['summary'], 'content': chunk['content']} for chunk in chunks]
 
 class DatasetService:
     def __init__(self):
         self.llm = AsyncLLM()
 
+    async def aclose(self):
+        """Release the pooled HTTP connections held by the LLM client."""
+        await self.llm.aclose()
+
     def load_files(self, input_path: str) -> List[str]:
         exts = ('.md', '.txt')
         if os.path.isdir(input_path):
@@ -123,8 +57,7 @@ class DatasetService:
 
     def read_file(self, file_path: str) -> str:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
+            text = read_text(file_path)
         except Exception as e:
             logger.error(f"Failed to read file: {file_path}, {e}")
             text = ''
@@ -7,7 +7,7 @@ to provide a stable import path for users when installed via PyPI.
 from app.core.config import Config, config  # noqa: F401
 from app.core.document import DocumentProcessor  # noqa: F401
 from app.core.dataset import DatasetBuilder  # noqa: F401
-from .api import generate_dataset, generate_dataset_to_dir  # noqa: F401
+from .api import generate_dataset, generate_dataset_to_dir, iter_dataset  # noqa: F401
 
 __all__ = [
     "Config",
@@ -16,6 +16,7 @@ __all__ = [
     "DatasetBuilder",
     "generate_dataset",
     "generate_dataset_to_dir",
+    "iter_dataset",
 ]
 
 
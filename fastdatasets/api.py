@@ -2,11 +2,12 @@ from __future__ import annotations
 
 import asyncio
 from pathlib import Path
-from typing import Iterable, List, Optional, Union
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Union
 
 from app.core.config import Config, config
 from app.core.document import DocumentProcessor
 from app.core.dataset import DatasetBuilder
+from app.core.manifest import BuildManifest
 
 
 InputPaths = Union[str, Path, Iterable[Union[str, Path]]]
@@ -59,30 +60,123 @@ def generate_dataset(
     api_key: Optional[str] = None,
     api_base: Optional[str] = None,
     model_name: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_path: Optional[Union[str, Path]] = None,
+    workers: int = 1,
+    ordered: bool = True,
 ) -> List[dict]:
     """Generate dataset from files/dirs with simple, sync API.
 
     - Hides asyncio usage internally
     - Allows overriding common knobs (chunk_size/overlap, COT, concurrency, LLM configs)
+    - With ``checkpoint_path``, completed QA pairs are journaled as they finish;
+      ``resume=True`` skips work already recorded there
+    - ``workers > 1`` parses and chunks files in a process pool; each file is
+      isolated and bounded by ``DOCUMENT_EXTRACTION_TIMEOUT``. ``ordered=False``
+      keeps chunks in completion order instead of input order
+    - Chunks are fed to the LLM pipeline as each file finishes parsing, so
+      generation starts before the last document is parsed
     """
     _apply_overrides(api_key, api_base, model_name, enable_cot, max_llm_concurrency, None)
 
-    paths = _normalize_inputs(inputs)
-    processor = DocumentProcessor()
+    builder = DatasetBuilder()
+    dataset: List[dict] = asyncio.run(
+        _build_and_close(
+            builder,
+            _stream_chunks(inputs, chunk_size, chunk_overlap, workers, ordered),
+            resume=resume,
+            checkpoint_path=str(checkpoint_path) if checkpoint_path else None,
+        )
+    )
+    return dataset
+
+
+def iter_dataset(
+    inputs: InputPaths,
+    *,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: int = 200,
+    enable_cot: Optional[bool] = None,
+    max_llm_concurrency: Optional[int] = None,
+    api_key: Optional[str] = None,
+    api_base: Optional[str] = None,
+    model_name: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_path: Optional[Union[str, Path]] = None,
+    include_content: bool = True,
+    workers: int = 1,
+) -> Iterator[dict]:
+    """Sync generator yielding QA pairs as soon as each one completes.
+
+    Same knobs as ``generate_dataset``, but nothing is accumulated in memory:
+    items come out in completion order and failed items are skipped, so callers
+    can stream them to disk. Set ``include_content=False`` to drop the source
+    chunk text from each item.
+    """
+    _apply_overrides(api_key, api_base, model_name, enable_cot, max_llm_concurrency, None)
 
-    all_chunks: List[dict] = []
-    for path in paths:
+    builder = DatasetBuilder()
+    agen = builder.iter_dataset(
+        _stream_chunks(inputs, chunk_size, chunk_overlap, workers, ordered=False),
+        resume=resume,
+        checkpoint_path=str(checkpoint_path) if checkpoint_path else None,
+        include_content=include_content,
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                item = loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+            yield item
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(builder.aclose())
+        loop.close()
+
+
+def _iter_input_files(inputs: InputPaths) -> List[str]:
+    files: List[str] = []
+    for path in _normalize_inputs(inputs):
         if path.is_dir():
-            for fp in path.rglob("*.*"):
-                chunks = processor.process_document(str(fp), chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-                all_chunks.extend(chunks)
+            files.extend(str(fp) for fp in path.rglob("*.*") if fp.is_file())
         else:
-            chunks = processor.process_document(str(path), chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            all_chunks.extend(chunks)
+            files.append(str(path))
+    return files
 
-    builder = DatasetBuilder()
-    dataset: List[dict] = asyncio.run(builder.build_dataset(all_chunks))
-    return dataset
+
+def _stream_chunks(
+    inputs: InputPaths,
+    chunk_size: Optional[int],
+    chunk_overlap: int,
+    workers: int = 1,
+    ordered: bool = True,
+) -> AsyncIterator[dict]:
+    processor = DocumentProcessor()
+    return processor.astream_chunks(
+        _iter_input_files(inputs),
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        workers=workers,
+        ordered=ordered,
+    )
+
+
+async def _build_and_close(builder: DatasetBuilder, chunks: Union[List[dict], AsyncIterator[dict]],
+                           **kwargs) -> List[dict]:
+    try:
+        return await builder.build_dataset(chunks, **kwargs)
+    finally:
+        await builder.aclose()
+
+
+async def _build_incremental_and_close(builder: DatasetBuilder, files: List[str], manifest: BuildManifest,
+                                      **kwargs) -> List[dict]:
+    try:
+        return await builder.build_incremental(files, manifest, **kwargs)
+    finally:
+        await builder.aclose()
 
 
 def generate_dataset_to_dir(
@@ -98,9 +192,22 @@ def generate_dataset_to_dir(
     api_key: Optional[str] = None,
     api_base: Optional[str] = None,
     model_name: Optional[str] = None,
+    resume: bool = False,
+    checkpoint_path: Optional[Union[str, Path]] = None,
+    workers: int = 1,
+    incremental: bool = False,
 ) -> List[dict]:
     """Generate dataset and export to directory in chosen formats.
 
+    Progress is journaled to ``<output_dir>/checkpoint.jsonl`` unless another
+    ``checkpoint_path`` is given, so an interrupted run can be restarted with
+    ``resume=True``.
+
+    With ``incremental=True``, ``<output_dir>/manifest.json`` records which QA
+    items each chunk produced. Later runs reuse them for unchanged files and
+    chunks, only call the LLM for new or changed chunks, and drop items from
+    files that are no longer among the inputs.
+
     Returns the in-memory dataset (list of dict) for further processing.
     """
     if formats is None:
@@ -109,16 +216,36 @@ def generate_dataset_to_dir(
     # Apply overrides including output formats
     _apply_overrides(api_key, api_base, model_name, enable_cot, max_llm_concurrency, formats)
 
-    dataset = generate_dataset(
-        inputs,
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        enable_cot=enable_cot,
-        max_llm_concurrency=max_llm_concurrency,
-        api_key=api_key,
-        api_base=api_base,
-        model_name=model_name,
-    )
+    checkpoint_path = checkpoint_path or Path(output_dir) / "checkpoint.jsonl"
+    if incremental:
+        manifest = BuildManifest(str(Path(output_dir) / "manifest.json")).load()
+        builder = DatasetBuilder()
+        dataset = asyncio.run(
+            _build_incremental_and_close(
+                builder,
+                _iter_input_files(inputs),
+                manifest,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                workers=workers,
+                resume=resume,
+                checkpoint_path=str(checkpoint_path),
+            )
+        )
+    else:
+        dataset = generate_dataset(
+            inputs,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            enable_cot=enable_cot,
+            max_llm_concurrency=max_llm_concurrency,
+            api_key=api_key,
+            api_base=api_base,
+            model_name=model_name,
+            resume=resume,
+            checkpoint_path=checkpoint_path,
+            workers=workers,
+        )
 
     builder = DatasetBuilder()
     Path(output_dir).mkdir(parents=True, exist_ok=True)
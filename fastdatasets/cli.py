@@ -2,14 +2,19 @@ import argparse
 import asyncio
 import os
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
+from app.core.circuit import ErrorBudgetExceeded
 from app.core.config import Config
 from app.core.document import DocumentProcessor
 from app.core.dataset import DatasetBuilder
+from app.core.manifest import BuildManifest
 
 
-def run_generate(input_paths: List[str], output_dir: str, formats: List[str], file_format: str):
+def run_generate(input_paths: List[str], output_dir: str, formats: List[str], file_format: str,
+                 resume: bool = False, checkpoint: Optional[str] = None, workers: int = 1,
+                 incremental: bool = False, dedup_chunks: bool = False, dedup_questions: bool = False,
+                 batch: bool = False):
     cfg = Config()
 
     # 环境变量覆盖（便于 CLI 直接注入）
@@ -20,20 +25,38 @@ def run_generate(input_paths: List[str], output_dir: str, formats: List[str], fi
 
     processor = DocumentProcessor()
     builder = DatasetBuilder()
+    if dedup_chunks:
+        builder.chunk_dedup = True
+    if dedup_questions:
+        builder.question_dedup = True
 
-    # 收集所有块
-    all_chunks = []
+    # 收集所有文件
+    files = []
     for p in input_paths:
         path = Path(p)
         if path.is_dir():
-            for fp in path.rglob("*.*"):
-                chunks = processor.process_document(str(fp))
-                all_chunks.extend(chunks)
+            files.extend(str(fp) for fp in path.rglob("*.*") if fp.is_file())
         else:
-            chunks = processor.process_document(str(path))
-            all_chunks.extend(chunks)
-
-    dataset = asyncio.run(builder.build_dataset(all_chunks))
+            files.append(str(path))
+
+    # 检查点默认写入输出目录，中断后可用 --resume 继续
+    checkpoint_path = checkpoint or str(Path(output_dir) / "checkpoint.jsonl")
+
+    async def _build():
+        try:
+            if incremental:
+                # 清单记录上一次构建的结果，只为新增或变化的文档块生成问答
+                manifest = BuildManifest(str(Path(output_dir) / "manifest.json")).load()
+                return await builder.build_incremental(files, manifest, processor=processor, workers=workers,
+                                                       resume=resume, checkpoint_path=checkpoint_path)
+            # 文档块边解析边送入生成流水线（workers > 1 时多进程并行解析）
+            chunks = processor.astream_chunks(files, workers=workers)
+            return await builder.build_dataset(chunks, resume=resume, checkpoint_path=checkpoint_path,
+                                               mode="batch" if batch else "online")
+        finally:
+            await builder.aclose()
+
+    dataset = asyncio.run(_build())
 
     # 导出
     Path(output_dir).mkdir(parents=True, exist_ok=True)
@@ -49,12 +72,31 @@ def main():
     gen.add_argument("-o", "--output", default="output", help="Output directory")
     gen.add_argument("-f", "--formats", default="alpaca", help="Export formats, comma-separated (alpaca,sharegpt)")
     gen.add_argument("--file-format", default="json", choices=["json", "jsonl"], help="Output file format")
+    gen.add_argument("-w", "--workers", type=int, default=1, help="Parallel document parsing processes")
+    gen.add_argument("--resume", action="store_true", help="Resume from the checkpoint, skipping completed QA pairs")
+    gen.add_argument("--checkpoint", default=None, help="Checkpoint journal path (default: <output>/checkpoint.jsonl)")
+    gen.add_argument("--incremental", action="store_true",
+                     help="Only generate QA for new or changed chunks, reusing <output>/manifest.json")
+    gen.add_argument("--dedup-chunks", action="store_true",
+                     help="Skip near-duplicate chunks before generating questions (see CHUNK_DEDUP_THRESHOLD)")
+    gen.add_argument("--dedup-questions", action="store_true",
+                     help="Merge near-duplicate questions across chunks before answering (see QUESTION_DEDUP_THRESHOLD)")
+    gen.add_argument("--batch", action="store_true",
+                     help="Submit each generation stage through the provider's batch API (see BATCH_* settings)")
 
     args = parser.parse_args()
+    if args.batch and args.incremental:
+        parser.error("--batch cannot be combined with --incremental")
 
     if args.command == "generate":
         formats = [s.strip() for s in str(args.formats).split(",") if s.strip()]
-        run_generate(args.inputs, args.output, formats=formats, file_format=args.file_format)
+        try:
+            run_generate(args.inputs, args.output, formats=formats, file_format=args.file_format,
+                         resume=args.resume, checkpoint=args.checkpoint, workers=args.workers,
+                         incremental=args.incremental, dedup_chunks=args.dedup_chunks,
+                         dedup_questions=args.dedup_questions, batch=args.batch)
+        except ErrorBudgetExceeded as e:
+            parser.exit(1, f"fastdatasets: {e}\n")
 
 
 if __name__ == "__main__":
@@ -25,20 +25,23 @@ async def process_document(file_path: str, output_dir: str = None, output_format
         # 解析文档
         logger.info(f"开始处理文档: {file_path}")
         
-        # 分割文档
-        chunks = processor.process_document(
-            file_path,
+        # 分割文档：在后台线程中解析，文档块一产出就送入生成流水线，不阻塞其他文件的生成
+        chunks = processor.astream_chunks(
+            [file_path],
             chunk_size=config.CHUNK_MAX_LEN,
             chunk_overlap=200
         )
         
-        if not chunks:
+        # 生成数据集
+        try:
+            dataset = await builder.build_dataset(chunks)
+        finally:
+            await builder.aclose()
+        
+        if not dataset:
             logger.error(f"文档处理失败: {file_path}")
             return
         
-        # 生成数据集
-        dataset = await builder.build_dataset(chunks)
-        
         # 保存数据集
         if output_dir:
             # 确保输出目录存在
@@ -0,0 +1,54 @@
+from app.core.chunker import TextChunker, TokenChunker, pack_sentences
+from app.core.tokenizer import EstimateTokenizer, get_tokenizer
+
+
+TEXT = "第一句话。第二句话！Third sentence. 第四句？最后没有结束符"
+
+
+def test_compat_mode_keeps_legacy_boundaries():
+    chunks = list(TextChunker(12, 4).split(TEXT))
+    assert chunks == ["第一句话。第二句话！", "Third sentence.", " 第四句？最后没有结束符"]
+    # legacy overlap starts after the last terminator, so sentence-final chunks do not overlap
+    assert list(TextChunker(12, 4).split("abcdefghij. klmnop")) == ["abcdefghij.", " klmnop"]
+    # whitespace-only input falls back to fixed-size slices
+    assert list(TextChunker(4, 1).split("      ")) == ["    ", "   "]
+
+
+def test_streaming_matches_whole_text_for_any_block_boundaries():
+    text = TEXT * 50
+    expected = list(TextChunker(40, 10).split(text))
+    for size in (1, 3, 7, 64):
+        blocks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert list(TextChunker(40, 10).split_stream(blocks)) == expected
+
+
+def test_strict_mode_bounds_chunks_and_overlaps_whole_sentences():
+    text = "一二三。四五六。七八九。" + "长" * 30 + "。"
+    chunks = list(TextChunker(10, 5, compat=False).split(text))
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert chunks[:2] == ["一二三。四五六。", "四五六。七八九。"]
+    assert "".join(chunks).count("长") >= 30
+
+
+def test_pack_sentences():
+    assert list(pack_sentences("ab。cd。ef。", 4)) == ["ab。", "cd。", "ef。"]
+    # legacy quirk: an over-long first sentence is preceded by an empty chunk
+    assert list(pack_sentences("abcdef。g。", 4)) == ["", "abcdef。", "g。"]
+    assert list(pack_sentences("abcdef。g。", 4, compat=False)) == ["abcd", "ef。", "g。"]
+
+
+def test_token_chunker_packs_to_budget_with_sentence_overlap():
+    tokenizer = EstimateTokenizer()
+    # 6 tokens per Chinese sentence, 3 per English one
+    text = "中文句子一。中文句子二。short one here. 中文句子三。" + "长" * 25 + "。"
+    chunks = list(TokenChunker(tokenizer, 15, overlap_tokens=6).split(text))
+
+    assert all(tokens <= 15 and tokens == tokenizer.count(chunk) for chunk, tokens in chunks)
+    assert chunks[0][0] == "中文句子一。中文句子二。"
+    assert chunks[1][0].startswith("中文句子二。")
+    assert "".join(chunk for chunk, _ in chunks).count("长") == 25
+
+
+def test_unknown_or_unavailable_tokenizer_falls_back_to_estimate():
+    assert get_tokenizer("no-such-tokenizer").name == "estimate"
+    assert get_tokenizer("hf:").name == "estimate"
@@ -0,0 +1,36 @@
+import asyncio
+
+from app.core.concurrency import AdaptiveConcurrencyLimiter
+
+
+def test_limit_grows_when_healthy_and_halves_on_overload():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, max_limit=16)
+    for _ in range(40):
+        limiter.record_success(0.1)
+    grown = limiter.limit
+    assert grown > 4
+
+    limiter.record_failure(overload=True)
+    assert limiter.limit == max(1, grown // 2)
+    # a burst of overload signals within the same round only shrinks once
+    limiter.record_failure(overload=True)
+    assert limiter.limit == max(1, grown // 2)
+    assert limiter.stats()["decreases"] == 1
+
+
+def test_inflight_never_exceeds_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial=3, adaptive=False)
+    peak = 0
+
+    async def worker():
+        nonlocal peak
+        async with limiter:
+            peak = max(peak, limiter.inflight)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(20)))
+
+    asyncio.run(run())
+    assert peak == 3
+    assert limiter.inflight == 0
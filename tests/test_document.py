@@ -0,0 +1,193 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from app.core import document
+from app.core.cache import ParseCache
+from app.core.chunker import TextChunker
+from app.core.document import DocumentProcessor
+from app.core.pdf import iter_pdf_pages
+from app.core.reader import detect_encoding, iter_text
+from app.core.tokenizer import get_tokenizer
+
+
+def _write_docs(tmp_path, count=4):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_text("".join(f"第{i}篇文档的第{j}句话。" for j in range(200)), encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+def test_parallel_processing_matches_serial_and_isolates_errors(tmp_path):
+    paths = _write_docs(tmp_path)
+    paths.insert(2, str(tmp_path / "missing.txt"))
+    processor = DocumentProcessor()
+
+    serial = list(processor.process_documents(paths, chunk_size=500))
+    parallel = list(processor.process_documents(paths, chunk_size=500, workers=2))
+
+    assert [p for p, _ in parallel] == paths
+    assert parallel == serial
+    assert dict(parallel)[str(tmp_path / "missing.txt")] == []
+
+
+def test_worker_crash_rebuilds_pool_and_fails_only_the_crashing_file(tmp_path, monkeypatch):
+    import multiprocessing
+    import os
+
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("the crashing worker is patched in and needs forked workers")
+    paths = _write_docs(tmp_path, count=5)
+    crash = str(tmp_path / "crash.txt")
+    Path(crash).write_text("boom", encoding="utf-8")
+    paths.insert(1, crash)
+    process_document = DocumentProcessor.process_document
+
+    def crashing(self, file_path, *args, **kwargs):
+        if file_path == crash:
+            os._exit(1)
+        return process_document(self, file_path, *args, **kwargs)
+
+    monkeypatch.setattr(DocumentProcessor, "process_document", crashing)
+    results = list(DocumentProcessor().process_documents(paths, chunk_size=500, workers=3))
+
+    assert [p for p, _ in results] == paths
+    # the crash takes the in-flight files down with it, but only the culprit is lost
+    assert dict(results)[crash] == []
+    assert all(chunks for p, chunks in results if p != crash)
+
+
+def test_unordered_processing_yields_every_file(tmp_path):
+    paths = _write_docs(tmp_path)
+    processor = DocumentProcessor()
+    results = list(processor.process_documents(paths, chunk_size=500, workers=3, ordered=False))
+    assert sorted(p for p, _ in results) == sorted(paths)
+    assert all(chunks for _, chunks in results)
+
+
+def test_async_chunk_stream_matches_serial(tmp_path):
+    paths = _write_docs(tmp_path, count=3)
+    processor = DocumentProcessor()
+    expected = [chunk for _, chunks in processor.process_documents(paths, chunk_size=500) for chunk in chunks]
+
+    async def collect():
+        return [chunk async for chunk in processor.astream_chunks(paths, chunk_size=500, workers=2)]
+
+    assert asyncio.run(collect()) == expected
+
+
+def test_parse_cache_skips_extraction_for_unchanged_files(tmp_path):
+    # plain .txt files are streamed straight into the chunker, so exercise the text cache with Markdown
+    path = tmp_path / "doc.md"
+    path.write_text("# 标题\n\n" + "".join(f"第{j}句话。" for j in range(200)), encoding="utf-8")
+    path = str(path)
+    processor = DocumentProcessor()
+    processor.cache = ParseCache(str(tmp_path / "parse.sqlite"))
+    first = processor.process_document(path, chunk_size=500)
+
+    parsed = []
+    original = processor._parse_txt
+    processor._parse_txt = lambda file_path: parsed.append(file_path) or original(file_path)
+
+    assert processor.process_document(path, chunk_size=500) == first
+    # new chunking parameters re-chunk the cached text without extracting again
+    assert processor.process_document(path, chunk_size=300)
+    assert parsed == []
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("新增内容。")
+    processor.process_document(path, chunk_size=500)
+    assert len(parsed) == 1
+
+
+def test_large_txt_is_streamed_chunk_by_chunk(tmp_path, monkeypatch):
+    paths = _write_docs(tmp_path, count=3)
+    big = tmp_path / "big.txt"
+    big.write_text("".join(f"大文件的第{j}句话。" for j in range(3000)), encoding="utf-8")
+    paths.insert(1, str(big))
+    processor = DocumentProcessor()
+    expected = [chunk for _, chunks in processor.process_documents(paths, chunk_size=500) for chunk in chunks]
+
+    read = []
+
+    def small_blocks(path):
+        text = Path(path).read_text(encoding="utf-8")
+        for i in range(0, len(text), 1000):
+            read.append(i)
+            yield text[i:i + 1000]
+
+    monkeypatch.setattr(document.config, "TXT_STREAM_MIN_BYTES", big.stat().st_size)
+    monkeypatch.setattr(document, "iter_text", small_blocks)
+
+    async def collect():
+        chunks, read_at_first = [], None
+        async for chunk in processor.astream_chunks(paths, chunk_size=500, workers=2):
+            if chunk["file"] == str(big) and read_at_first is None:
+                read_at_first = len(read)
+            chunks.append(chunk)
+        return chunks, read_at_first
+
+    chunks, read_at_first = asyncio.run(collect())
+    streamed = [chunk for chunk in chunks if chunk["file"] == str(big)]
+    # the big file's first chunk arrives before the rest of the file has been read
+    assert read_at_first < len(read)
+    assert all(chunk["metadata"]["total_chunks"] is None for chunk in streamed)
+    for chunk in streamed:
+        chunk["metadata"]["total_chunks"] = len(streamed)
+    assert chunks == expected
+
+
+def test_token_mode_records_token_counts_and_respects_budget(tmp_path):
+    paths = _write_docs(tmp_path, count=2)
+    processor = DocumentProcessor()
+    processor.chunk_unit = "tokens"
+    processor.tokenizer = get_tokenizer("estimate")
+
+    serial = list(processor.process_documents(paths, chunk_size=300, chunk_overlap=50))
+    chunks = [chunk for _, file_chunks in serial for chunk in file_chunks]
+    assert chunks and all(0 < chunk["metadata"]["tokens"] <= 300 for chunk in chunks)
+    # worker processes rebuild the same tokenizer from the processor's settings
+    assert list(processor.process_documents(paths, chunk_size=300, chunk_overlap=50, workers=2)) == serial
+
+
+def test_txt_streaming_detects_encoding_and_matches_whole_text(tmp_path):
+    text = "".join(f"第{j}句话，内容较长一些。\r\n" for j in range(300))
+    path = tmp_path / "gbk.txt"
+    path.write_bytes(text.encode("gbk"))
+    processor = DocumentProcessor()
+
+    assert detect_encoding(str(path)) == "gbk"
+    whole = processor._parse_txt(path)
+    assert whole == text.replace("\r\n", "\n")
+    chunks = processor.process_document(str(path), chunk_size=200, chunk_overlap=20)
+    assert [chunk["content"] for chunk in chunks] == processor._split_text(whole, 200, 20)
+    # block boundaries do not change the result
+    assert list(TextChunker(200, 20).split_stream(iter_text(str(path), block_size=7))) == \
+        [chunk["content"] for chunk in chunks]
+
+
+def test_pdf_pages_are_streamed_into_chunks_with_page_numbers(tmp_path, monkeypatch):
+    path = tmp_path / "paper.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    pages = [(1, "第一页的内容。" * 30), (2, "   "), (3, "第三页的内容。" * 30)]
+    monkeypatch.setattr(document, "iter_pdf_pages", lambda file_path, backend, workers=1: iter(pages))
+    processor = DocumentProcessor()
+    processor.pdf_backend = "pypdf"
+
+    chunks = processor.process_document(str(path), chunk_size=100, chunk_overlap=0)
+    spans = [(c["metadata"]["page_start"], c["metadata"]["page_end"]) for c in chunks]
+    assert spans[0] == (1, 1) and spans[-1] == (3, 3)
+    # the blank page is skipped and one chunk straddles pages 1 and 3
+    assert (1, 3) in spans and all(2 not in span for span in spans)
+    assert "".join(c["content"] for c in chunks).count("页的内容") == 60
+
+
+def test_native_pdf_backend_extracts_every_page():
+    pytest.importorskip("pypdf")
+    pdf = str(Path(__file__).parent / "BERT：Pre-training of Deep Bidirectional Transformers for Language Understanding.pdf")
+    serial = list(iter_pdf_pages(pdf, "pypdf"))
+    assert [number for number, _ in serial] == list(range(1, len(serial) + 1))
+    assert list(iter_pdf_pages(pdf, "pypdf", workers=2, batch_size=4)) == serial
@@ -0,0 +1,417 @@
+import asyncio
+import json
+
+import httpx
+
+from app.core.cache import LLMCache
+from app.core.llm import AsyncLLM
+
+
+def _ok_handler(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+
+def test_client_is_reused_across_calls():
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(_ok_handler))
+
+    async def run():
+        first = await llm.call_llm("hello")
+        client = llm._get_client()
+        second = await llm.call_llm("hello again")
+        assert llm._get_client() is client
+        await llm.aclose()
+        return first, second, client
+
+    first, second, client = asyncio.run(run())
+    assert first == second == "ok"
+    assert client.is_closed
+
+
+def test_cached_response_skips_http(tmp_path):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return _ok_handler(request)
+
+    cache = LLMCache(str(tmp_path / "llm.sqlite"))
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler), cache=cache)
+
+    async def run():
+        first = await llm.call_llm("same prompt")
+        second = await llm.call_llm("same prompt")
+        await llm.aclose()
+        return first, second
+
+    assert asyncio.run(run()) == ("ok", "ok")
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm.sqlite"), max_bytes=200)
+    for i in range(10):
+        cache.set(f"k{i}", {"content": "x" * 40})
+    assert cache.get("k0") is None
+    assert cache.get("k9") == {"content": "x" * 40}
+    assert cache.stats()["size_bytes"] <= 200
+    assert cache.stats()["evictions"] > 0
+
+
+def test_cache_hits_buffer_access_times_until_flush(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm.sqlite"), max_bytes=200)
+    for i in range(3):
+        cache.set(f"k{i}", {"content": "x" * 40})
+    changes = cache._conn.total_changes
+    assert cache.get("k0") == {"content": "x" * 40}
+    # a hit does not write to the database
+    assert cache._conn.total_changes == changes
+    for i in range(3, 5):
+        cache.set(f"k{i}", {"content": "x" * 40})
+    # the buffered access time is flushed before eviction, so the recently read entry survives
+    assert cache.get("k0") is not None
+    assert cache.get("k1") is None
+    cache.close()
+
+
+def test_usage_reports_provider_cached_tokens():
+    responses = iter([
+        {"prompt_tokens": 1000, "completion_tokens": 50, "prompt_tokens_details": {"cached_tokens": 0}},
+        {"prompt_tokens": 1000, "completion_tokens": 40, "prompt_tokens_details": {"cached_tokens": 896}},
+        {"prompt_tokens": 1000, "completion_tokens": 30, "prompt_cache_hit_tokens": 904},
+    ])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}], "usage": next(responses)})
+
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler))
+
+    async def run():
+        for i in range(3):
+            await llm.call_llm(f"prompt {i}")
+        await llm.aclose()
+
+    asyncio.run(run())
+    usage = llm.stats()["usage"]
+    assert usage == {"requests": 3, "prompt_tokens": 3000, "completion_tokens": 120,
+                     "cached_tokens": 1800, "cached_ratio": 0.6}
+
+
+def test_openai_batch_transport_uploads_polls_and_merges_error_file(tmp_path):
+    from app.core.batch import OpenAIBatchTransport
+
+    seen = []
+    statuses = iter(["in_progress", "completed"])
+    files = {"out": b'{"custom_id": "req-1"}', "err": b'{"custom_id": "req-2"}\n'}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append((request.method, request.url.path))
+        if request.url.path.endswith("/files"):
+            assert b'name="purpose"' in request.content and b"batch" in request.content
+            return httpx.Response(200, json={"id": "file-in"})
+        if request.url.path.endswith("/batches"):
+            assert json.loads(request.content)["input_file_id"] == "file-in"
+            return httpx.Response(200, json={"id": "batch-1", "status": "validating"})
+        if request.url.path.endswith("/batches/batch-1"):
+            return httpx.Response(200, json={"id": "batch-1", "status": next(statuses),
+                                             "output_file_id": "out", "error_file_id": "err"})
+        return httpx.Response(200, content=files[request.url.path.split("/")[-2]])
+
+    input_path = tmp_path / "in.jsonl"
+    input_path.write_text('{"custom_id": "req-1"}\n', encoding="utf-8")
+    transport = OpenAIBatchTransport("http://llm.test/v1", "k", transport=httpx.MockTransport(handler))
+
+    async def run():
+        batch_id = await transport.submit(str(input_path))
+        states = [await transport.status(batch_id), await transport.status(batch_id)]
+        await transport.fetch(batch_id, str(tmp_path / "out.jsonl"))
+        await transport.aclose()
+        return states
+
+    assert asyncio.run(run()) == ["in_progress", "completed"]
+    assert (tmp_path / "out.jsonl").read_text(encoding="utf-8").splitlines() == [
+        '{"custom_id": "req-1"}', '{"custom_id": "req-2"}']
+    assert seen[-2:] == [("GET", "/v1/files/out/content"), ("GET", "/v1/files/err/content")]
+
+
+def test_batch_transport_missing_a_method_fails_at_construction():
+    import pytest
+
+    from app.core.batch import BatchTransport
+
+    class NoFetch(BatchTransport):
+        async def submit(self, input_path):
+            return "batch-1"
+
+        async def status(self, batch_id):
+            return "completed"
+
+    with pytest.raises(TypeError):
+        NoFetch()
+
+
+def test_batch_wave_is_not_split_by_requests_waiting_on_real_io(tmp_path):
+    import time
+
+    from app.core.batch import BatchLLM, LocalBatchTransport
+
+    transport = LocalBatchTransport(str(tmp_path / "remote"),
+                                    lambda body: {"choices": [{"message": {"content": "ok"}}]})
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k")
+    batch_llm = BatchLLM(llm, transport, str(tmp_path / "work"), poll_interval=0, settle_delay=0.2)
+
+    async def call(i):
+        if i % 2:
+            # e.g. a thread-pool parse before the request is registered
+            await asyncio.get_running_loop().run_in_executor(None, time.sleep, 0.05)
+        return await batch_llm.call_llm_advanced(f"p{i}")
+
+    results = asyncio.run(batch_llm.run([call(i) for i in range(4)]))
+
+    assert all(result["choices"][0]["message"]["content"] == "ok" for result in results)
+    assert batch_llm.waves == 1 and len(transport.submitted) == 1
+
+
+def _pool(*weights, **kwargs):
+    from app.core.endpoints import Endpoint, EndpointPool
+
+    endpoints = [Endpoint(f"http://replica{i}.test/v1", "k", "m", weight=w, name=f"r{i}") for i, w in enumerate(weights)]
+    return EndpointPool(endpoints, **kwargs)
+
+
+def test_requests_spread_by_outstanding_load_and_weight():
+    hits = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        hits.append(request.url.host)
+        await asyncio.sleep(0.05)
+        return _ok_handler(request)
+
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler), pool=_pool(2, 1))
+
+    async def run():
+        await asyncio.gather(*(llm.call_llm(f"p{i}") for i in range(6)))
+        await llm.aclose()
+
+    asyncio.run(run())
+    assert sorted(hits) == ["replica0.test"] * 4 + ["replica1.test"] * 2
+    assert llm.semaphore.limit == 2 * llm.max_concurrency
+
+
+def test_failing_replica_is_skipped_without_backoff():
+    hits = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits.append(request.url.host)
+        if request.url.host == "replica0.test":
+            return httpx.Response(503, text="down")
+        return _ok_handler(request)
+
+    pool = _pool(1, 1, failure_threshold=2, cooldown=60)
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler), pool=pool)
+
+    async def run():
+        results = [await llm.call_llm(f"p{i}") for i in range(4)]
+        await llm.aclose()
+        return results
+
+    assert asyncio.run(run()) == ["ok"] * 4
+    # the dead replica is tried twice, then paused; every request fails over immediately
+    assert hits.count("replica0.test") == 2
+    assert [e["healthy"] for e in llm.stats()["endpoints"]] == [False, True]
+
+
+def test_latency_routing_avoids_slow_replica():
+    pool = _pool(1, 1, 1, routing="latency", slow_factor=3)
+    fast, slow, new = pool.endpoints
+    pool.record_success(fast, 0.5)
+    pool.record_success(slow, 4.0)
+    fast.outstanding = 5
+    # the untried replica is assumed to be as fast as the fastest one
+    assert pool.select() is new
+    new.outstanding = 5
+    # the slow replica is only used once nothing else is left
+    assert pool.select() is fast
+    assert pool.select(exclude=[fast, new]) is slow
+
+
+def test_circuit_breaker_half_opens_for_a_single_probe():
+    import time
+
+    from app.core.circuit import CircuitBreaker
+
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=10)
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is True
+    assert not breaker.available()
+    later = time.monotonic() + 11
+    assert breaker.available(later)
+    breaker.on_start()
+    # only one probe is admitted while half open
+    assert not breaker.available(later)
+    breaker.record_success()
+    breaker.on_end()
+    assert breaker.available() and breaker.state == "closed"
+
+
+def test_open_circuit_fails_fast_instead_of_retrying(monkeypatch):
+    from app.core.circuit import LLMUnavailableError
+    from app.core.config import config
+
+    monkeypatch.setattr(config, "LLM_CIRCUIT_MAX_WAIT", 0)
+    hits = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits.append(request.url.host)
+        return httpx.Response(503, text="down")
+
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler), pool=_pool(1, failure_threshold=2, cooldown=60))
+
+    async def run():
+        results = [await llm.call_llm_advanced(f"p{i}", backoff_factor=0, return_exceptions=True) for i in range(3)]
+        await llm.aclose()
+        return results
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, LLMUnavailableError) for result in results)
+    # the breaker opens after two failures; later attempts never reach the endpoint
+    assert len(hits) == 2
+    assert llm.pool.endpoints[0].breaker.state == "open"
+
+
+def test_cache_keys_responses_by_the_endpoint_model_that_served_them(tmp_path):
+    from app.core.endpoints import Endpoint, EndpointPool
+
+    hits = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits.append(request.url.host)
+        if request.url.host == "primary.test":
+            return httpx.Response(503, text="down")
+        return _ok_handler(request)
+
+    cache = LLMCache(str(tmp_path / "llm.sqlite"))
+    pool = EndpointPool([Endpoint("http://primary.test/v1", "k", "big"), Endpoint("http://fallback.test/v1", "k", "small")])
+    llm = AsyncLLM(model_name="big", base_url="http://primary.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler), cache=cache, pool=pool)
+
+    async def run():
+        results = [await llm.call_llm("hello"), await llm.call_llm("hello")]
+        await llm.aclose()
+        return results
+
+    assert asyncio.run(run()) == ["ok", "ok"]
+    assert hits == ["primary.test", "fallback.test"]
+    # the fallback's answer is not stored as if the primary model had produced it
+    assert cache.get(LLMCache.make_key(llm._build_payload("hello", 2048 * 2, "big"))) is None
+    assert cache.get(LLMCache.make_key(llm._build_payload("hello", 2048 * 2, "small"))) is not None
+
+
+def test_half_open_endpoint_admits_one_probe_across_concurrent_requests(monkeypatch):
+    from app.core.config import config
+    from app.core.ratelimit import RateLimiter
+
+    class YieldingLimiter(RateLimiter):
+        async def acquire(self, tokens: float = 0):
+            await asyncio.sleep(0)
+            return await super().acquire(tokens)
+
+    monkeypatch.setattr(config, "LLM_CIRCUIT_MAX_WAIT", 5)
+    pool = _pool(1, cooldown=60)
+    inflight, probes = [0], []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        inflight[0] += 1
+        if pool.endpoints[0].breaker.state == "half_open":
+            probes.append(inflight[0])
+        await asyncio.sleep(0.05)
+        inflight[0] -= 1
+        return _ok_handler(request)
+
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k", transport=httpx.MockTransport(handler),
+                   pool=pool, rate_limiter=YieldingLimiter())
+    pool.endpoints[0].breaker.trip(0.05)
+
+    async def run():
+        results = await asyncio.gather(*(llm.call_llm(f"p{i}") for i in range(4)))
+        await llm.aclose()
+        return results
+
+    assert asyncio.run(run()) == ["ok"] * 4
+    # exactly one request probed the half-open endpoint; the rest waited for it to close
+    assert probes == [1]
+    assert pool.endpoints[0].breaker.state == "closed"
+
+
+def test_retry_prefers_a_tried_closed_endpoint_over_an_open_one():
+    pool = _pool(1, 1, 1)
+    tried, first_open, second_open = pool.endpoints
+    first_open.breaker.trip(60)
+    second_open.breaker.trip(30)
+    # the only untried endpoints are open; the retry goes back to the healthy one
+    assert pool.select(exclude=[tried]) is tried
+    tried.breaker.trip(90)
+    # with nothing healthy, the endpoint that recovers first is used
+    assert pool.select(exclude=[tried]) is second_open
+
+
+def test_open_circuit_raises_instead_of_returning_a_fallback(monkeypatch):
+    import pytest
+
+    from app.core.circuit import LLMUnavailableError
+    from app.core.config import config
+
+    monkeypatch.setattr(config, "LLM_CIRCUIT_MAX_WAIT", 0)
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(lambda request: httpx.Response(503, text="down")),
+                   pool=_pool(1, failure_threshold=1, cooldown=60))
+    assert not llm.error_budget.enabled
+
+    async def run():
+        try:
+            return await llm.call_llm_advanced("question?", backoff_factor=0)
+        finally:
+            await llm.aclose()
+
+    # even without an error budget, a dead endpoint never turns into a placeholder answer
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(run())
+
+
+def test_backoff_does_not_count_as_outstanding_on_the_endpoint():
+    responses = [httpx.Response(503, text="down"), httpx.ConnectError("refused")]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if responses:
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return _ok_handler(request)
+
+    pool = _pool(1, failure_threshold=10)
+    llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                   transport=httpx.MockTransport(handler), pool=pool)
+    outstanding = []
+    retry_wait = llm._retry_wait
+
+    async def observed_wait(request_id, tried, wait_time):
+        outstanding.append(pool.endpoints[0].outstanding)
+        await retry_wait(request_id, tried, 0)
+
+    llm._retry_wait = observed_wait
+
+    async def run():
+        result = await llm.call_llm("hello")
+        await llm.aclose()
+        return result
+
+    assert asyncio.run(run()) == "ok"
+    # neither the 5xx nor the connection-error backoff holds the endpoint
+    assert outstanding == [0, 0]
@@ -0,0 +1,503 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.core.batch import LocalBatchTransport
+from app.core.config import config
+from app.core.dataset import DatasetBuilder
+from app.core.manifest import BuildManifest
+
+
+def _builder(events):
+    builder = DatasetBuilder()
+    builder.enable_cot = False
+    builder.enable_label = False
+    builder.enable_optimize = False
+
+    async def fake_questions(context, number=5):
+        events.append(("questions", context))
+        # the second chunk is a straggler
+        await asyncio.sleep(0.2 if context == "slow" else 0)
+        return [f"{context}-q{i}" for i in range(2)]
+
+    async def fake_answer(question, context):
+        events.append(("answer", question))
+        return f"answer to {question}"
+
+    builder._generate_questions = fake_questions
+    builder._generate_answer = fake_answer
+    return builder
+
+
+def test_answers_start_before_slow_chunks_finish_and_order_is_kept():
+    events = []
+    builder = _builder(events)
+    chunks = [{"chunk_id": "a", "content": "fast"}, {"chunk_id": "b", "content": "slow"}]
+
+    dataset = asyncio.run(builder.build_dataset(chunks))
+
+    assert [item["question"] for item in dataset] == ["fast-q0", "fast-q1", "slow-q0", "slow-q1"]
+    assert all(item["answer"] == f"answer to {item['question']}" for item in dataset)
+    # the fast chunk's answers are generated while the slow chunk is still pending
+    first_answer = events.index(("answer", "fast-q0"))
+    assert first_answer < events.index(("answer", "slow-q0"))
+    assert ("questions", "slow") in events[:first_answer]
+
+
+def test_resume_skips_checkpointed_work(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    chunks = [{"chunk_id": "a", "content": "fast"}, {"chunk_id": "b", "content": "other"}]
+
+    first_events = []
+    first = asyncio.run(_builder(first_events).build_dataset(chunks, checkpoint_path=checkpoint))
+
+    # simulate a crash that lost the last journaled answer
+    with open(checkpoint, encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(checkpoint, "w", encoding="utf-8") as f:
+        f.writelines(lines[:-1])
+        f.write('{"type": "item", "chunk"')
+
+    events = []
+    resumed = asyncio.run(_builder(events).build_dataset(chunks, resume=True, checkpoint_path=checkpoint))
+
+    assert resumed == first
+    assert not any(kind == "questions" for kind, _ in events)
+    assert len([kind for kind, _ in events if kind == "answer"]) == 1
+
+
+def test_chunks_from_async_source_are_processed_while_source_is_open():
+    events = []
+    builder = _builder(events)
+    first_answered = None
+
+    async def source():
+        yield {"chunk_id": "a", "content": "fast"}
+        # the next file is only "parsed" once the first chunk has been answered
+        for _ in range(100):
+            if ("answer", "fast-q0") in events:
+                break
+            await asyncio.sleep(0.01)
+        nonlocal first_answered
+        first_answered = ("answer", "fast-q0") in events
+        yield {"chunk_id": "b", "content": "other"}
+
+    dataset = asyncio.run(builder.build_dataset(source()))
+
+    assert first_answered
+    assert [item["question"] for item in dataset] == ["fast-q0", "fast-q1", "other-q0", "other-q1"]
+
+
+def test_incremental_build_only_generates_changed_chunks(tmp_path):
+    paths = {}
+    for name, text in (("a", "alpha"), ("b", "beta"), ("c", "gamma")):
+        paths[name] = str(tmp_path / f"{name}.txt")
+        with open(paths[name], "w", encoding="utf-8") as f:
+            f.write(text)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    def build(files):
+        events = []
+        manifest = BuildManifest(manifest_path).load()
+        dataset = asyncio.run(_builder(events).build_incremental(files, manifest))
+        return dataset, [context for kind, context in events if kind == "questions"]
+
+    first, generated = build([paths["a"], paths["b"]])
+    assert generated == ["alpha", "beta"]
+
+    with open(paths["b"], "w", encoding="utf-8") as f:
+        f.write("beta v2")
+    second, generated = build([paths["b"], paths["c"]])
+
+    assert sorted(generated) == ["beta v2", "gamma"]
+    assert [item["question"] for item in second] == ["beta v2-q0", "beta v2-q1", "gamma-q0", "gamma-q1"]
+
+    third, generated = build([paths["b"], paths["c"]])
+    assert generated == []
+    assert third == second
+
+
+def test_incremental_build_reuses_sections_after_an_earlier_one_is_removed(tmp_path):
+    from app.core.document import DocumentProcessor
+
+    path = str(tmp_path / "guide.md")
+    manifest_path = str(tmp_path / "manifest.json")
+    processor = DocumentProcessor()
+    processor.chunk_min_len = 20
+
+    def build(sections):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("".join(f"# Section {i}\n\n" + f"Body of section {i}. " * 3 + "\n\n" for i in sections))
+        events = []
+        manifest = BuildManifest(manifest_path).load()
+        dataset = asyncio.run(_builder(events).build_incremental([path], manifest, processor=processor))
+        return dataset, [context for kind, context in events if kind == "questions"]
+
+    first, generated = build(range(4))
+    assert len(generated) == 4
+
+    # removing the first section shifts every positional chunk_id, but no content changed
+    second, generated = build(range(1, 4))
+    assert generated == []
+    assert [item["question"] for item in second] == [item["question"] for item in first[2:]]
+    assert [item["chunk_id"] for item in second] == ["guide_part_1"] * 2 + ["guide_part_2"] * 2 + ["guide_part_3"] * 2
+
+    # editing a middle section regenerates only that section
+    third, generated = build([1, 5, 3])
+    assert generated == ["Body of section 5. " * 2 + "Body of section 5."]
+    assert [item["chunk_id"] for item in third][::2] == ["guide_part_1", "guide_part_2", "guide_part_3"]
+
+
+def test_near_duplicate_chunks_are_skipped_before_question_generation():
+    events = []
+    builder = _builder(events)
+    builder.chunk_dedup = True
+    page = "".join(f"第{i}段的正文内容，用于测试重复检测。" for i in range(40))
+    chunks = [
+        {"chunk_id": "a", "content": page},
+        {"chunk_id": "b", "content": "完全不同的一段文字。" * 30},
+        {"chunk_id": "c", "content": page.replace("第3段", "第三段")},
+        {"chunk_id": "d", "content": "  " + page.upper() + "\n"},
+    ]
+
+    dataset = asyncio.run(builder.build_dataset(chunks))
+
+    assert [event[1] for event in events if event[0] == "questions"] == [chunks[0]["content"], chunks[1]["content"]]
+    assert {item["chunk_id"] for item in dataset} == {"a", "b"}
+    skipped = builder.last_dedup.skipped
+    assert [(s["chunk_id"], s["duplicate_of"]) for s in skipped] == [("c", "a"), ("d", "a")]
+    assert skipped[1]["similarity"] == 1.0 and skipped[0]["similarity"] >= 0.85
+
+
+def test_chunk_dedup_runs_off_the_event_loop(monkeypatch):
+    import threading
+
+    from app.core.dedup import ChunkDeduplicator
+
+    threads = []
+    check = ChunkDeduplicator.check
+
+    def recording_check(self, index, chunk):
+        threads.append(threading.current_thread())
+        return check(self, index, chunk)
+
+    monkeypatch.setattr(ChunkDeduplicator, "check", recording_check)
+    builder = _builder([])
+    builder.chunk_dedup = True
+    chunks = [{"chunk_id": "a", "content": "fast"}, {"chunk_id": "b", "content": "slow"}]
+
+    assert len(asyncio.run(builder.build_dataset(chunks))) == 4
+    # signatures are computed in a worker thread, not on the loop serving LLM calls
+    assert len(threads) == 2 and threading.main_thread() not in threads
+
+
+def test_incremental_build_regenerates_duplicate_when_its_original_is_removed(tmp_path):
+    page = "".join(f"第{i}段的正文内容，用于测试重复检测。" for i in range(40))
+    paths = [str(tmp_path / "a.txt"), str(tmp_path / "b.txt")]
+    for path in paths:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(page)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    def build(files):
+        events = []
+        builder = _builder(events)
+        builder.chunk_dedup = True
+        dataset = asyncio.run(builder.build_incremental(files, BuildManifest(manifest_path).load()))
+        return dataset, [context for kind, context in events if kind == "questions"]
+
+    first, generated = build(paths)
+    assert len(generated) == 1 and {item["file"] for item in first} == {paths[0]}
+    assert build(paths) == (first, [])
+
+    # with the original gone, the duplicate's content must come back instead of staying empty
+    second, generated = build(paths[1:])
+    assert len(generated) == 1
+    assert {item["file"] for item in second} == {paths[1]}
+
+
+def test_incremental_build_keeps_questions_merged_into_another_chunk(tmp_path):
+    paths = {}
+    for name in ("a", "b", "c"):
+        paths[name] = str(tmp_path / f"{name}.txt")
+        with open(paths[name], "w", encoding="utf-8") as f:
+            f.write(f"section {name}")
+    manifest_path = str(tmp_path / "manifest.json")
+    shared = "What does every section have in common?"
+
+    def build(files):
+        events = []
+        builder = _builder(events)
+        builder.question_dedup = True
+
+        async def questions(context, number=5):
+            events.append(("questions", context))
+            return [shared, f"What is in {context}?"]
+
+        builder._generate_questions = questions
+        dataset = asyncio.run(builder.build_incremental(files, BuildManifest(manifest_path).load()))
+        return dataset, [context for kind, context in events if kind == "questions"]
+
+    first, _ = build([paths["a"], paths["b"]])
+    owners = [item["file"] for item in first if item["question"] == shared]
+    assert len(owners) == 1
+    other = paths["b"] if owners[0] == paths["a"] else paths["a"]
+
+    # a new chunk is deduplicated against the questions of reused chunks
+    second, generated = build([paths["a"], paths["b"], paths["c"]])
+    assert generated == ["section c"]
+    assert [item["question"] for item in second].count(shared) == 1
+
+    # once the chunk that kept the shared question is gone, the other chunk is regenerated with it
+    third, generated = build([other])
+    assert generated == [open(other, encoding="utf-8").read()]
+    assert shared in [item["question"] for item in third]
+
+
+def test_near_duplicate_questions_across_chunks_are_answered_once():
+    events = []
+    builder = _builder(events)
+    builder.question_dedup = True
+    builder.enable_optimize = True
+
+    async def fake_questions(context, number=5):
+        return {"a": ["什么是注意力机制？", "Transformer 由哪些部分组成？"],
+                "b": ["什么是注意力机制?", "BERT 的预训练任务有哪些？"]}[context]
+
+    async def fake_optimize(answer):
+        return answer
+
+    builder._generate_questions = fake_questions
+    builder._optimize_answer = fake_optimize
+    chunks = [{"chunk_id": "a", "content": "a"}, {"chunk_id": "b", "content": "b"}]
+
+    dataset = asyncio.run(builder.build_dataset(chunks))
+
+    assert [item["question"] for item in dataset] == [
+        "什么是注意力机制？", "Transformer 由哪些部分组成？", "BERT 的预训练任务有哪些？"]
+    assert len([event for event in events if event[0] == "answer"]) == 3
+    stats = builder.last_question_dedup.stats(builder._calls_per_question())
+    assert stats == {"kept": 3, "skipped": 1, "saved_calls": 2}
+
+
+def test_fused_mode_uses_one_call_and_falls_back_per_missing_field():
+    events = []
+    builder = _builder(events)
+    builder.fused_generation = True
+    builder.enable_cot = True
+    builder.enable_label = True
+    replies = {
+        "ok-q0": '```json\n{"answer": "fused answer", "cot": "step by step", "labels": ["AI"]}\n```',
+        "ok-q1": 'Sure! {"answer": "second", "cot": "why", "labels": "NLP"}',
+        "bad-q0": '{"answer": "only an answer", "cot": ""}',
+        "bad-q1": "not json at all",
+    }
+
+    async def fake_llm(prompt, **kwargs):
+        question = next(q for q in replies if f"\n{q}\n" in prompt)
+        events.append(("fused", question))
+        return {"choices": [{"message": {"content": replies[question]}}]}
+
+    async def fake_cot(question):
+        events.append(("cot", question))
+        return "separate cot"
+
+    async def fake_labels(question):
+        events.append(("labels", question))
+        return ["separate"]
+
+    builder.llm.call_llm_advanced = fake_llm
+    builder._generate_cot = fake_cot
+    builder._generate_labels = fake_labels
+    chunks = [{"chunk_id": "a", "content": "ok"}, {"chunk_id": "b", "content": "bad"}]
+
+    dataset = {item["question"]: item for item in asyncio.run(builder.build_dataset(chunks))}
+
+    assert (dataset["ok-q0"]["answer"], dataset["ok-q0"]["cot"], dataset["ok-q0"]["labels"]) == \
+        ("fused answer", "step by step", ["AI"])
+    assert dataset["ok-q1"]["labels"] == ["NLP"]
+    assert (dataset["bad-q0"]["answer"], dataset["bad-q0"]["cot"]) == ("only an answer", "separate cot")
+    assert dataset["bad-q1"]["answer"] == "answer to bad-q1"
+    separate = sorted(event for event in events if event[0] in ("answer", "cot", "labels"))
+    assert separate == [("answer", "bad-q1"), ("cot", "bad-q0"), ("cot", "bad-q1"),
+                        ("labels", "bad-q0"), ("labels", "bad-q1")]
+
+
+def test_batched_answers_share_one_call_and_fall_back_per_question():
+    events = []
+    builder = _builder(events)
+    builder.answer_batch_size = 8
+
+    async def fake_questions(context, number=5):
+        return ["Q1", "Q2", "Q3"]
+
+    async def fake_llm(prompt, **kwargs):
+        events.append(("batch", prompt.count("the chunk text")))
+        return {"choices": [{"message": {"content": (
+            '[{"id": 2, "answer": "A2"}, {"id": 1, "answer": "A1"}, {"id": 3, "answer": ""}]'
+        )}}]}
+
+    builder._generate_questions = fake_questions
+    builder.llm.call_llm_advanced = fake_llm
+
+    dataset = asyncio.run(builder.build_dataset([{"chunk_id": "a", "content": "the chunk text"}]))
+
+    assert [(item["question"], item["answer"]) for item in dataset] == [
+        ("Q1", "A1"), ("Q2", "A2"), ("Q3", "answer to Q3")]
+    # the context is sent once for the whole batch; only the unparsed question is answered separately
+    assert events == [("batch", 1), ("answer", "Q3")]
+
+
+def test_sibling_prompts_share_prefix_and_wait_for_warmup():
+    builder = _builder([])
+    builder.prompt_cache_warmup = True
+    prompts = []
+    in_flight = []
+
+    async def fake_questions(context, number=5):
+        return ["Q1", "Q2", "Q3"]
+
+    async def fake_llm(prompt, **kwargs):
+        in_flight.append(prompt)
+        await asyncio.sleep(0.05 if not prompts else 0)
+        prompts.append((len(in_flight), prompt))
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    builder._generate_questions = fake_questions
+    builder._generate_answer = DatasetBuilder._generate_answer.__get__(builder)
+    builder.llm.call_llm_advanced = fake_llm
+
+    asyncio.run(builder.build_dataset([{"chunk_id": "a", "content": "the chunk text"}]))
+
+    # the first sibling runs alone; the others are released once it returns
+    assert [count for count, _ in prompts][0] == 1
+    # instructions and chunk context form an identical prefix; only the trailing question differs
+    texts = [prompt for _, prompt in prompts]
+    prefixes = {text[:text.rindex("Q")] for text in texts}
+    assert len(prefixes) == 1 and "the chunk text" in prefixes.pop()
+    assert sorted(text.strip().splitlines()[-1] for text in texts) == ["Q1", "Q2", "Q3"]
+
+
+def test_batch_mode_runs_stages_as_waves_and_joins_by_custom_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "BATCH_DIR", str(tmp_path / "work"))
+    monkeypatch.setattr(config, "BATCH_POLL_INTERVAL", 0)
+    waves = []
+    failures = {"answer to beta-q0": 1}
+
+    def handler(body):
+        prompt = body["messages"][-1]["content"]
+        if "Role Mission" in prompt:
+            stage, text = "questions", json.dumps([f"{prompt.split('ctx:')[1].split()[0]}-q{i}" for i in range(2)])
+        elif "COT Optimization" in prompt:
+            stage, text = "optimize", "better " + prompt.split("## Original COT:")[1].split("\n")[1]
+        elif "Answer Optimization" in prompt:
+            stage, text = "optimize", "better " + prompt.split("## Original Answer:")[1].split("\n")[1]
+        elif "Chain-of-Thought" in prompt:
+            stage, text = "cot", "<think>because</think>"
+        else:
+            stage, text = "answer", "answer to " + prompt.rstrip().splitlines()[-1]
+        if failures.get(text):
+            failures[text] -= 1
+            raise RuntimeError("replica lost")
+        waves.append(stage)
+        return {"choices": [{"message": {"content": text}}], "usage": {"prompt_tokens": 10, "completion_tokens": 2}}
+
+    builder = DatasetBuilder()
+    builder.language = "English"
+    builder.enable_cot, builder.enable_label, builder.enable_optimize = True, False, True
+    builder.batch_transport = transport = LocalBatchTransport(str(tmp_path / "remote"), handler)
+    chunks = [{"chunk_id": "a", "content": "ctx: alpha"}, {"chunk_id": "b", "content": "ctx: beta"}]
+
+    dataset = asyncio.run(builder.build_dataset(chunks, mode="batch"))
+
+    assert [(item["question"], item["answer"]) for item in dataset] == [
+        ("alpha-q0", "better answer to alpha-q0"), ("alpha-q1", "better answer to alpha-q1"),
+        ("beta-q0", "better answer to beta-q0"), ("beta-q1", "better answer to beta-q1")]
+    assert all("because" in item["cot"] for item in dataset)
+    # questions, then answers + CoT, then the failed answer is retried alongside the first optimizations
+    assert len(transport.submitted) == 4
+    assert waves == (["questions"] * 2 + ["answer", "cot", "answer", "cot", "cot", "answer", "cot"]
+                     + ["answer"] + ["optimize"] * 8)
+    assert builder.llm.stats()["usage"]["requests"] == 18
+
+    # a rerun joins the stored results without submitting anything new
+    builder.batch_transport = rerun = LocalBatchTransport(str(tmp_path / "remote"), handler)
+    assert asyncio.run(builder.build_dataset(chunks, mode="batch")) == dataset
+    assert rerun.submitted == []
+
+
+def test_build_stops_when_error_budget_is_exhausted(monkeypatch):
+    from app.core.circuit import ErrorBudgetExceeded
+    from app.core.endpoints import Endpoint, EndpointPool
+    from app.core.llm import AsyncLLM
+
+    monkeypatch.setattr(config, "LLM_CIRCUIT_MAX_WAIT", 0)
+    monkeypatch.setattr(config, "LLM_ERROR_BUDGET", 0.5)
+    monkeypatch.setattr(config, "LLM_ERROR_BUDGET_MIN_CALLS", 2)
+    builder = DatasetBuilder()
+    builder.llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                           transport=httpx.MockTransport(lambda request: httpx.Response(503, text="down")),
+                           pool=EndpointPool([Endpoint("http://llm.test/v1", "k", "m")], failure_threshold=1))
+    chunks = [{"chunk_id": str(i), "content": f"chunk {i}"} for i in range(20)]
+
+    with pytest.raises(ErrorBudgetExceeded):
+        asyncio.run(builder.build_dataset(chunks))
+    # the build aborts instead of filling the dataset with placeholder answers
+    assert builder.llm.error_budget.calls < len(chunks)
+
+
+def test_build_stops_when_answer_stage_exhausts_error_budget(monkeypatch):
+    from app.core.circuit import ErrorBudgetExceeded
+    from app.core.endpoints import Endpoint, EndpointPool
+    from app.core.llm import AsyncLLM
+
+    monkeypatch.setattr(config, "LLM_CIRCUIT_MAX_WAIT", 0)
+    monkeypatch.setattr(config, "LLM_ERROR_BUDGET", 0.5)
+    monkeypatch.setattr(config, "LLM_ERROR_BUDGET_MIN_CALLS", 2)
+    builder = _builder([])
+    del builder._generate_answer
+
+    async def many_questions(context, number=5):
+        return [f"{context}-q{i}" for i in range(100)]
+
+    builder._generate_questions = many_questions
+    builder.llm = AsyncLLM(model_name="m", base_url="http://llm.test/v1", api_key="k",
+                           transport=httpx.MockTransport(lambda request: httpx.Response(503, text="down")),
+                           pool=EndpointPool([Endpoint("http://llm.test/v1", "k", "m")], failure_threshold=1))
+    # questions keep succeeding and fill the answer queue, so question workers block instead of failing
+    chunks = [{"chunk_id": str(i), "content": f"chunk {i}"} for i in range(20)]
+
+    with pytest.raises(ErrorBudgetExceeded):
+        asyncio.run(asyncio.wait_for(builder.build_dataset(chunks), timeout=10))
+
+
+def test_iter_dataset_yields_items_without_content():
+    builder = _builder([])
+    chunks = [{"chunk_id": "a", "content": "fast"}, {"chunk_id": "b", "content": "slow"}]
+
+    async def collect():
+        return [item async for item in builder.iter_dataset(chunks, include_content=False)]
+
+    items = asyncio.run(collect())
+    assert sorted(item["question"] for item in items) == ["fast-q0", "fast-q1", "slow-q0", "slow-q1"]
+    assert all("content" not in item for item in items)
+
+
+def test_export_dataset_streams_all_formats_in_one_pass(tmp_path):
+    builder = _builder([])
+    consumed = []
+
+    def items():
+        for i in range(3):
+            consumed.append(i)
+            yield {"question": f"q{i}", "answer": f"a{i}"}
+
+    builder.export_dataset(items(), str(tmp_path), ["alpaca", "sharegpt"], "jsonl")
+
+    assert consumed == [0, 1, 2]
+    with open(tmp_path / "dataset-alpaca.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["instruction"] for line in f] == ["q0", "q1", "q2"]
+    with open(tmp_path / "dataset-sharegpt.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) == 3
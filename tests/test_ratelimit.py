@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from app.core.ratelimit import RateLimiter, parse_duration
+
+
+def test_parse_duration():
+    assert parse_duration("2") == 2.0
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("1h2m3s") == 3723.0
+    assert parse_duration("soon") is None
+    assert parse_duration(None) is None
+
+
+def test_token_budget_throttles_requests():
+    # 60000 tokens/min = 1000 tokens/s; the second request must wait ~0.2s
+    limiter = RateLimiter(tpm=60000)
+    limiter.tokens.tokens = 100
+
+    async def run():
+        start = time.monotonic()
+        await limiter.acquire(100)
+        await limiter.acquire(200)
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    assert 0.15 <= elapsed < 1.0
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_headers_adopt_server_limits():
+    limiter = RateLimiter()
+    assert not limiter.enabled
+    retry_after = limiter.update_from_headers({
+        "retry-after": "3",
+        "x-ratelimit-limit-requests": "600",
+        "x-ratelimit-remaining-requests": "10",
+    })
+    assert retry_after == 3.0
+    assert limiter.requests.capacity == 600
+    assert limiter.requests.tokens <= 10
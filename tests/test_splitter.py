@@ -0,0 +1,46 @@
+from app.core.splitter import MarkdownSplitter
+from app.services.dataset_service import TextSplitter
+
+
+DOC = """前言。
+
+# 第一章
+## 1.1
+### 1.1.1
+#### 跳级标题
+## 1.2 {#sec-1-2}
+# 第二章
+### 缺少二级
+## 1.1
+"""
+
+
+def test_outline_paths_follow_legacy_parent_lookup():
+    outline = MarkdownSplitter.extract_outline(DOC)
+    assert [item["path"] for item in outline] == [
+        "第一章",
+        "第一章 > 1.1",
+        "第一章 > 1.1 > 1.1.1",
+        "第一章 > 1.1 > 1.1.1 > 跳级标题",
+        "第一章 > 1.2",
+        "第二章",
+        # parents are looked up by exact level, skipping over the intervening top-level heading
+        "第一章 > 1.2 > 缺少二级",
+        # duplicate headings share the path of their first occurrence
+        "第一章 > 1.1",
+    ]
+
+    splitter = MarkdownSplitter(0, 1000)
+    sections = splitter.split_by_headings(DOC, outline)
+    assert splitter.summarize(dict(sections[0], content=""), outline) == "第一章 前言"
+    assert splitter.summarize(sections[4], outline) == "第一章 > 1.1 > 1.1.1 > 跳级标题"
+
+
+def test_service_and_processor_share_the_engine():
+    text = "# Title\n\n" + "Some sentence here. " * 40 + "\n\n## Short\n\nok."
+    outline = TextSplitter.extract_outline(text)
+    chunks = TextSplitter.split_sections(TextSplitter.split_by_headings(text, outline), outline, 50, 300)
+    expected = MarkdownSplitter(50, 300).split(text)
+    assert [c["content"] for c in chunks] == [c["content"] for c in expected]
+    assert all(set(c) == {"summary", "content"} for c in chunks)
+    assert TextSplitter.generate_summary({"heading": None, "level": 0, "content": ""}, outline) == "Title Introduction"
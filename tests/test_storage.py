@@ -0,0 +1,34 @@
+import json
+import os
+
+from app.core.storage import StreamingJSONWriter, write_records
+
+
+def test_json_output_matches_json_dump(tmp_path):
+    data = [{"q": "多行\n问题", "nested": {"a": [1, 2]}}, {"q": "second"}]
+    path = str(tmp_path / "out.json")
+    assert write_records(path, iter(data), "json") == 2
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == json.dumps(data, ensure_ascii=False, indent=2)
+
+    empty = str(tmp_path / "empty.json")
+    write_records(empty, [], "json")
+    with open(empty, encoding="utf-8") as f:
+        assert json.load(f) == []
+
+
+def test_failed_write_leaves_previous_file_untouched(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    write_records(path, [{"v": 1}], "jsonl")
+
+    def broken():
+        yield {"v": 2}
+        raise RuntimeError("boom")
+
+    try:
+        write_records(path, broken(), "jsonl")
+    except RuntimeError:
+        pass
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [{"v": 1}]
+    assert not os.path.exists(path + ".tmp")
@@ -42,6 +42,20 @@ def generate_task_id() -> str:
     random_str = hashlib.md5(timestamp.encode()).hexdigest()[:8]
     return f"task_{timestamp}_{random_str}"
 
+def input_set_digest(file_paths: List[str]) -> str:
+    """按文件内容计算一组输入文件的哈希，与文件顺序和上传路径无关；文件无法读取时以路径代替"""
+    digests = []
+    for file_path in file_paths:
+        digest = hashlib.sha256()
+        try:
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        except OSError:
+            digest.update(str(file_path).encode('utf-8'))
+        digests.append(digest.hexdigest())
+    return hashlib.sha256("\n".join(sorted(digests)).encode('utf-8')).hexdigest()[:16]
+
 def validate_file_format(file_path: str, supported_formats: List[str]) -> bool:
     """验证文件格式"""
     if not file_path:
@@ -8,6 +8,7 @@ FastDatasets Web Interface
 import os
 import sys
 import json
+import asyncio
 import threading
 import time
 import argparse
@@ -39,7 +40,7 @@ except ImportError as e:
 # 导入Web模块
 from config import web_config
 from utils import (
-    format_file_size, format_duration, generate_task_id,
+    format_file_size, format_duration, generate_task_id, input_set_digest,
     validate_file_format, get_file_info, format_status_message,
     format_results_summary, clean_old_tasks, save_task_state,
     load_task_state, validate_config
@@ -78,7 +79,7 @@ def recover_zombie_tasks():
             logger.warning(f"发现僵尸任务 {task_id}，运行时间: {elapsed}，将标记为失败")
             status_manager.fail_task(
                 task_id, 
-                f"任务超时（运行 {int(elapsed.total_seconds()//60)} 分钟）"
+                f"任务超时（运行 {int(elapsed.total_seconds()//60)} 分钟），重新提交相同文件将从检查点继续"
             )
 
 # 启动时执行恢复
@@ -273,77 +274,111 @@ class WebInterface:
             
             results = []
             total_files = len(files)
+            loop = asyncio.get_running_loop()
             
-            for i, file_path in enumerate(files):
-                logger.info(f"处理文件 {i+1}/{total_files}: {Path(file_path).name}")
-                
-                # 更新当前处理文件
-                try:
-                    status_manager.update_task(task_id,
-                        current_file=Path(file_path).name,
-                        progress=int((i / total_files) * 30),  # 文档处理占30%
-                        stage_progress=int((i / total_files) * 100),
-                        message=f"正在处理文档 {i+1}/{total_files}: {Path(file_path).name}"
-                    )
-                    logger.info(f"文件状态更新完成 - 任务ID: {task_id}")
-                except Exception as status_error:
-                    logger.error(f"状态更新失败: {status_error}")
-                
-                try:
-                    # 处理单个文件
-                    logger.info(f"开始处理文档: {file_path}")
-                    result = self.doc_processor.process_document(file_path)
-                    logger.info(f"文档处理完成，得到 {len(result) if result else 0} 个文档块")
+            async def stream_chunks():
+                """逐个解析文件，文档块一产出就交给生成流水线，后续文件的解析与问答生成同时进行"""
+                for i, file_path in enumerate(files):
+                    logger.info(f"处理文件 {i+1}/{total_files}: {Path(file_path).name}")
                     
-                    if result:
-                        results.extend(result)
-                    
-                    # 更新已处理文件数
+                    # 更新当前处理文件
                     try:
-                        status_manager.update_task(task_id, processed_files=i + 1)
-                        logger.info(f"已处理文件数更新: {i + 1}")
+                        status_manager.update_task(task_id,
+                            current_file=Path(file_path).name,
+                            progress=int((i / total_files) * 30),  # 文档处理占30%
+                            stage_progress=int((i / total_files) * 100),
+                            message=f"正在处理文档 {i+1}/{total_files}: {Path(file_path).name}"
+                        )
+                        logger.info(f"文件状态更新完成 - 任务ID: {task_id}")
                     except Exception as status_error:
-                        logger.error(f"已处理文件数更新失败: {status_error}")
-                        
-                except Exception as e:
-                    logger.error(f"处理文件 {file_path} 失败: {e}")
-                    import traceback
-                    logger.error(f"详细错误信息: {traceback.format_exc()}")
+                        logger.error(f"状态更新失败: {status_error}")
                     
                     try:
-                        status_manager.update_task(task_id, 
-                            message=f"处理文件 {Path(file_path).name} 失败: {str(e)}"
-                        )
-                    except Exception as status_error:
-                        logger.error(f"错误状态更新失败: {status_error}")
-            
-            logger.info(f"文档处理完成，共得到 {len(results)} 个文档块")
-            
-            # 阶段2: 生成数据集
-            if results:
-                total_chunks = len(results)
-                logger.info(f"开始生成数据集，共 {total_chunks} 个文档块")
+                        # 在后台线程中处理单个文件，避免阻塞正在进行的 LLM 请求
+                        logger.info(f"开始处理文档: {file_path}")
+                        result = await loop.run_in_executor(None, self.doc_processor.process_document, file_path)
+                        logger.info(f"文档处理完成，得到 {len(result) if result else 0} 个文档块")
+                        
+                        if result:
+                            results.extend(result)
+                        
+                        # 更新已处理文件数
+                        try:
+                            status_manager.update_task(task_id, processed_files=i + 1, total_chunks=len(results))
+                            logger.info(f"已处理文件数更新: {i + 1}")
+                        except Exception as status_error:
+                            logger.error(f"已处理文件数更新失败: {status_error}")
+                            
+                    except Exception as e:
+                        logger.error(f"处理文件 {file_path} 失败: {e}")
+                        import traceback
+                        logger.error(f"详细错误信息: {traceback.format_exc()}")
+                        
+                        try:
+                            status_manager.update_task(task_id, 
+                                message=f"处理文件 {Path(file_path).name} 失败: {str(e)}"
+                            )
+                        except Exception as status_error:
+                            logger.error(f"错误状态更新失败: {status_error}")
+                        continue
+                    
+                    for chunk in result or []:
+                        yield chunk
                 
-                # 阶段2.1: 生成问题
+                logger.info(f"文档处理完成，共得到 {len(results)} 个文档块")
                 try:
                     status_manager.update_task(
                         task_id,
-                        stage="生成问题",
-                        message=f"正在为 {total_chunks} 个文档块生成问题...",
-                        progress=35,
-                        stage_progress=0,
-                        total_chunks=total_chunks,
-                        processed_chunks=0
+                        stage="生成答案",
+                        message="文档解析完成，正在生成剩余问答对...",
+                        progress=60,
+                        stage_progress=0
                     )
-                    logger.info(f"生成问题阶段状态更新完成")
                 except Exception as status_error:
-                    logger.error(f"生成问题阶段状态更新失败: {status_error}")
+                    logger.error(f"生成答案阶段状态更新失败: {status_error}")
+            
+            output_path = Path(output_dir)
+            output_path.mkdir(parents=True, exist_ok=True)
+            logger.info(f"输出目录已创建: {output_path}")
+            
+            # 检查点按输入文件内容区分，任务中断后重新提交相同文件会复用已完成的问答对，
+            # 不同的任务不会共用同一个检查点
+            checkpoint_dir = output_path / "checkpoints"
+            checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            input_digest = await loop.run_in_executor(None, input_set_digest, files)
+            checkpoint_file = checkpoint_dir / f"{input_digest}.jsonl"
+            
+            # 阶段2: 生成数据集（与文档解析同时进行）
+            qa_pairs = []
+            built = False
+            dataset_generator = DatasetBuilder()
+            try:
+                logger.info(f"开始生成问答对...")
+                try:
+                    qa_pairs = await dataset_generator.build_dataset(
+                        stream_chunks(),
+                        resume=True,
+                        checkpoint_path=str(checkpoint_file)
+                    )
+                finally:
+                    await dataset_generator.aclose()
+                built = True
+                logger.info(f"问答对生成完成，共 {len(qa_pairs)} 个")
                 
-                # 导出数据集
-                output_path = Path(output_dir)
-                output_path.mkdir(parents=True, exist_ok=True)
-                logger.info(f"输出目录已创建: {output_path}")
+            except Exception as e:
+                logger.error(f"生成问答对失败: {e}")
+                import traceback
+                logger.error(f"详细错误信息: {traceback.format_exc()}")
                 
+                try:
+                    status_manager.update_task(
+                        task_id,
+                        message=f"生成问答对失败: {str(e)}"
+                    )
+                except Exception as status_error:
+                    logger.error(f"问答对失败状态更新失败: {status_error}")
+            
+            if results:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 
                 # 保存原始数据
@@ -355,53 +390,18 @@ class WebInterface:
                 except Exception as e:
                     logger.error(f"保存原始数据失败: {e}")
                 
-                # 生成问答对
-                qa_pairs = []
+                # 阶段2.3: 保存结果
                 try:
-                    # 阶段2.2: 生成答案
-                    try:
-                        status_manager.update_task(
-                            task_id,
-                            stage="生成答案",
-                            message="正在生成问题答案...",
-                            progress=60,
-                            stage_progress=0
-                        )
-                        logger.info(f"生成答案阶段状态更新完成")
-                    except Exception as status_error:
-                        logger.error(f"生成答案阶段状态更新失败: {status_error}")
-                    
-                    # 初始化 DatasetBuilder
-                    logger.info(f"开始生成问答对...")
-                    dataset_generator = DatasetBuilder()
-                    qa_pairs = await dataset_generator.build_dataset(results)
-                    logger.info(f"问答对生成完成，共 {len(qa_pairs)} 个")
-                    
-                    # 阶段2.3: 保存结果
-                    try:
-                        status_manager.update_task(
-                            task_id,
-                            stage="保存结果",
-                            message="正在保存结果...",
-                            progress=85,
-                            stage_progress=0
-                        )
-                        logger.info(f"保存结果阶段状态更新完成")
-                    except Exception as status_error:
-                        logger.error(f"保存结果阶段状态更新失败: {status_error}")
-                    
-                except Exception as e:
-                    logger.error(f"生成问答对失败: {e}")
-                    import traceback
-                    logger.error(f"详细错误信息: {traceback.format_exc()}")
-                    
-                    try:
-                        status_manager.update_task(
-                            task_id,
-                            message=f"生成问答对失败: {str(e)}"
-                        )
-                    except Exception as status_error:
-                        logger.error(f"问答对失败状态更新失败: {status_error}")
+                    status_manager.update_task(
+                        task_id,
+                        stage="保存结果",
+                        message="正在保存结果...",
+                        progress=85,
+                        stage_progress=0
+                    )
+                    logger.info(f"保存结果阶段状态更新完成")
+                except Exception as status_error:
+                    logger.error(f"保存结果阶段状态更新失败: {status_error}")
                 
                 # 阶段3: 导出文件
                 try:
@@ -438,6 +438,13 @@ class WebInterface:
                             logger.warning(f"导出文件不存在: {file_path}")
                     
                     logger.info(f"数据集已导出到: {output_path}")
+                    
+                    # 构建和导出都成功后不再需要恢复，删除检查点；构建失败时保留，供重新提交时继续
+                    if built:
+                        try:
+                            checkpoint_file.unlink()
+                        except FileNotFoundError:
+                            pass
                 except Exception as e:
                     logger.error(f"导出数据集失败: {e}")
                     import traceback